@@ -2,24 +2,54 @@
 
 import os
 
+import click
 from flask import Flask, jsonify
-from flask_smorest import Api
-from flask_jwt_extended import JWTManager
-from flask_migrate import Migrate
+from flask.cli import ScriptInfo
 
 from exceptions import ApiErrorException
 from resources.items import blp as ItemsBlueprint
 from resources.stores import blp as StoresBlueprint
 from resources.tags import blp as TagsBlueprint
 from resources.users import blp as UsersBlueprint
+from resources.admin import blp as AdminBlueprint
+from resources.search import blp as SearchBlueprint
 from db import db
-from blocklist import BLOCKLIST
+from replicas import replica_router
+from blocklist import blocklist
+from cache import response_cache
+from compression import compressor
+from ratelimit import rate_limiter
+from passwords import password_hasher
+from stats import store_stats
+from search import search_index
+from jobs import jobs
+from instrumentation import (
+    init_query_counter,
+    init_request_instrumentation,
+    engine_options,
+    token_verified
+)
+from serializers import OrjsonProvider, TimedJSONProvider
+from profiling import request_profiler
+from openapi import LazyApi
+from tokens import CachingJWTManager, token_cache
+
+
+def running_flask_cli() -> bool:
+    """Whether the app is being loaded by the `flask` command"""
+    context = click.get_current_context(silent=True)
+    return context is not None and context.find_object(ScriptInfo) is not None
 
 
 def create_app(db_url=None):
     """Create Flask App"""
 
     app = Flask(__name__)
+    # Responses are encoded with orjson unless JSON_ENCODER=default
+    if os.getenv("JSON_ENCODER", "orjson") == "orjson":
+        app.json = OrjsonProvider(app)
+    else:
+        app.json = TimedJSONProvider(app)
 
     # Flask config that says that if there's an exception that occurs hidden inside an
     # extension of flask,to propagate it into the main app so that we can see it
@@ -36,19 +66,50 @@ def create_app(db_url=None):
         "sqlite:///data.db"
     )
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options(
+        app.config["SQLALCHEMY_DATABASE_URI"]
+    )
+    # Rows per INSERT/UPDATE statement on bulk endpoints
+    app.config["BULK_CHUNK_SIZE"] = int(os.getenv("BULK_CHUNK_SIZE", "500"))
+    # Stores with more items are deleted by a background job, 0 never does
+    app.config["STORE_DELETE_BACKGROUND_ITEMS"] = int(
+        os.getenv("STORE_DELETE_BACKGROUND_ITEMS", "10000"))
+    # Skips creating the schema and, outside `flask` commands, Flask-Migrate.
+    # Run `flask db upgrade` when deploying instead
+    app.config["FAST_BOOT"] = os.getenv("FAST_BOOT", "0") == "1"
+    replica_router.init_app(app)
     db.init_app(app)
-    migrate = Migrate(app, db)
-    api = Api(app)
+    init_request_instrumentation(app)
+    request_profiler.init_app(app)
+    compressor.init_app(app)
+    rate_limiter.init_app(app)
+    init_query_counter(app)
+    blocklist.init_app(app)
+    response_cache.init_app(app)
+    password_hasher.init_app(app)
+    store_stats.init_app(app)
+    search_index.init_app(app)
+    jobs.init_app(app)
+    if not app.config["FAST_BOOT"] or running_flask_cli():
+        # Importing alembic takes longer than the rest of the app
+        from flask_migrate import Migrate  # pylint: disable=import-outside-toplevel
+        Migrate(app, db)
+    # Documents the blueprints on first use of the spec, see openapi.py
+    api = LazyApi(app)
 
     app.config["JWT_SECRET_KEY"] = os.getenv(
         "JWT_SECRET_KEY",
         "95088854782557170340987083085166124607"
     )
-    jwt = JWTManager(app)
+    # Memoizes verified tokens, see tokens.py
+    token_cache.init_app(app)
+    jwt = CachingJWTManager(app)
 
     @jwt.token_in_blocklist_loader
     def check_if_token_in_blocklist(jwt_header, jwy_payload):
-        return jwy_payload["jti"] in BLOCKLIST
+        revoked = blocklist.is_revoked(jwy_payload)
+        token_verified()
+        return revoked
 
     @jwt.revoked_token_loader
     def revoked_token_callback(jwt_header, jwt_payload):
@@ -70,12 +131,6 @@ def create_app(db_url=None):
             401
         )
 
-    @jwt.additional_claims_loader
-    def add_claims_to_jwt(identity):
-        if identity == 1:
-            return {"is_admin": True}
-        return {"is_admin": False}
-
     @jwt.expired_token_loader
     def expired_token_callback(jwt_header, jwt_payload):
         return (
@@ -106,13 +161,21 @@ def create_app(db_url=None):
             401
         )
 
-    with app.app_context():
-        db.create_all()
+    if not app.config["FAST_BOOT"]:
+        with app.app_context():
+            db.create_all()
+            search_index.create_all()
+            # Workers forked from a preloaded app (gunicorn --preload) must not
+            # share the connections opened here
+            for engine in db.engines.values():
+                engine.dispose()
 
     api.register_blueprint(ItemsBlueprint)
     api.register_blueprint(StoresBlueprint)
     api.register_blueprint(TagsBlueprint)
     api.register_blueprint(UsersBlueprint)
+    api.register_blueprint(AdminBlueprint)
+    api.register_blueprint(SearchBlueprint)
 
     @app.errorhandler(ApiErrorException)
     def handle_api_error(err: ApiErrorException):
@@ -124,6 +187,6 @@ def create_app(db_url=None):
             "detail": err.detail,
         }
 
-        return response, err.code
+        return response, err.code, err.headers
 
     return app
@@ -0,0 +1,161 @@
+"""ASGI entry point.
+
+Serve it with `uvicorn --factory asgi:create_asgi_app --workers 4`. The event
+loop reads request bodies and writes responses, so thousands of slow clients
+per process only cost a socket each. The Flask app runs on a pool of `ASGI_THREADS` threads
+(default: the size of the database connection pool plus its overflow) which
+are only busy while a request is actually handled.
+"""
+import asyncio
+import io
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from app import create_app
+
+# Response chunks buffered per request before the app thread waits for the
+# client to read them, so streamed responses keep a bounded memory use
+SEND_QUEUE_SIZE = 16
+
+
+class WsgiToAsgi:
+    """Runs a WSGI app on a thread pool behind an ASGI server"""
+
+    def __init__(self, wsgi_app, threads):
+        self.wsgi_app = wsgi_app
+        self.executor = ThreadPoolExecutor(
+            max_workers=threads, thread_name_prefix="asgi")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self.lifespan(receive, send)
+        elif scope["type"] == "http":
+            await self.http(scope, receive, send)
+
+    async def lifespan(self, receive, send):
+        """Handles server start up and shut down"""
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                self.executor.shutdown(wait=False)
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def http(self, scope, receive, send):
+        """Reads the request, runs the app on a thread and sends its response"""
+        body = bytearray()
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                return
+            body += message.get("body", b"")
+            if not message.get("more_body"):
+                break
+
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue(SEND_QUEUE_SIZE)
+        task = loop.run_in_executor(
+            self.executor, self.run_wsgi_app, scope, bytes(body), loop, queue)
+
+        client_connected = True
+        while True:
+            message = await queue.get()
+            if message is None:
+                break
+            if client_connected:
+                try:
+                    await send(message)
+                except Exception:  # pylint: disable=broad-except
+                    # Keep consuming so the app thread doesn't block
+                    client_connected = False
+        await task
+
+    def run_wsgi_app(self, scope, body, loop, queue):
+        """Runs the app (in a pool thread), queueing the response messages"""
+        def put(message):
+            asyncio.run_coroutine_threadsafe(queue.put(message), loop).result()
+
+        response_start = {}
+
+        def start_response(status, headers, exc_info=None):
+            if exc_info and response_start.get("sent"):
+                raise exc_info[1].with_traceback(exc_info[2])
+            response_start["message"] = {
+                "type": "http.response.start",
+                "status": int(status.split(" ", 1)[0]),
+                "headers": [
+                    (name.lower().encode("latin1"), value.encode("latin1"))
+                    for name, value in headers
+                ],
+            }
+            return lambda data: send_body(data, True)
+
+        def send_body(data, more_body):
+            if not response_start.get("sent"):
+                put(response_start["message"])
+                response_start["sent"] = True
+            put({"type": "http.response.body", "body": data, "more_body": more_body})
+
+        try:
+            result = self.wsgi_app(build_environ(scope, body), start_response)
+            try:
+                for data in result:
+                    if data:
+                        send_body(data, True)
+            finally:
+                if hasattr(result, "close"):
+                    result.close()
+            send_body(b"", False)
+        finally:
+            put(None)
+
+
+def build_environ(scope, body):
+    """WSGI environ of an ASGI http request"""
+    server = scope.get("server") or ("localhost", 80)
+    client = scope.get("client") or ("", 0)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", "").encode("utf8").decode("latin1"),
+        "PATH_INFO": scope["path"].encode("utf8").decode("latin1"),
+        "QUERY_STRING": scope["query_string"].decode("latin1"),
+        "SERVER_NAME": server[0],
+        "SERVER_PORT": str(server[1]),
+        "SERVER_PROTOCOL": f"HTTP/{scope['http_version']}",
+        "REMOTE_ADDR": client[0],
+        "REMOTE_PORT": str(client[1]),
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False,
+    }
+
+    for name, value in scope["headers"]:
+        name = name.decode("latin1")
+        value = value.decode("latin1")
+        if name == "content-type":
+            key = "CONTENT_TYPE"
+        elif name == "content-length":
+            key = "CONTENT_LENGTH"
+        else:
+            key = "HTTP_" + name.upper().replace("-", "_")
+        environ[key] = f"{environ[key]},{value}" if key in environ else value
+
+    return environ
+
+
+def create_asgi_app(db_url=None):
+    """Create the Flask App wrapped as an ASGI app"""
+    flask_app = create_app(db_url)
+    options = flask_app.config["SQLALCHEMY_ENGINE_OPTIONS"]
+    threads = int(os.getenv(
+        "ASGI_THREADS",
+        str(options.get("pool_size", 5) + options.get("max_overflow", 10))
+    ))
+    return WsgiToAsgi(flask_app, threads)
@@ -0,0 +1,270 @@
+"""Latency benchmark for every endpoint.
+
+Seeds a synthetic catalogue in a fresh SQLite database through
+`create_app(db_url=...)`, then drives each route in-process with the Flask test
+client and reports p50/p95/p99 latency, throughput and SQL queries per
+request. Results can be written as a JSON baseline and compared with a later
+run:
+
+    python benchmarks/endpoints.py --output baseline.json
+    python benchmarks/endpoints.py --compare baseline.json
+"""
+import argparse
+import itertools
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# pylint: disable=wrong-import-position
+from flask_jwt_extended import create_refresh_token
+from sqlalchemy import insert
+
+from app import create_app
+from db import db
+from models import StoreModel, ItemModel, TagModel, ItemsTagsModel
+from search import search_index
+from stats import store_stats
+from tokens import ADMIN, role_claims
+
+USERNAME = "benchmark"
+PASSWORD = "benchmark-password"
+
+
+def seed(app, args):
+    """Inserts the synthetic catalogue and returns the item/tag pairs of the
+    same store that are not linked"""
+    rng = random.Random(args.seed)
+    unlinked = []
+    with app.app_context():
+        db.session.execute(insert(StoreModel), [
+            {"id": store_id, "name": f"store-{store_id}"}
+            for store_id in range(1, args.stores + 1)
+        ])
+        item_id = 0
+        tag_id = 0
+        for store_id in range(1, args.stores + 1):
+            items = range(item_id + 1, item_id + args.items_per_store + 1)
+            tags = range(tag_id + 1, tag_id + args.tags_per_store + 1)
+            item_id, tag_id = items.stop - 1, tags.stop - 1
+
+            db.session.execute(insert(ItemModel), [
+                {
+                    "id": item, "name": f"item-{item}", "description": "synthetic",
+                    "price": round(rng.uniform(1, 100), 2), "store_id": store_id
+                }
+                for item in items
+            ])
+            db.session.execute(insert(TagModel), [
+                {"id": tag, "name": f"tag-{tag}", "store_id": store_id}
+                for tag in tags
+            ])
+
+            links = []
+            for pair in itertools.product(items, tags):
+                if rng.random() < args.tag_density:
+                    links.append({"item_id": pair[0], "tag_id": pair[1]})
+                else:
+                    unlinked.append(pair)
+            if links:
+                db.session.execute(insert(ItemsTagsModel), links)
+        # Rows inserted with core statements, index and summarize them
+        search_index.backend.rebuild()
+        store_stats.rebuild()
+        db.session.commit()
+
+    rng.shuffle(unlinked)
+    return unlinked
+
+
+def scenarios(app, client, args, unlinked):
+    """(name, request function) of every benchmarked route"""
+    rng = random.Random(args.seed)
+    client.post("/register", json={"username": USERNAME, "password": PASSWORD})
+    tokens = client.post(
+        "/login", json={"username": USERNAME, "password": PASSWORD}).json
+    auth = {"Authorization": f"Bearer {tokens['access_token']}"}
+
+    with app.app_context():
+        refresh_tokens = iter([
+            create_refresh_token(
+                identity="1", additional_claims=role_claims(ADMIN)) for _ in range(args.requests)
+        ])
+
+    items = args.stores * args.items_per_store
+    tags = args.stores * args.tags_per_store
+    new_items = itertools.count()
+    links = iter(unlinked[:args.requests])
+    unlinks = iter(unlinked[:args.requests])
+
+    def random_id(count):
+        return rng.randint(1, count)
+
+    def new_item():
+        return {
+            "name": f"new-item-{next(new_items)}",
+            "price": 9.99,
+            "store_id": random_id(args.stores)
+        }
+
+    def link(method):
+        item_id, tag_id = next(links if method == "post" else unlinks)
+        return getattr(client, method)(f"/item/{item_id}/tags/{tag_id}", headers=auth)
+
+    return [
+        ("GET /items", lambda: client.get("/items", headers=auth)),
+        ("GET /items?store_id", lambda: client.get(
+            f"/items?store_id={random_id(args.stores)}", headers=auth)),
+        ("GET /items/<id>", lambda: client.get(
+            f"/items/{random_id(items)}", headers=auth)),
+        ("POST /items", lambda: client.post("/items", json=new_item(), headers=auth)),
+        ("PUT /items/<id>", lambda: client.put(
+            f"/items/{random_id(items)}",
+            json={"name": f"renamed-{next(new_items)}", "price": 1.5},
+            headers=auth
+        )),
+        ("GET /stores", lambda: client.get("/stores", headers=auth)),
+        ("GET /stores/<id>", lambda: client.get(
+            f"/stores/{random_id(args.stores)}", headers=auth)),
+        ("GET /stores/<id>/tags", lambda: client.get(
+            f"/stores/{random_id(args.stores)}/tags", headers=auth)),
+        ("GET /tags/<id>", lambda: client.get(
+            f"/tags/{random_id(tags)}", headers=auth)),
+        ("GET /stores/stats", lambda: client.get("/stores/stats", headers=auth)),
+        ("GET /stores/<id>/stats", lambda: client.get(
+            f"/stores/{random_id(args.stores)}/stats", headers=auth)),
+        ("GET /search", lambda: client.get(
+            f"/search?q=item-{random_id(items)}", headers=auth)),
+        ("POST /item/<id>/tags/<id>", lambda: link("post")),
+        ("DELETE /item/<id>/tags/<id>", lambda: link("delete")),
+        ("POST /login", lambda: client.post(
+            "/login", json={"username": USERNAME, "password": PASSWORD})),
+        ("POST /refresh", lambda: client.post(
+            "/refresh",
+            headers={"Authorization": f"Bearer {next(refresh_tokens)}"}
+        )),
+    ]
+
+
+def percentile(values, fraction):
+    """Value at the given fraction of a sorted list"""
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+def measure(send, requests, concurrency):
+    """Sends `requests` requests and summarizes their latency"""
+    def timed():
+        start = time.perf_counter()
+        response = send()
+        return (
+            time.perf_counter() - start,
+            response.status_code,
+            int(response.headers.get("X-Query-Count", 0))
+        )
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        samples = list(executor.map(lambda _: timed(), range(requests)))
+    elapsed = time.perf_counter() - start
+
+    latencies = sorted(sample[0] for sample in samples)
+    return {
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p95_ms": percentile(latencies, 0.95) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "requests_per_second": requests / elapsed,
+        "queries_per_request": sum(sample[2] for sample in samples) / requests,
+        "errors": sum(sample[1] >= 400 for sample in samples),
+    }
+
+
+def compare(results, baseline, threshold):
+    """Prints the change of each metric against a baseline and returns the
+    routes whose p95 latency or queries per request regressed"""
+    regressions = []
+    for name, result in results.items():
+        before = baseline["results"].get(name)
+        if before is None:
+            continue
+        changes = []
+        for metric in ("p50_ms", "p95_ms", "p99_ms", "queries_per_request"):
+            if before[metric]:
+                change = (result[metric] - before[metric]) / before[metric]
+                changes.append(f"{metric} {change:+.0%}")
+                if metric in ("p95_ms", "queries_per_request") and change > threshold:
+                    regressions.append(name)
+        print(f"{name:<30} {'  '.join(changes)}")
+    return sorted(set(regressions))
+
+
+def main():
+    """Seeds the dataset, runs every scenario and reports"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--stores", type=int, default=20)
+    parser.add_argument("--items-per-store", type=int, default=200)
+    parser.add_argument("--tags-per-store", type=int, default=10)
+    parser.add_argument("--tag-density", type=float, default=0.2,
+                        help="Fraction of item/tag pairs of a store that are linked")
+    parser.add_argument("--requests", type=int, default=200,
+                        help="Requests per route")
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument("--cache", action="store_true",
+                        help="Keep the response cache enabled")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="Write the results as JSON here")
+    parser.add_argument("--compare", help="JSON results of a previous run")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="Relative p95/queries increase reported as regression")
+    args = parser.parse_args()
+
+    os.environ["DEBUG_QUERY_COUNT"] = "1"
+    os.environ["RESPONSE_CACHE_ENABLED"] = "1" if args.cache else "0"
+    os.environ["RATE_LIMIT_ENABLED"] = "0"
+
+    with tempfile.TemporaryDirectory() as tmp:
+        app = create_app(db_url=f"sqlite:///{tmp}/benchmark.db")
+        unlinked = seed(app, args)
+        client = app.test_client()
+
+        results = {}
+        for name, send in scenarios(app, client, args, unlinked):
+            results[name] = measure(send, args.requests, args.concurrency)
+            result = results[name]
+            print(
+                f"{name:<30} p50 {result['p50_ms']:8.2f} ms  "
+                f"p95 {result['p95_ms']:8.2f} ms  p99 {result['p99_ms']:8.2f} ms  "
+                f"{result['requests_per_second']:8.1f} req/s  "
+                f"{result['queries_per_request']:5.1f} queries  "
+                f"{result['errors']} errors"
+            )
+
+    report = {
+        "config": {
+            key: value for key, value in vars(args).items()
+            if key not in ("output", "compare", "threshold")
+        },
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump(report, file, indent=2)
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as file:
+            baseline = json.load(file)
+        if baseline["config"] != report["config"]:
+            print(f"\nWarning: {args.compare} was run with {baseline['config']}")
+        print(f"\nCompared with {args.compare}:")
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"\nRegressions: {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,201 @@
+"""Compares the sync (gunicorn) and async (uvicorn + asgi.py) serving modes.
+
+Opens many slow clients, which trickle their request headers over a few
+seconds, and measures the latency of fast requests sent meanwhile,
+`--concurrency` at a time, to two routes:
+
+-   `openapi`: `GET /openapi.json`, served from memory
+-   `store`: `GET /stores/<id>` with a valid token and the response cache
+    disabled, so every request checks the token and reads the database, the
+    work the ASGI thread pool is sized for
+
+    python benchmarks/serving.py --slow-clients 200 --slow-seconds 3
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# pylint: disable=wrong-import-position
+from flask_jwt_extended import create_access_token
+from sqlalchemy import insert
+
+from app import create_app
+from db import db
+from models import StoreModel, ItemModel
+from tokens import USER, role_claims
+
+HOST = "127.0.0.1"
+SLOW_PATH = "/openapi.json"
+
+SERVERS = {
+    "sync": lambda port, workers: [
+        sys.executable, "-m", "gunicorn", "--bind", f"{HOST}:{port}",
+        "--workers", str(workers), "app:create_app()",
+    ],
+    "async": lambda port, workers: [
+        sys.executable, "-m", "uvicorn", "--factory", "asgi:create_asgi_app",
+        "--host", HOST, "--port", str(port), "--workers", str(workers),
+        "--log-level", "warning",
+    ],
+}
+
+
+async def wait_until_up(port, timeout=30):
+    """Waits for the server to accept connections"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            _, writer = await asyncio.open_connection(HOST, port)
+            writer.close()
+            return
+        except OSError:
+            await asyncio.sleep(0.2)
+    raise RuntimeError(f"Server on port {port} didn't start")
+
+
+def seed(db_url, stores, items_per_store):
+    """Creates the schema and the stores, returns an access token"""
+    app = create_app(db_url)
+    with app.app_context():
+        db.session.execute(insert(StoreModel), [
+            {"id": store_id, "name": f"store-{store_id}"}
+            for store_id in range(1, stores + 1)
+        ])
+        db.session.execute(insert(ItemModel), [
+            {
+                "name": f"item-{store_id}-{item}", "price": 1.5,
+                "store_id": store_id
+            }
+            for store_id in range(1, stores + 1)
+            for item in range(items_per_store)
+        ])
+        db.session.commit()
+        return create_access_token(identity="1", additional_claims=role_claims(USER))
+
+
+def scenarios(args, token):
+    """(name, path function, extra headers) of the fast requests"""
+    return [
+        ("openapi", lambda number: "/openapi.json", ""),
+        (
+            "store",
+            lambda number: f"/stores/{number % args.stores + 1}",
+            f"Authorization: Bearer {token}\r\n"
+        ),
+    ]
+
+
+async def request(port, path, headers=""):
+    """Sends a GET and returns its latency in seconds"""
+    start = time.perf_counter()
+    reader, writer = await asyncio.open_connection(HOST, port)
+    writer.write(
+        f"GET {path} HTTP/1.1\r\nHost: {HOST}\r\n{headers}"
+        "Connection: close\r\n\r\n".encode())
+    await writer.drain()
+    status = (await reader.read()).split(b" ", 2)[1]
+    writer.close()
+    if status != b"200":
+        raise RuntimeError(f"GET {path} returned {status.decode()}")
+    return time.perf_counter() - start
+
+
+async def slow_request(port, seconds, lines=10):
+    """Sends a GET trickling its headers over `seconds`"""
+    reader, writer = await asyncio.open_connection(HOST, port)
+    writer.write(f"GET {SLOW_PATH} HTTP/1.1\r\nHost: {HOST}\r\n".encode())
+    for line in range(lines):
+        await asyncio.sleep(seconds / lines)
+        writer.write(f"X-Slow-{line}: 1\r\n".encode())
+        await writer.drain()
+    writer.write(b"Connection: close\r\n\r\n")
+    await writer.drain()
+    await reader.read()
+    writer.close()
+
+
+async def run_scenario(port, args, path, headers):
+    """Fast request latencies while the slow clients are connected"""
+    slow = [
+        asyncio.create_task(slow_request(port, args.slow_seconds))
+        for _ in range(args.slow_clients)
+    ]
+    await asyncio.sleep(0.5)
+
+    latencies = []
+    for batch in range(0, args.fast_requests, args.concurrency):
+        numbers = range(batch, min(batch + args.concurrency, args.fast_requests))
+        latencies += await asyncio.gather(*(
+            asyncio.wait_for(request(port, path(number), headers), timeout=60)
+            for number in numbers
+        ))
+    await asyncio.gather(*slow, return_exceptions=True)
+    return sorted(latencies)
+
+
+def percentile(values, fraction):
+    """Value at the given fraction of a sorted list"""
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+def main():
+    """Runs the benchmark for each serving mode"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--slow-clients", type=int, default=200)
+    parser.add_argument("--slow-seconds", type=float, default=3)
+    parser.add_argument("--fast-requests", type=int, default=40)
+    parser.add_argument("--concurrency", type=int, default=8,
+                        help="Fast requests in flight at once")
+    parser.add_argument("--stores", type=int, default=100)
+    parser.add_argument("--items-per-store", type=int, default=20)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--output", help="Write the results as JSON here")
+    args = parser.parse_args()
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        db_url = f"sqlite:///{tmp}/bench.db"
+        token = seed(db_url, args.stores, args.items_per_store)
+        env = {
+            **os.environ,
+            "DATABASE_URL": db_url,
+            "PYTHONPATH": ROOT,
+            "RATE_LIMIT_ENABLED": "0",
+            # Every store read goes to the database
+            "RESPONSE_CACHE_ENABLED": "0",
+        }
+        for port, (mode, command) in enumerate(SERVERS.items(), start=8701):
+            with subprocess.Popen(command(port, args.workers), cwd=ROOT, env=env) as server:
+                try:
+                    asyncio.run(wait_until_up(port))
+                    for name, path, headers in scenarios(args, token):
+                        latencies = asyncio.run(run_scenario(port, args, path, headers))
+                        results[f"{mode}_{name}"] = {
+                            "p50_ms": percentile(latencies, 0.5) * 1000,
+                            "p95_ms": percentile(latencies, 0.95) * 1000,
+                            "max_ms": latencies[-1] * 1000,
+                        }
+                finally:
+                    server.terminate()
+
+    for name, result in results.items():
+        print(
+            f"{name:>14}: fast request p50 {result['p50_ms']:8.1f} ms  "
+            f"p95 {result['p95_ms']:8.1f} ms  max {result['max_ms']:8.1f} ms  "
+            f"({args.slow_clients} slow clients)"
+        )
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
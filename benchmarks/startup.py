@@ -0,0 +1,135 @@
+"""Cold start benchmark.
+
+Starts a fresh interpreter `--runs` times per boot mode (default, and
+`FAST_BOOT=1`) and measures how long importing `app`, `create_app()` and the
+first request take, like a new gunicorn worker or container would. Results can
+be written as a JSON baseline and compared with a later run:
+
+    python benchmarks/startup.py --output startup.json
+    python benchmarks/startup.py --compare startup.json
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MODES = {
+    "default": {"FAST_BOOT": "0"},
+    "fast_boot": {"FAST_BOOT": "1"},
+}
+
+# Run in each fresh interpreter, prints the phase durations as JSON
+BOOT = """
+import json, sys, time
+start = time.perf_counter()
+from app import create_app
+imported = time.perf_counter()
+app = create_app(sys.argv[1])
+created = time.perf_counter()
+response = app.test_client().get("/stores/stats")
+served = time.perf_counter()
+assert response.status_code == 401, response.status_code
+print(json.dumps({
+    "import_ms": (imported - start) * 1000,
+    "create_app_ms": (created - imported) * 1000,
+    "first_request_ms": (served - created) * 1000,
+    "total_ms": (served - start) * 1000,
+}))
+"""
+
+METRICS = ("import_ms", "create_app_ms", "first_request_ms", "total_ms")
+
+
+def boot(db_url, env):
+    """Boots the app in a new interpreter and returns its phase durations"""
+    output = subprocess.run(
+        [sys.executable, "-c", BOOT, db_url],
+        cwd=ROOT, env={**os.environ, **env}, capture_output=True, text=True,
+        check=True
+    ).stdout
+    return json.loads(output.splitlines()[-1])
+
+
+def percentile(values, fraction):
+    """Value at the given fraction of a sorted list"""
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+def measure(db_url, env, runs):
+    """Boots `runs` times and summarizes each phase"""
+    samples = [boot(db_url, env) for _ in range(runs)]
+    result = {}
+    for metric in METRICS:
+        values = sorted(sample[metric] for sample in samples)
+        result[f"{metric}_p50"] = percentile(values, 0.50)
+        result[f"{metric}_p95"] = percentile(values, 0.95)
+    return result
+
+
+def compare(results, baseline, threshold):
+    """Prints the change of each metric against a baseline and returns the
+    modes whose median total boot time regressed"""
+    regressions = []
+    for name, result in results.items():
+        before = baseline["results"].get(name)
+        if before is None:
+            continue
+        changes = []
+        for metric in (f"{metric}_p50" for metric in METRICS):
+            if before[metric]:
+                change = (result[metric] - before[metric]) / before[metric]
+                changes.append(f"{metric} {change:+.0%}")
+                if metric == "total_ms_p50" and change > threshold:
+                    regressions.append(name)
+        print(f"{name:<12} {'  '.join(changes)}")
+    return regressions
+
+
+def main():
+    """Boots the app in every mode and reports"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=10, help="Boots per mode")
+    parser.add_argument("--output", help="Write the results as JSON here")
+    parser.add_argument("--compare", help="JSON results of a previous run")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="Relative median boot time increase reported as regression")
+    args = parser.parse_args()
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        db_url = f"sqlite:///{tmp}/startup.db"
+        # Fast boot expects the schema to exist, like after `flask db upgrade`
+        boot(db_url, MODES["default"])
+
+        for name, env in MODES.items():
+            results[name] = measure(db_url, env, args.runs)
+            result = results[name]
+            print(
+                f"{name:<12} import {result['import_ms_p50']:7.1f} ms  "
+                f"create_app {result['create_app_ms_p50']:7.1f} ms  "
+                f"first request {result['first_request_ms_p50']:7.1f} ms  "
+                f"total {result['total_ms_p50']:7.1f} ms "
+                f"(p95 {result['total_ms_p95']:7.1f} ms)"
+            )
+
+    report = {"config": {"runs": args.runs}, "results": results}
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump(report, file, indent=2)
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as file:
+            baseline = json.load(file)
+        print(f"\nCompared with {args.compare}:")
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"\nRegressions: {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
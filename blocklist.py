@@ -1,2 +1,137 @@
-"""This file contains the tokens blocklist (logged out tokens)"""
-BLOCKLIST = set()
+"""This file contains the tokens blocklist (logged out tokens).
+
+Revoked `jti`s are kept in a shared backend so every worker honours a log
+out, and expire together with the token they belong to. Each worker keeps a
+small LRU cache in front of the backend so the check done on every request is
+usually an in-memory lookup:
+
+- Revoked tokens are cached until they expire, since they can't be un-revoked
+- Access tokens found not revoked are cached for `BLOCKLIST_CACHE_TTL`
+  seconds, which is how long a log out done in another worker may take to be
+  seen here
+- Refresh tokens found not revoked aren't cached: they are only used once, by
+  `/refresh`, and revoking them there is atomic in the backend, so two
+  refreshes with the same token can't both succeed
+"""
+import os
+import time
+
+from sqlalchemy import delete, exists, select
+from sqlalchemy.exc import IntegrityError
+
+from cache import LRUCache
+from db import db
+from kvstore import kv_client
+from models import RevokedTokenModel
+
+
+class SQLBlocklistBackend:
+    """Stores revoked tokens in the `revoked_tokens` table"""
+
+    # Expired rows are purged every this many revocations
+    PURGE_EVERY = 100
+
+    def __init__(self):
+        self._adds = 0
+
+    def add(self, jti: str, expires_at: int) -> bool:
+        """Revokes a token, returns False if it already was"""
+        db.session.add(RevokedTokenModel(jti=jti, expires_at=expires_at))
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # Already revoked
+            db.session.rollback()
+            return False
+
+        self._adds += 1
+        if self._adds % self.PURGE_EVERY == 0:
+            self.purge()
+        return True
+
+    def contains(self, jti: str) -> bool:
+        """Whether a token is revoked"""
+        # From the primary, a replica may not have seen the log out yet
+        return db.session.scalar(
+            select(exists().where(RevokedTokenModel.jti == jti)),
+            bind_arguments={"primary": True}
+        )
+
+    def purge(self):
+        """Deletes the revoked tokens that already expired"""
+        db.session.execute(
+            delete(RevokedTokenModel).where(
+                RevokedTokenModel.expires_at < int(time.time())
+            )
+        )
+        db.session.commit()
+
+
+class KeyValueBlocklistBackend:
+    """Stores revoked tokens as expiring keys in a key/value store"""
+
+    KEY_PREFIX = "blocklist:"
+
+    def __init__(self, client):
+        self.client = client
+
+    def add(self, jti: str, expires_at: int) -> bool:
+        """Revokes a token, returns False if it already was"""
+        ttl = max(int(expires_at - time.time()), 1)
+        return bool(self.client.set(self.KEY_PREFIX + jti, 1, ex=ttl, nx=True))
+
+    def contains(self, jti: str) -> bool:
+        """Whether a token is revoked"""
+        return bool(self.client.exists(self.KEY_PREFIX + jti))
+
+
+class Blocklist:
+    """Revoked tokens, stored in a shared backend behind a per worker cache"""
+
+    def __init__(self):
+        self.backend = None
+        self.cache_ttl = 0
+        self.cache = LRUCache()
+
+    def init_app(self, app):
+        """Configures the backend from the app config"""
+        app.config.setdefault(
+            "BLOCKLIST_BACKEND", os.getenv("BLOCKLIST_BACKEND", "sql"))
+        app.config.setdefault(
+            "BLOCKLIST_KV_URL", os.getenv("BLOCKLIST_KV_URL"))
+        app.config.setdefault(
+            "BLOCKLIST_CACHE_SIZE", int(os.getenv("BLOCKLIST_CACHE_SIZE", "10000")))
+        app.config.setdefault(
+            "BLOCKLIST_CACHE_TTL", float(os.getenv("BLOCKLIST_CACHE_TTL", "5")))
+
+        if app.config["BLOCKLIST_BACKEND"] == "kv":
+            self.backend = KeyValueBlocklistBackend(
+                kv_client(app.config["BLOCKLIST_KV_URL"]))
+        else:
+            self.backend = SQLBlocklistBackend()
+
+        self.cache_ttl = app.config["BLOCKLIST_CACHE_TTL"]
+        self.cache = LRUCache(app.config["BLOCKLIST_CACHE_SIZE"])
+
+    def revoke(self, jwt_payload) -> bool:
+        """Adds the token with the given payload to the blocklist. Returns
+        False if it already was, in this or any other worker."""
+        jti = jwt_payload["jti"]
+        revoked = self.backend.add(jti, jwt_payload["exp"])
+        self.cache.set(jti, True, jwt_payload["exp"])
+        return revoked
+
+    def is_revoked(self, jwt_payload) -> bool:
+        """Whether the token with the given payload was revoked"""
+        jti = jwt_payload["jti"]
+        revoked = self.cache.get(jti)
+        if revoked is None:
+            revoked = self.backend.contains(jti)
+            if revoked:
+                self.cache.set(jti, True, jwt_payload["exp"])
+            elif jwt_payload.get("type") != "refresh":
+                self.cache.set(jti, False, time.time() + self.cache_ttl)
+        return revoked
+
+
+blocklist = Blocklist()
@@ -0,0 +1,182 @@
+"""Serialized response cache for the read endpoints.
+
+Responses are cached by resource, id and the version their ETag is made of
+(see `etags.py`) in a bounded per worker LRU and, optionally, in a key/value
+store shared by every worker. A cached body is only served with the ETag of
+the version it was cached under.
+
+Writes don't invalidate anything: replacing the version (`touch_stores`)
+makes the entries of the old one unreachable in every worker, and they age
+out of the LRU or expire after `RESPONSE_CACHE_TTL` seconds. A read that
+started before a write can only cache its body under the old version.
+
+The compressed bodies of cached responses are cached next to them, one per
+content encoding, so hits don't compress them again.
+"""
+import os
+import time
+from collections import OrderedDict
+from threading import Lock
+
+from flask import Response, current_app, request
+
+from compression import compressor
+from kvstore import kv_client
+
+CACHE_HEADER = "X-Cache"
+
+
+class LRUCache:
+    """Bounded least recently used cache with per entry expiry"""
+
+    def __init__(self, size=0):
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key, default=None):
+        """Returns the value of a key, or `default` if missing or expired"""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[1] <= time.time():
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, value, expires_at):
+        """Sets a key until the `expires_at` timestamp"""
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.size:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        """Deletes a key"""
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        """Deletes every key"""
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class ResponseCache:
+    """Two tier cache of serialized GET responses"""
+
+    KEY_PREFIX = "response:"
+
+    def __init__(self):
+        self.enabled = False
+        self.ttl = 0
+        self.local = LRUCache()
+        self.shared = None
+        self.shared_hits = 0
+
+    def init_app(self, app):
+        """Configures the cache from the app config"""
+        app.config.setdefault(
+            "RESPONSE_CACHE_ENABLED",
+            os.getenv("RESPONSE_CACHE_ENABLED", "1") == "1")
+        app.config.setdefault(
+            "RESPONSE_CACHE_BACKEND", os.getenv("RESPONSE_CACHE_BACKEND", "local"))
+        app.config.setdefault(
+            "RESPONSE_CACHE_KV_URL", os.getenv("RESPONSE_CACHE_KV_URL"))
+        app.config.setdefault(
+            "RESPONSE_CACHE_SIZE", int(os.getenv("RESPONSE_CACHE_SIZE", "10000")))
+        app.config.setdefault(
+            "RESPONSE_CACHE_TTL", int(os.getenv("RESPONSE_CACHE_TTL", "300")))
+
+        self.enabled = app.config["RESPONSE_CACHE_ENABLED"]
+        self.ttl = app.config["RESPONSE_CACHE_TTL"]
+        self.local = LRUCache(app.config["RESPONSE_CACHE_SIZE"])
+        if app.config["RESPONSE_CACHE_BACKEND"] == "kv":
+            self.shared = kv_client(app.config["RESPONSE_CACHE_KV_URL"])
+        else:
+            self.shared = None
+
+    def get(self, key):
+        """Cached body of a response, or None"""
+        body = self.local.get(key)
+        if body is None and self.shared is not None:
+            body = self.shared.get(self.KEY_PREFIX + key)
+            if body is not None:
+                self.shared_hits += 1
+                self.local.set(key, body, time.time() + self.ttl)
+        return body
+
+    def set(self, key, body):
+        """Caches the body of a response"""
+        self.local.set(key, body, time.time() + self.ttl)
+        if self.shared is not None:
+            self.shared.set(self.KEY_PREFIX + key, body, ex=self.ttl)
+
+    def compress(self, response, key, body):
+        """Compresses a cached response for the current request, with the
+        compressed body cached next to it"""
+        if not compressor.compressible(response):
+            return
+        encoding = compressor.negotiate()
+        if encoding is None:
+            return
+        data = self.get(encoded_key(key, encoding))
+        if data is None:
+            data = compressor.compress(body, encoding)
+            self.set(encoded_key(key, encoding), data)
+        compressor.apply(response, encoding, data)
+
+    def stats(self):
+        """Hit, miss and eviction counters"""
+        return {
+            "hits": self.local.hits + self.shared_hits,
+            "misses": self.local.misses - self.shared_hits,
+            "local_hits": self.local.hits,
+            "shared_hits": self.shared_hits,
+            "evictions": self.local.evictions,
+            "size": len(self.local),
+        }
+
+    def respond(self, key, view):
+        """Response of `view`, served from the cache under `key` or cached
+        there if successful. Only the default representation is cached, not
+        the ones selected with query string arguments."""
+        if not self.enabled or request.args:
+            return current_app.make_response(view())
+
+        body = self.get(key)
+        if body is not None:
+            response = Response(body, mimetype="application/json")
+            self.compress(response, key, body)
+            response.headers[CACHE_HEADER] = "HIT"
+            return response
+
+        response = current_app.make_response(view())
+        if response.status_code == 200:
+            body = response.get_data()
+            self.set(key, body)
+            self.compress(response, key, body)
+        response.headers[CACHE_HEADER] = "MISS"
+        return response
+
+
+def cache_key(resource, *ids):
+    """Key of a cached response, like `item:1:<version>`"""
+    return ":".join([resource, *map(str, ids)])
+
+
+def encoded_key(key, encoding):
+    """Key of the `encoding` compressed body of a cached response"""
+    return f"{key}|{encoding}"
+
+
+response_cache = ResponseCache()
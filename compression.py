@@ -0,0 +1,152 @@
+"""Negotiated response compression.
+
+Responses of at least `COMPRESSION_MIN_SIZE` bytes are compressed with the
+first encoding of `COMPRESSION_ENCODINGS` (default `br,zstd,gzip`) the client
+accepts. gzip is always available, brotli needs `pip install brotli` and zstd
+`pip install zstandard`, the missing ones are skipped. Each has its own level:
+`COMPRESSION_LEVEL_GZIP` (default 6), `COMPRESSION_LEVEL_BR` (default 5) and
+`COMPRESSION_LEVEL_ZSTD` (default 3).
+
+Compressed responses get the encoding appended to their ETag, like
+`"item-1-<version>-gzip"`, since their bytes differ, and `etags.py` accepts
+those back in `If-None-Match` and `If-Match`, answering `304` with the ETag of
+the representation the client has.
+"""
+import gzip
+import os
+
+from flask import g, request
+
+from instrumentation import phase
+
+# Every encoding the API can produce
+ENCODINGS = ("br", "zstd", "gzip")
+
+COMPRESSIBLE_MIMETYPES = ("application/json", "text/plain", "text/html")
+
+
+def gzip_codec(level):
+    """gzip compression function"""
+    return lambda data: gzip.compress(data, compresslevel=level, mtime=0)
+
+
+def brotli_codec(level):
+    """brotli compression function, None if brotli isn't installed"""
+    try:
+        import brotli  # pylint: disable=import-outside-toplevel
+    except ImportError:
+        return None
+    return lambda data: brotli.compress(data, quality=level)
+
+
+def zstd_codec(level):
+    """zstd compression function, None if zstandard isn't installed"""
+    try:
+        import zstandard  # pylint: disable=import-outside-toplevel
+    except ImportError:
+        return None
+    # Compressors can't be shared between threads, creating one is cheap
+    return lambda data: zstandard.ZstdCompressor(level=level).compress(data)
+
+
+CODECS = {"gzip": gzip_codec, "br": brotli_codec, "zstd": zstd_codec}
+
+DEFAULT_LEVELS = {"gzip": 6, "br": 5, "zstd": 3}
+
+
+def encoded_etag(etag, encoding):
+    """ETag of the `encoding` compressed representation"""
+    return f"{etag}-{encoding}"
+
+
+class ResponseCompressor:
+    """Compresses responses with the best encoding the client accepts"""
+
+    def __init__(self):
+        self.enabled = False
+        self.min_size = 0
+        self.codecs = {}
+
+    def init_app(self, app):
+        """Configures the encodings from the app config and registers the
+        compression hook"""
+        app.config.setdefault(
+            "COMPRESSION_ENABLED", os.getenv("COMPRESSION_ENABLED", "1") == "1")
+        app.config.setdefault(
+            "COMPRESSION_MIN_SIZE", int(os.getenv("COMPRESSION_MIN_SIZE", "1024")))
+        app.config.setdefault(
+            "COMPRESSION_ENCODINGS", os.getenv("COMPRESSION_ENCODINGS", "br,zstd,gzip"))
+        for encoding, level in DEFAULT_LEVELS.items():
+            key = f"COMPRESSION_LEVEL_{encoding.upper()}"
+            app.config.setdefault(key, int(os.getenv(key, str(level))))
+
+        self.enabled = app.config["COMPRESSION_ENABLED"]
+        self.min_size = app.config["COMPRESSION_MIN_SIZE"]
+        self.codecs = {}
+        for encoding in app.config["COMPRESSION_ENCODINGS"].split(","):
+            encoding = encoding.strip()
+            if encoding not in CODECS:
+                raise ValueError(
+                    f"COMPRESSION_ENCODINGS can only list {', '.join(ENCODINGS)}")
+            codec = CODECS[encoding](
+                app.config[f"COMPRESSION_LEVEL_{encoding.upper()}"])
+            if codec is not None:
+                self.codecs[encoding] = codec
+
+        @app.after_request
+        def compress_response(response):
+            if self.compressible(response):
+                response.vary.add("Accept-Encoding")
+                encoding = self.negotiate()
+                if encoding is not None:
+                    self.apply(
+                        response, encoding, self.compress(response.get_data(), encoding))
+            # Also set when the response cache compressed it, before the view
+            # decorators added the ETag
+            if g.get("response_encoding"):
+                self._tag(response, g.response_encoding)
+            return response
+
+    def negotiate(self):
+        """Encoding to use for the current request, None for identity"""
+        if not self.enabled:
+            return None
+        for encoding in self.codecs:
+            if request.accept_encodings[encoding] > 0:
+                return encoding
+        return None
+
+    def compressible(self, response) -> bool:
+        """Whether a response is worth compressing"""
+        return (
+            self.enabled
+            and response.status_code == 200
+            and not response.is_streamed
+            and not response.direct_passthrough
+            and "Content-Encoding" not in response.headers
+            and response.mimetype in COMPRESSIBLE_MIMETYPES
+            and response.content_length is not None
+            and response.content_length >= self.min_size
+        )
+
+    def compress(self, data: bytes, encoding) -> bytes:
+        """Compresses `data` with `encoding`"""
+        with phase("compress"):
+            return self.codecs[encoding](data)
+
+    @staticmethod
+    def apply(response, encoding, data):
+        """Replaces the body of a response with its compressed `data`"""
+        response.set_data(data)
+        response.headers["Content-Encoding"] = encoding
+        response.vary.add("Accept-Encoding")
+        g.response_encoding = encoding
+
+    @staticmethod
+    def _tag(response, encoding):
+        etag, weak = response.get_etag()
+        if etag and not etag.endswith(f"-{encoding}"):
+            response.set_etag(encoded_etag(etag, encoding), weak)
+
+
+compressor = ResponseCompressor()
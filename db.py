@@ -1,4 +1,17 @@
 """Database"""
+from flask import current_app
 from flask_sqlalchemy import SQLAlchemy
 
-db = SQLAlchemy()
+from replicas import RoutingSession
+
+# Reads of GET requests go to the read replicas, if any (see replicas.py)
+db = SQLAlchemy(session_options={"class_": RoutingSession})
+
+
+def chunks(rows):
+    """Splits rows into lists of BULK_CHUNK_SIZE, to keep statements and
+    their parameters bounded"""
+    rows = list(rows)
+    size = current_app.config["BULK_CHUNK_SIZE"]
+    for start in range(0, len(rows), size):
+        yield rows[start:start + size]
@@ -0,0 +1,186 @@
+"""Strong ETags and conditional requests.
+
+ETags are built from the `version` of the store a resource belongs to, which
+every write changing a store, its items, its tags or their links replaces
+through `touch_stores` in the same transaction. Checking them costs one small
+query, so `If-None-Match` is answered with `304` before loading relationships
+or serializing, and `If-Match` gives optimistic concurrency to writes.
+"""
+import hashlib
+import uuid
+from functools import wraps
+
+from flask import Response, current_app, request
+from sqlalchemy import select, update
+
+from cache import cache_key, response_cache
+from compression import ENCODINGS, compressor, encoded_etag
+from db import db, chunks
+from exceptions import ApiErrorException
+from models import StoreModel, ItemModel, TagModel
+from pagination import page_query
+from stats import mark_changed
+
+
+def new_version() -> str:
+    """Random store version, never reused"""
+    return uuid.uuid4().hex
+
+
+def touch_stores(store_ids):
+    """Replaces the version of the given stores, and schedules their summary
+    stats to be recomputed. Call it before committing every write that changes
+    what a store, its items or its tags show."""
+    store_ids = set(store_ids)
+    mark_changed(store_ids)
+    for chunk in chunks(store_ids):
+        db.session.execute(
+            update(StoreModel)
+            .where(StoreModel.id.in_(chunk))
+            .values(version=new_version())
+        )
+
+
+def store_version(store_id):
+    """Version of a store, None if it doesn't exist"""
+    return db.session.scalar(
+        select(StoreModel.version).where(StoreModel.id == store_id))
+
+
+def item_version(item_id):
+    """Version of the store of an item, None if the item doesn't exist"""
+    return db.session.scalar(
+        select(StoreModel.version)
+        .join(ItemModel, ItemModel.store_id == StoreModel.id)
+        .where(ItemModel.id == item_id)
+    )
+
+
+def tag_version(tag_id):
+    """Version of the store of a tag, None if the tag doesn't exist"""
+    return db.session.scalar(
+        select(StoreModel.version)
+        .join(TagModel, TagModel.store_id == StoreModel.id)
+        .where(TagModel.id == tag_id)
+    )
+
+
+def make_etag(resource, *parts):
+    """ETag of a resource, like `item-1-<version>`"""
+    return "-".join([resource, *map(str, parts)])
+
+
+def page_etag(resource, versions_query, id_column, query_args):
+    """ETag of one page of a collection.
+
+    `versions_query` selects the id and the version of each row, with the same
+    filters as the collection.
+    """
+    rows = page_query(
+        versions_query, id_column, query_args.get("cursor"), query_args["limit"]
+    ).all()
+    digest = hashlib.sha1(
+        repr((sorted(query_args.items()), [tuple(row) for row in rows])).encode()
+    ).hexdigest()
+    return make_etag(resource, digest)
+
+
+def query_digest():
+    """Short digest of the query string arguments of the request"""
+    return hashlib.sha1(
+        repr(sorted(request.args.items(multi=True))).encode()
+    ).hexdigest()[:12]
+
+
+def matches(etags, etag) -> bool:
+    """Whether `etags` has `etag` or the ETag of a compressed representation
+    of it"""
+    return etags.contains(etag) or any(
+        etags.contains(encoded_etag(etag, encoding)) for encoding in ENCODINGS)
+
+
+def is_not_modified(etag) -> bool:
+    """Whether the client already has the representation with this ETag"""
+    return etag is not None and matches(request.if_none_match, etag)
+
+
+def not_modified_etag(etag):
+    """ETag of the representation the client has: the one compressed with the
+    encoding negotiated for this request if it sent that back, since a `200`
+    would have had it, else the one it sent"""
+    encoding = compressor.negotiate()
+    if encoding is not None and request.if_none_match.contains(
+            encoded_etag(etag, encoding)):
+        return encoded_etag(etag, encoding)
+    if request.if_none_match.contains(etag):
+        return etag
+    for other in ENCODINGS:
+        if request.if_none_match.contains(encoded_etag(etag, other)):
+            return encoded_etag(etag, other)
+    return etag
+
+
+def not_modified(etag):
+    """304 response for the given ETag, with the encoding suffix of the
+    representation the client has"""
+    response = Response(status=304)
+    response.set_etag(not_modified_etag(etag))
+    if compressor.enabled:
+        response.vary.add("Accept-Encoding")
+    return response
+
+
+def check_if_match(etag):
+    """Fails with 412 if the request has an If-Match not matching `etag`"""
+    if request.if_match and (etag is None or not matches(request.if_match, etag)):
+        raise ApiErrorException(
+            412,
+            "Precondition Failed",
+            "Resource was modified",
+            {"etag": etag}
+        )
+
+
+def conditional(resource, version, cached=False):
+    """Answers conditional requests to a view with the id in its url.
+
+    `version` returns the version of the resource given its id. With `cached`
+    successful GET responses go to `response_cache`, keyed by that version.
+    Goes outside `blp.arguments`.
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            ids = list(kwargs.values())
+            # Representations selected with query string arguments differ
+            variant = [query_digest()] if request.args else []
+
+            def current_etag(current):
+                if current is None:
+                    return None
+                return make_etag(resource, *ids, current, *variant)
+
+            current = version(*ids)
+            etag = current_etag(current)
+            if request.method == "GET" and is_not_modified(etag):
+                return not_modified(etag)
+            check_if_match(etag)
+
+            if cached and request.method == "GET" and current is not None:
+                # The body is read after the version, so it's never older
+                # than the ETag it's served with
+                response = response_cache.respond(
+                    cache_key(resource, *ids, current),
+                    lambda: func(*args, **kwargs)
+                )
+            else:
+                response = current_app.make_response(func(*args, **kwargs))
+            if request.method == "GET" and response.status_code == 200:
+                response.set_etag(etag)
+            elif request.method == "PUT" and response.status_code == 200:
+                response.set_etag(current_etag(version(*ids)))
+            return response
+
+        return wrapper
+
+    return decorator
@@ -4,9 +4,11 @@
 class ApiErrorException(Exception):
     """API Error exception"""
 
-    def __init__(self, code: int, status: str, message: str, detail, *args):
+    def __init__(self, code: int, status: str, message: str, detail, *args, headers=None):
         self.code = code
         self.status = status
         self.message = message
         self.detail = detail
+        # Extra response headers, like Retry-After
+        self.headers = headers or {}
         super().__init__(*args)
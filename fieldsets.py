@@ -0,0 +1,58 @@
+"""Sparse fieldsets.
+
+GET endpoints returning items, stores and tags take `fields`, the comma
+separated fields to return, and `expand`, the nested collections to add.
+Collections that can hold thousands of rows, like the items of a tag, are only
+returned when asked for, and only the relationships returned are loaded.
+"""
+from functools import lru_cache
+
+from exceptions import ApiErrorException
+from loaders import loader_options
+from schemas import ItemSchema, StoreSchema, TagSchema
+
+# Nested collections left out unless expanded, by schema
+EXPANDABLE = {
+    ItemSchema: (),
+    StoreSchema: ("items",),
+    TagSchema: ("items",),
+}
+
+
+@lru_cache(maxsize=None)
+def dump_fields(schema_class):
+    """Names of the fields a schema dumps"""
+    return frozenset(schema_class().dump_fields)
+
+
+def response_fields(schema_class, query_args):
+    """Fields of `schema_class` to return given the `fields` and `expand`
+    arguments. Fails with 400 on unknown ones."""
+    available = dump_fields(schema_class)
+    expandable = EXPANDABLE[schema_class]
+    fields = query_args.get("only")
+    expand = query_args.get("expand", [])
+
+    unknown = sorted(
+        {field for field in fields or () if field not in available}
+        | {field for field in expand if field not in expandable}
+    )
+    if unknown:
+        raise ApiErrorException(
+            400,
+            "Bad Request",
+            "Unknown fields",
+            {"unknown": unknown, "fields": sorted(available), "expand": expandable}
+        )
+
+    if fields:
+        return frozenset(fields) | frozenset(expand)
+    return available - frozenset(expandable) | frozenset(expand)
+
+
+def sparse_fieldset(schema_class, loaders, query_args):
+    """Fields the view response returns and the loader options of their
+    relationships. Views return `SparseResult(result, fields)` to dump only
+    those."""
+    fields = response_fields(schema_class, query_args)
+    return fields, loader_options(loaders, fields)
@@ -0,0 +1,12 @@
+"""gunicorn settings, read from the working directory"""
+import os
+import tempfile
+
+# Builds the app once in the master and forks the workers from it, so they
+# start serving right away and share its memory. GUNICORN_PRELOAD=0 builds it
+# in every worker instead, e.g. to reload code on HUP
+preload_app = os.getenv("GUNICORN_PRELOAD", "1") == "1"
+
+# Workers share their request metrics through a directory, a new one on every
+# start of the server, so /metrics counts every worker, see instrumentation.py
+os.environ.setdefault("METRICS_DIR", tempfile.mkdtemp(prefix="store-api-metrics-"))
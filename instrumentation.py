@@ -0,0 +1,437 @@
+"""Request and database instrumentation.
+
+`/metrics` counts the requests of every worker when they share a
+`METRICS_DIR`: each worker writes its counters there as `<pid>.json` every
+`METRICS_WRITE_INTERVAL` seconds and a scrape adds up every file, so it
+doesn't matter which worker answers it. Files of workers that exited are kept,
+so the counters never go back. `gunicorn.conf.py` sets a fresh directory on
+every start, without one each worker serves its own counters.
+
+`/metrics` needs `Authorization: Bearer <METRICS_TOKEN>`, and isn't served
+without a `METRICS_TOKEN`.
+"""
+import glob
+import hmac
+import json
+import os
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from contextlib import contextmanager
+from threading import Lock, Thread
+
+from flask import (
+    Response,
+    current_app,
+    g,
+    has_app_context,
+    has_request_context,
+    request
+)
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import Pool, QueuePool
+
+from exceptions import ApiErrorException
+
+QUERY_COUNT_HEADER = "X-Query-Count"
+
+SERVER_TIMING_HEADER = "Server-Timing"
+
+# Upper bounds (seconds) of the connection checkout wait histogram buckets
+WAIT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+
+# Upper bounds (seconds) of the request latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Phases of a request reported in Server-Timing and /metrics
+PHASES = ("auth", "db", "serialize", "encode", "compress")
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def count_query(conn, cursor, statement, parameters, context, executemany):
+    """Counts the SQL statements executed while handling a request"""
+    if has_request_context():
+        g.query_count = g.get("query_count", 0) + 1
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def time_query(conn, cursor, statement, parameters, context, executemany):
+    """Adds up the time spent in SQL statements and logs the slow ones"""
+    duration = time.perf_counter() - conn.info["query_start"].pop()
+    if has_request_context():
+        g.db_time = g.get("db_time", 0) + duration
+
+    if not has_app_context():
+        return
+    threshold = current_app.config["SLOW_QUERY_THRESHOLD_MS"]
+    if threshold and duration * 1000 >= threshold:
+        current_app.logger.warning(
+            "Slow query (%.1f ms) on %s: %s",
+            duration * 1000,
+            f"{request.method} {request.path}" if has_request_context() else "-",
+            statement
+        )
+
+
+@event.listens_for(Engine, "handle_error")
+def discard_query_start(context):
+    """Drops the start time of statements that failed"""
+    if context.connection is not None and context.connection.info.get("query_start"):
+        context.connection.info["query_start"].pop()
+
+
+def init_query_counter(app):
+    """Adds the number of queries of each request as a debug header"""
+    app.config.setdefault(
+        "DEBUG_QUERY_COUNT",
+        os.getenv("DEBUG_QUERY_COUNT", "0") == "1"
+    )
+    app.config.setdefault(
+        "SLOW_QUERY_THRESHOLD_MS",
+        float(os.getenv("SLOW_QUERY_THRESHOLD_MS", "200"))
+    )
+
+    @app.after_request
+    def add_query_count_header(response):
+        if app.config["DEBUG_QUERY_COUNT"] or app.debug:
+            response.headers[QUERY_COUNT_HEADER] = str(g.get("query_count", 0))
+        return response
+
+
+@contextmanager
+def phase(name):
+    """Adds the time spent in the block to phase `name` of the request.
+    Nested blocks of the same phase count once."""
+    if not has_request_context() or name in g.setdefault("active_phases", set()):
+        yield
+        return
+
+    g.active_phases.add(name)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        g.active_phases.discard(name)
+        phases = g.setdefault("phase_times", {})
+        phases[name] = phases.get(name, 0) + time.perf_counter() - start
+
+
+def token_verified():
+    """Ends the auth phase: from the start of the request until its token is
+    decoded and checked against the blocklist"""
+    if has_request_context() and "request_start" in g:
+        g.setdefault("phase_times", {}).setdefault(
+            "auth", time.perf_counter() - g.request_start)
+
+
+def request_phases():
+    """Seconds spent in each phase of the current request"""
+    phases = dict(g.get("phase_times", {}))
+    if "db_time" in g:
+        phases["db"] = g.db_time
+    return phases
+
+
+def server_timing(phases, total):
+    """Server-Timing header value of the given phase durations"""
+    entries = [
+        f"{name};dur={phases[name] * 1000:.2f}" for name in PHASES if name in phases
+    ]
+    entries.append(f"total;dur={total * 1000:.2f}")
+    return ", ".join(entries)
+
+
+class RequestMetrics:
+    """Request latency histograms per route, in the Prometheus text format.
+    Of this worker, or of every worker writing to the same `directory`."""
+
+    def __init__(self):
+        self.buckets = defaultdict(lambda: [0] * (len(LATENCY_BUCKETS) + 1))
+        self.sums = defaultdict(float)
+        self.responses = defaultdict(int)
+        self.phase_sums = defaultdict(float)
+        self.directory = None
+        self.write_interval = 1.0
+        self._writer_pid = None
+        self._lock = Lock()
+
+    def configure(self, directory, write_interval):
+        """Shares the counters through `directory`, None keeps them in this
+        worker"""
+        self.directory = directory
+        self.write_interval = write_interval
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def observe(self, method, route, status, seconds, phases):
+        """Records a request to `route` that took `seconds`"""
+        with self._lock:
+            self.buckets[(method, route)][bisect_left(LATENCY_BUCKETS, seconds)] += 1
+            self.sums[(method, route)] += seconds
+            self.responses[(method, route, status)] += 1
+            for name, duration in phases.items():
+                self.phase_sums[(method, route, name)] += duration
+        if self.directory and self._writer_pid != os.getpid():
+            self._start_writer()
+
+    def snapshot(self) -> dict:
+        """Counters as JSON serializable lists"""
+        with self._lock:
+            return {
+                "buckets": [[*key, counts] for key, counts in self.buckets.items()],
+                "sums": [[*key, value] for key, value in self.sums.items()],
+                "responses": [[*key, value] for key, value in self.responses.items()],
+                "phase_sums": [[*key, value] for key, value in self.phase_sums.items()],
+            }
+
+    def add(self, snapshot):
+        """Adds the counters of a `snapshot`"""
+        with self._lock:
+            for *key, counts in snapshot["buckets"]:
+                bucket = self.buckets[tuple(key)]
+                for index, count in enumerate(counts):
+                    bucket[index] += count
+            for name in ("sums", "responses", "phase_sums"):
+                counters = getattr(self, name)
+                for *key, value in snapshot[name]:
+                    counters[tuple(key)] += value
+
+    def write(self):
+        """Writes the counters of this worker to `directory`"""
+        path = os.path.join(self.directory, f"{os.getpid()}.json")
+        with open(path + ".tmp", "w", encoding="utf-8") as output:
+            json.dump(self.snapshot(), output)
+        # Scrapes never read a partly written file
+        os.replace(path + ".tmp", path)
+
+    def _start_writer(self):
+        # Each (forked) worker process needs its own writer thread
+        with self._lock:
+            if self._writer_pid == os.getpid():
+                return
+            self._writer_pid = os.getpid()
+        Thread(target=self._write_periodically, daemon=True).start()
+
+    def _write_periodically(self):
+        while True:
+            if self.directory:
+                try:
+                    self.write()
+                except OSError:
+                    # Written again on the next interval
+                    pass
+            time.sleep(self.write_interval)
+
+    def collect(self):
+        """Counters of every worker sharing `directory`, or of this one"""
+        if not self.directory:
+            return self
+        self.write()
+        merged = RequestMetrics()
+        for path in glob.glob(os.path.join(self.directory, "*.json")):
+            try:
+                with open(path, encoding="utf-8") as metrics_file:
+                    merged.add(json.load(metrics_file))
+            except FileNotFoundError:
+                continue
+        return merged
+
+    def render(self) -> str:
+        """Metrics in the Prometheus text exposition format"""
+        return self.collect()._render()  # pylint: disable=protected-access
+
+    def _render(self) -> str:
+        lines = [
+            "# HELP http_request_duration_seconds Request latency by route",
+            "# TYPE http_request_duration_seconds histogram",
+        ]
+        with self._lock:
+            for (method, route), buckets in sorted(self.buckets.items()):
+                labels = f'method="{method}",route="{escape_label(route)}"'
+                cumulative = 0
+                for bound, count in zip((*LATENCY_BUCKETS, "+Inf"), buckets):
+                    cumulative += count
+                    lines.append(
+                        f'http_request_duration_seconds_bucket{{{labels},le="{bound}"}} '
+                        f"{cumulative}"
+                    )
+                lines.append(
+                    f"http_request_duration_seconds_sum{{{labels}}} "
+                    f"{self.sums[(method, route)]}"
+                )
+                lines.append(
+                    f"http_request_duration_seconds_count{{{labels}}} {cumulative}")
+
+            lines += [
+                "# HELP http_responses_total Responses by route and status",
+                "# TYPE http_responses_total counter",
+            ]
+            for (method, route, status), count in sorted(self.responses.items()):
+                lines.append(
+                    f'http_responses_total{{method="{method}",'
+                    f'route="{escape_label(route)}",status="{status}"}} {count}'
+                )
+
+            lines += [
+                "# HELP http_request_phase_seconds_total Time spent in each "
+                "phase of the requests by route",
+                "# TYPE http_request_phase_seconds_total counter",
+            ]
+            for (method, route, name), seconds in sorted(self.phase_sums.items()):
+                lines.append(
+                    f'http_request_phase_seconds_total{{method="{method}",'
+                    f'route="{escape_label(route)}",phase="{name}"}} {seconds}'
+                )
+        return "\n".join(lines) + "\n"
+
+
+def escape_label(value) -> str:
+    """Prometheus label value"""
+    return value.replace("\\", "\\\\").replace('"', '\\"')
+
+
+request_metrics = RequestMetrics()
+
+
+def init_request_instrumentation(app):
+    """Times the phases of each request into a Server-Timing header and the
+    per route histograms served at /metrics"""
+    app.config.setdefault(
+        "SERVER_TIMING_ENABLED", os.getenv("SERVER_TIMING_ENABLED", "1") == "1")
+    app.config.setdefault(
+        "METRICS_ENABLED", os.getenv("METRICS_ENABLED", "1") == "1")
+    app.config.setdefault("METRICS_TOKEN", os.getenv("METRICS_TOKEN"))
+    app.config.setdefault("METRICS_DIR", os.getenv("METRICS_DIR"))
+    app.config.setdefault(
+        "METRICS_WRITE_INTERVAL", float(os.getenv("METRICS_WRITE_INTERVAL", "1")))
+    request_metrics.configure(
+        app.config["METRICS_DIR"], app.config["METRICS_WRITE_INTERVAL"])
+
+    @app.before_request
+    def start_request_timer():
+        g.request_start = time.perf_counter()
+
+    @app.after_request
+    def record_request_timing(response):
+        if "request_start" not in g:
+            return response
+        total = time.perf_counter() - g.request_start
+        phases = request_phases()
+        if app.config["SERVER_TIMING_ENABLED"]:
+            response.headers[SERVER_TIMING_HEADER] = server_timing(phases, total)
+        if app.config["METRICS_ENABLED"]:
+            route = request.url_rule.rule if request.url_rule else "<unmatched>"
+            request_metrics.observe(
+                request.method, route, response.status_code, total, phases)
+        return response
+
+    def metrics():
+        """Prometheus metrics of every worker sharing METRICS_DIR"""
+        token = app.config["METRICS_TOKEN"]
+        if not app.config["METRICS_ENABLED"] or not token:
+            return Response(status=404)
+        if not hmac.compare_digest(
+                request.headers.get("Authorization", ""), f"Bearer {token}"):
+            raise ApiErrorException(
+                401,
+                "Unauthorized",
+                "METRICS_TOKEN required",
+                {},
+                headers={"WWW-Authenticate": "Bearer"}
+            )
+        return Response(
+            request_metrics.render(),
+            mimetype="text/plain; version=0.0.4"
+        )
+
+    app.add_url_rule("/metrics", "metrics", metrics)
+
+
+class PoolMetrics:
+    """Connection pool counters of this worker"""
+
+    def __init__(self):
+        self.checkouts = 0
+        self.connects = 0
+        self.invalidations = 0
+        self.overflow_checkouts = 0
+        self.wait_buckets = [0] * (len(WAIT_BUCKETS) + 1)
+        self.wait_sum = 0.0
+        self._lock = Lock()
+
+    def observe_wait(self, seconds, overflow):
+        """Records the time a checkout waited for a connection"""
+        with self._lock:
+            self.checkouts += 1
+            self.wait_sum += seconds
+            self.wait_buckets[bisect_left(WAIT_BUCKETS, seconds)] += 1
+            if overflow:
+                self.overflow_checkouts += 1
+
+    def stats(self, pool):
+        """Counters plus the current state of `pool`"""
+        queue_pool = isinstance(pool, QueuePool)
+        cumulative = 0
+        wait_histogram = []
+        for bound, count in zip((*WAIT_BUCKETS, "+Inf"), self.wait_buckets):
+            cumulative += count
+            wait_histogram.append({"le": str(bound), "count": cumulative})
+
+        return {
+            "pool": type(pool).__name__,
+            "size": pool.size() if queue_pool else None,
+            "in_use": pool.checkedout() if queue_pool else None,
+            "idle": pool.checkedin() if queue_pool else None,
+            "overflow": max(pool.overflow(), 0) if queue_pool else None,
+            "checkouts": self.checkouts,
+            "connects": self.connects,
+            "invalidations": self.invalidations,
+            "overflow_checkouts": self.overflow_checkouts,
+            "wait_seconds_sum": self.wait_sum,
+            "wait_seconds_histogram": wait_histogram,
+        }
+
+
+pool_metrics = PoolMetrics()
+
+
+class InstrumentedQueuePool(QueuePool):
+    """QueuePool recording how long checkouts wait for a connection"""
+
+    def _do_get(self):
+        start = time.perf_counter()
+        connection = super()._do_get()
+        pool_metrics.observe_wait(time.perf_counter() - start, self.overflow() > 0)
+        return connection
+
+
+@event.listens_for(Pool, "connect")
+def count_connect(dbapi_connection, connection_record):
+    """Counts new database connections"""
+    pool_metrics.connects += 1
+
+
+@event.listens_for(Pool, "invalidate")
+def count_invalidation(dbapi_connection, connection_record, exception):
+    """Counts connections discarded as stale or broken"""
+    pool_metrics.invalidations += 1
+
+
+def engine_options(database_uri):
+    """Connection pool settings, from DB_POOL_* environment variables"""
+    options = {"pool_pre_ping": os.getenv("DB_POOL_PRE_PING", "1") == "1"}
+
+    # In memory SQLite databases live in a single connection
+    if database_uri in ("sqlite://", "sqlite:///:memory:"):
+        return options
+
+    options.update({
+        "poolclass": InstrumentedQueuePool,
+        "pool_size": int(os.getenv("DB_POOL_SIZE", "5")),
+        "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", "10")),
+        "pool_recycle": int(os.getenv("DB_POOL_RECYCLE", "1800")),
+        "pool_timeout": float(os.getenv("DB_POOL_TIMEOUT", "30")),
+    })
+    return options
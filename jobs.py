@@ -0,0 +1,89 @@
+"""Background jobs.
+
+Long running work (like deleting a very large store) runs on a pool of
+`JOBS_WORKERS` threads per worker, inside an app context. Job status is kept
+in a key/value store for `JOBS_TTL` seconds: redis at `JOBS_KV_URL`, shared
+by every worker so any of them can answer `GET /jobs/<id>`, or an in-process
+stand-in when no url is set. Only the worker that ran a job would know it
+then, so callers run their work inline instead unless `jobs.shared`.
+"""
+import json
+import os
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app
+
+from kvstore import kv_client
+
+
+class JobQueue:
+    """Runs jobs on a thread pool and tracks their status"""
+
+    KEY_PREFIX = "job:"
+
+    def __init__(self):
+        self.workers = 2
+        self.ttl = 3600
+        self.client = None
+        self.shared = False
+        self._executor = None
+
+    def init_app(self, app):
+        """Configures the pool and the status store from the app config"""
+        app.config.setdefault("JOBS_WORKERS", int(os.getenv("JOBS_WORKERS", "2")))
+        app.config.setdefault("JOBS_KV_URL", os.getenv("JOBS_KV_URL"))
+        app.config.setdefault("JOBS_TTL", int(os.getenv("JOBS_TTL", "3600")))
+
+        self.workers = app.config["JOBS_WORKERS"]
+        self.ttl = app.config["JOBS_TTL"]
+        self.client = kv_client(app.config["JOBS_KV_URL"])
+        # Whether every worker sees the status of the jobs
+        self.shared = bool(app.config["JOBS_KV_URL"])
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+        self._executor = None
+
+    def submit(self, name, func, *args):
+        """Schedules `func(*args)` to run in an app context, returns the job"""
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.workers, thread_name_prefix="jobs")
+
+        job = {
+            "id": uuid.uuid4().hex,
+            "name": name,
+            "status": "pending",
+            "created_at": time.time(),
+            "finished_at": None,
+            "error": None,
+        }
+        self._save(job)
+        self._executor.submit(
+            self._run, current_app._get_current_object(), job, func, args)
+        return job
+
+    def get(self, job_id):
+        """Status of a job, None if unknown or expired"""
+        value = self.client.get(self.KEY_PREFIX + job_id)
+        return json.loads(value) if value is not None else None
+
+    def _run(self, app, job, func, args):
+        self._save({**job, "status": "running"})
+        with app.app_context():
+            try:
+                func(*args)
+            except Exception as e:  # pylint: disable=broad-except
+                app.logger.exception("Job %s (%s) failed", job["id"], job["name"])
+                job.update(status="failed", error=str(e))
+            else:
+                job["status"] = "done"
+        job["finished_at"] = time.time()
+        self._save(job)
+
+    def _save(self, job):
+        self.client.set(self.KEY_PREFIX + job["id"], json.dumps(job), ex=self.ttl)
+
+
+jobs = JobQueue()
@@ -0,0 +1,56 @@
+"""Key/value store clients shared by workers (redis), with a local stand-in"""
+import time
+from threading import Lock
+
+
+class LocalKeyValueStore:
+    """In-process stand-in for a key/value store with key expiry (redis).
+
+    Only shares data between the threads of one process, use it for local
+    development and tests.
+    """
+
+    def __init__(self):
+        self._data = {}
+        self._lock = Lock()
+
+    def get(self, name):
+        """Returns the value of a key, or None if it doesn't exist"""
+        with self._lock:
+            entry = self._data.get(name)
+            if entry is None:
+                return None
+            if entry[1] is not None and entry[1] <= time.time():
+                del self._data[name]
+                return None
+            return entry[0]
+
+    def set(self, name, value, ex=None, nx=False):
+        """Sets a key, expiring after `ex` seconds. With `nx` only if it
+        doesn't exist, returning None if it did."""
+        expires_at = time.time() + ex if ex is not None else None
+        with self._lock:
+            entry = self._data.get(name)
+            if nx and entry is not None and (entry[1] is None or entry[1] > time.time()):
+                return None
+            self._data[name] = (value, expires_at)
+            return True
+
+    def delete(self, *names) -> int:
+        """Deletes keys, returns how many existed"""
+        with self._lock:
+            return sum(
+                self._data.pop(name, None) is not None for name in names)
+
+    def exists(self, name) -> int:
+        """Returns 1 if the key exists, 0 otherwise"""
+        return int(self.get(name) is not None)
+
+
+def kv_client(url):
+    """redis client for `url`, or the local stand-in if no url is set"""
+    if not url:
+        return LocalKeyValueStore()
+
+    import redis  # pylint: disable=import-outside-toplevel
+    return redis.Redis.from_url(url)
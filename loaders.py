@@ -0,0 +1,33 @@
+"""Loader strategies for the relationships each response schema serializes.
+
+Views add the ones of the fields they return to their queries with
+`query.options(*loader_options(ITEM_LOADERS, fields))` so the nested fields of
+the schema are loaded with a constant number of queries instead of one lazy
+load per row, and the ones left out aren't loaded at all.
+"""
+from sqlalchemy.orm import joinedload, selectinload
+
+from models import ItemModel, StoreModel, TagModel
+
+# ItemSchema: store and tags
+ITEM_LOADERS = {
+    "store": joinedload(ItemModel.store),
+    "tags": selectinload(ItemModel.tags),
+}
+
+# StoreSchema: items and tags
+STORE_LOADERS = {
+    "items": selectinload(StoreModel.items),
+    "tags": selectinload(StoreModel.tags),
+}
+
+# TagSchema: store and items
+TAG_LOADERS = {
+    "store": joinedload(TagModel.store),
+    "items": selectinload(TagModel.items),
+}
+
+
+def loader_options(loaders, fields):
+    """Loader options of the relationships among `fields`"""
+    return [loader for field, loader in loaders.items() if field in fields]
@@ -0,0 +1,59 @@
+"""search index
+
+Revision ID: d81f3b6c7a95
+Revises: c4e9a1d7f352
+Create Date: 2026-10-18 17:42:09.315870
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd81f3b6c7a95'
+down_revision = 'c4e9a1d7f352'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Not in the models, see search.py. Other databases use the memory index
+    dialect = op.get_bind().dialect.name
+    if dialect == 'sqlite':
+        exists = op.get_bind().scalar(sa.text(
+            "SELECT 1 FROM sqlite_master WHERE name = 'search_index'"))
+        if exists:
+            # Created by db.create_all() at start up
+            return
+        op.execute(
+            "CREATE VIRTUAL TABLE search_index USING fts5("
+            "name, description, kind UNINDEXED, store_id UNINDEXED, "
+            "tokenize = 'unicode61', prefix = '2 3')"
+        )
+        # Items and tags rows are interleaved, see FTS5Backend.rowid
+        op.execute(
+            "INSERT INTO search_index (rowid, kind, store_id, name, description) "
+            "SELECT id * 2, 'item', store_id, name, description FROM items"
+        )
+        op.execute(
+            "INSERT INTO search_index (rowid, kind, store_id, name, description) "
+            "SELECT id * 2 + 1, 'tag', store_id, name, NULL FROM tags"
+        )
+    elif dialect == 'postgresql':
+        op.execute(
+            "CREATE INDEX IF NOT EXISTS ix_items_search ON items USING gin "
+            "(to_tsvector('simple', name || ' ' || coalesce(description, '')))"
+        )
+        op.execute(
+            "CREATE INDEX IF NOT EXISTS ix_tags_search ON tags USING gin "
+            "(to_tsvector('simple', name))"
+        )
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'sqlite':
+        op.execute("DROP TABLE IF EXISTS search_index")
+    elif dialect == 'postgresql':
+        op.execute("DROP INDEX IF EXISTS ix_items_search")
+        op.execute("DROP INDEX IF EXISTS ix_tags_search")
@@ -4,3 +4,5 @@ from models.item import ItemModel
 from models.tag import TagModel
 from models.items_tags import ItemsTagsModel
 from models.user import UserModel
+from models.revoked_token import RevokedTokenModel
+from models.store_stats import StoreStatsModel
@@ -1,11 +1,15 @@
 """Items Model File"""
-from sqlalchemy import Column, Integer, String, Float, ForeignKey
+from sqlalchemy import Column, Integer, String, Float, ForeignKey, Index
 from db import db
 
 
 class ItemModel(db.Model):
     """Item Model"""
     __tablename__ = "items"
+    __table_args__ = (
+        # Item names are unique per store
+        Index("ix_items_store_id_name", "store_id", "name", unique=True),
+    )
 
     id = Column(Integer, primary_key=True)
     name = Column(String(80), nullable=False)
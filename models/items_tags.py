@@ -1,12 +1,16 @@
 """Items Tags Many to Many"""
-from sqlalchemy import Column, Integer, ForeignKey
+from sqlalchemy import Column, Integer, ForeignKey, Index
 from db import db
 
 
 class ItemsTagsModel(db.Model):
     """Items Tags Many to Many Modal"""
     __tablename__ = "items_tags"
+    __table_args__ = (
+        # An item can be linked to a tag once. Also serves lookups by item_id
+        Index("ix_items_tags_item_id_tag_id", "item_id", "tag_id", unique=True),
+    )
 
     id = Column(Integer, primary_key=True)
-    tag_id = Column(Integer, ForeignKey("tags.id"), nullable=False)
+    tag_id = Column(Integer, ForeignKey("tags.id"), nullable=False, index=True)
     item_id = Column(Integer, ForeignKey("items.id"), nullable=False)
@@ -0,0 +1,13 @@
+"""Revoked Tokens Model File"""
+from sqlalchemy import Column, Integer, String
+from db import db
+
+
+class RevokedTokenModel(db.Model):
+    """Revoked (logged out) JWT Model"""
+    __tablename__ = "revoked_tokens"
+
+    id = Column(Integer, primary_key=True)
+    jti = Column(String(36), unique=True, nullable=False)
+    # Token expiration (unix timestamp), the row can be purged after it
+    expires_at = Column(Integer, nullable=False, index=True)
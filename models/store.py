@@ -1,4 +1,5 @@
 """Stores Model File"""
+import uuid
 from sqlalchemy import Column, Integer, String
 from db import db
 
@@ -9,9 +10,16 @@ class StoreModel(db.Model):
 
     id = Column(Integer, primary_key=True)
     name = Column(String(80), unique=True, nullable=False)
+    # Replaced on every change to the store, its items or tags (see etags.py)
+    version = Column(
+        String(32), nullable=False, default=lambda: uuid.uuid4().hex)
 
+    # Plain (non dynamic) collections so they can be eager loaded, see loaders.py
     items = db.relationship(
-        "ItemModel", back_populates="store", lazy="dynamic", cascade="all, delete")
+        "ItemModel", back_populates="store", cascade="all, delete")
 
     tags = db.relationship(
-        "TagModel", back_populates="store", lazy="dynamic", cascade="all, delete")
+        "TagModel", back_populates="store", cascade="all, delete")
+
+    stats = db.relationship(
+        "StoreStatsModel", uselist=False, cascade="all, delete")
@@ -0,0 +1,17 @@
+"""Store Stats Model File"""
+from sqlalchemy import Column, Integer, Float, ForeignKey
+from db import db
+
+
+class StoreStatsModel(db.Model):
+    """Summary of the items and tags of a store, see stats.py"""
+    __tablename__ = "store_stats"
+
+    store_id = Column(Integer, ForeignKey("stores.id"), primary_key=True)
+    item_count = Column(Integer, nullable=False, default=0)
+    tag_count = Column(Integer, nullable=False, default=0)
+    # Item and tag links of the store
+    link_count = Column(Integer, nullable=False, default=0)
+    min_price = Column(Float(precision=2))
+    max_price = Column(Float(precision=2))
+    avg_price = Column(Float)
@@ -1,11 +1,15 @@
 """Stores Model File"""
-from sqlalchemy import Column, Integer, String, ForeignKey
+from sqlalchemy import Column, Integer, String, ForeignKey, Index
 from db import db
 
 
 class TagModel(db.Model):
     """Store Model"""
     __tablename__ = "tags"
+    __table_args__ = (
+        # Tag names are unique per store
+        Index("ix_tags_store_id_name", "store_id", "name", unique=True),
+    )
 
     id = Column(Integer, primary_key=True)
     name = Column(String(80), nullable=False)
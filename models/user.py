@@ -10,3 +10,5 @@ class UserModel(db.Model):
     id = Column(Integer, primary_key=True)
     username = Column(String(80), unique=True, nullable=False)
     password = Column(String(80), nullable=False)
+    # Resolved into the permissions of its tokens at log in, see tokens.py
+    role = Column(String(20), nullable=False, default="user", server_default="user")
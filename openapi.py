@@ -0,0 +1,128 @@
+"""OpenAPI documentation built on first use.
+
+flask-smorest documents every view of a blueprint when it's registered,
+resolving each marshmallow schema into the spec, which is most of the time
+`create_app` takes. `LazyApi` registers the blueprints right away but
+documents them the first time the spec is used (`/openapi.json`, the Swagger
+UI, `flask openapi print`), so workers that never serve it don't build it.
+
+`/openapi.json` is encoded and gzipped once and then served from memory with a
+content hash ETag. `flask openapi-freeze` writes it to disk, and with
+`OPENAPI_SPEC_FILE` pointing at that file workers serve it without building
+the spec at all.
+"""
+import gzip
+import hashlib
+import os
+from threading import RLock
+
+import click
+from flask import Response, json, request
+from flask_smorest import Api
+
+
+class FrozenSpec:
+    """Encoded spec, its gzipped bytes and ETag"""
+
+    def __init__(self, body: bytes, compressed: bytes = None):
+        self.body = body
+        self.compressed = compressed or gzip.compress(body, mtime=0)
+        self.etag = hashlib.sha256(body).hexdigest()[:32]
+
+    def response(self):
+        """The spec for the current request, gzipped if accepted"""
+        gzipped = "gzip" in request.accept_encodings
+        etag = f"{self.etag}-gzip" if gzipped else self.etag
+        if request.if_none_match.contains(etag):
+            response = Response(status=304)
+        else:
+            response = Response(
+                self.compressed if gzipped else self.body,
+                mimetype="application/json"
+            )
+            if gzipped:
+                response.headers["Content-Encoding"] = "gzip"
+        response.set_etag(etag)
+        response.headers["Cache-Control"] = "no-cache"
+        response.vary.add("Accept-Encoding")
+        return response
+
+
+class LazyApi(Api):
+    """Api documenting its blueprints on first access to `spec`"""
+
+    def __init__(self, *args, **kwargs):
+        self._spec = None
+        self._undocumented = []
+        self._frozen = None
+        self._lock = RLock()
+        super().__init__(*args, **kwargs)
+
+    def init_app(self, app, *, spec_kwargs=None):
+        """Initializes the Api and registers the `flask openapi-freeze`
+        command"""
+        app.config.setdefault("OPENAPI_SPEC_FILE", os.getenv("OPENAPI_SPEC_FILE"))
+        super().init_app(app, spec_kwargs=spec_kwargs)
+
+        @app.cli.command("openapi-freeze")
+        @click.argument("output_file", default="openapi.json")
+        def freeze_openapi(output_file):
+            """Write openapi.json and its gzipped copy, to serve with
+            OPENAPI_SPEC_FILE"""
+            frozen = self.frozen_spec()
+            with open(output_file, "wb") as output:
+                output.write(frozen.body)
+            with open(output_file + ".gz", "wb") as output:
+                output.write(frozen.compressed)
+            print(f"Wrote {output_file} and {output_file}.gz")
+
+    def frozen_spec(self) -> FrozenSpec:
+        """The encoded spec, read from OPENAPI_SPEC_FILE if set or built once"""
+        if self._frozen is None:
+            with self._lock:
+                if self._frozen is None:
+                    self._frozen = self._freeze()
+        return self._frozen
+
+    def _freeze(self):
+        path = self.config.get("OPENAPI_SPEC_FILE")
+        if path:
+            with open(path, "rb") as spec_file:
+                body = spec_file.read()
+            compressed = None
+            if os.path.exists(path + ".gz"):
+                with open(path + ".gz", "rb") as compressed_file:
+                    compressed = compressed_file.read()
+            return FrozenSpec(body, compressed)
+        return FrozenSpec(json.dumps(
+            self.spec.to_dict(), indent=2, sort_keys=False).encode())
+
+    def _openapi_json(self):
+        """Serve JSON spec file, encoded once"""
+        return self.frozen_spec().response()
+
+    @property
+    def spec(self):
+        """APISpec with every registered blueprint documented"""
+        if self._undocumented:
+            with self._lock:
+                while self._undocumented:
+                    self._document(*self._undocumented.pop(0))
+        return self._spec
+
+    @spec.setter
+    def spec(self, spec):
+        self._spec = spec
+
+    def register_blueprint(self, blp, *, parameters=None, **options):
+        """Registers a blueprint, its documentation is added on first use"""
+        blp_name = options.get("name", blp.name)
+        self._app.extensions["flask-smorest"]["blp_name_to_api"][blp_name] = self
+        self._app.register_blueprint(blp, **options)
+        with self._lock:
+            self._undocumented.append((blp, blp_name, parameters))
+
+    def _document(self, blp, blp_name, parameters):
+        blp.register_views_in_doc(
+            self, self._app, self._spec, name=blp_name, parameters=parameters)
+        self._spec.tag({"name": blp_name, "description": blp.description})
@@ -0,0 +1,56 @@
+"""Keyset (cursor) pagination helpers"""
+import base64
+import binascii
+import json
+
+from exceptions import ApiErrorException
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+PAGINATION_HEADER = "X-Pagination"
+
+
+def encode_cursor(last_id: int) -> str:
+    """Builds an opaque cursor pointing right after the given row id"""
+    return base64.urlsafe_b64encode(str(last_id).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> int:
+    """Returns the row id encoded in an opaque cursor"""
+    try:
+        padding = "=" * (-len(cursor) % 4)
+        return int(base64.urlsafe_b64decode(cursor + padding).decode())
+    except (binascii.Error, UnicodeDecodeError, ValueError) as e:
+        raise ApiErrorException(
+            400,
+            "Bad Request",
+            "Invalid pagination cursor",
+            {"cursor": cursor}
+        ) from e
+
+
+def page_query(query, id_column, cursor=None, limit=DEFAULT_PAGE_SIZE):
+    """Restricts `query` to one page, plus one row to know whether there's a
+    next page"""
+    if cursor is not None:
+        query = query.filter(id_column > decode_cursor(cursor))
+
+    return query.order_by(id_column).limit(limit + 1)
+
+
+def paginate(query, id_column, cursor=None, limit=DEFAULT_PAGE_SIZE):
+    """Fetches one page of `query` ordered by `id_column`.
+
+    Returns the rows and the headers describing the next page, so views can
+    return them straight to `blp.response`.
+    """
+    rows = page_query(query, id_column, cursor, limit).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1].id)
+
+    headers = {
+        PAGINATION_HEADER: json.dumps({"next": next_cursor, "limit": limit})
+    }
+    return rows, headers
@@ -0,0 +1,147 @@
+"""Password hashing, inline or on a bounded process pool.
+
+pbkdf2 holds the CPU for tens of milliseconds per hash. By default
+(`PASSWORD_HASH_WORKERS=0`) it runs in the request thread, which is all a sync
+worker can do: it waits for the hash either way, and a pool would only add
+the cost of sending it to another process. At most
+`PASSWORD_HASH_MAX_PENDING` (default 1) hashes run at once in each worker.
+
+Workers serving several requests at once (gunicorn `--threads`, `asgi.py`)
+can set `PASSWORD_HASH_WORKERS` to hash on a pool of that many processes, so
+their other threads keep the GIL meanwhile. The pool belongs to each worker
+process, so the app uses up to workers × `PASSWORD_HASH_WORKERS` of them. Its
+processes are started from a fork server, not forked from a worker that may
+already run threads, and `PASSWORD_HASH_MAX_PENDING` defaults to 4 hashes per
+pool process.
+
+Either way requests beyond `PASSWORD_HASH_MAX_PENDING` wait
+`PASSWORD_HASH_QUEUE_TIMEOUT` seconds for a slot and then get a 503, and
+`stats()` counts them.
+
+passlib is imported on the first hash, not when the app starts.
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from threading import BoundedSemaphore, Lock
+
+from exceptions import ApiErrorException
+
+# passlib's pbkdf2_sha256.default_rounds
+DEFAULT_ROUNDS = 29000
+
+
+def _pbkdf2_sha256():
+    from passlib.hash import pbkdf2_sha256  # pylint: disable=import-outside-toplevel
+    return pbkdf2_sha256
+
+
+def _hash_password(password, rounds):
+    return _pbkdf2_sha256().using(rounds=rounds).hash(password)
+
+
+def _verify_password(password, password_hash):
+    return _pbkdf2_sha256().verify(password, password_hash)
+
+
+class PasswordHasher:
+    """Hashes and verifies passwords, inline or on a process pool, with a
+    bounded number at once"""
+
+    def __init__(self):
+        self.rounds = DEFAULT_ROUNDS
+        self.workers = 0
+        self.queue_timeout = 0
+        self.pending = 0
+        self.max_pending_seen = 0
+        self.completed = 0
+        self.rejected = 0
+        self._slots = None
+        self._executor = None
+        self._pid = None
+        self._lock = Lock()
+
+    def init_app(self, app):
+        """Configures rounds and pool size from the app config"""
+        app.config.setdefault(
+            "PASSWORD_HASH_ROUNDS",
+            int(os.getenv("PASSWORD_HASH_ROUNDS", str(DEFAULT_ROUNDS))))
+        app.config.setdefault(
+            "PASSWORD_HASH_WORKERS",
+            int(os.getenv("PASSWORD_HASH_WORKERS", "0")))
+        app.config.setdefault(
+            "PASSWORD_HASH_MAX_PENDING",
+            int(os.getenv(
+                "PASSWORD_HASH_MAX_PENDING",
+                str(app.config["PASSWORD_HASH_WORKERS"] * 4 or 1))))
+        app.config.setdefault(
+            "PASSWORD_HASH_QUEUE_TIMEOUT",
+            float(os.getenv("PASSWORD_HASH_QUEUE_TIMEOUT", "5")))
+
+        self.rounds = app.config["PASSWORD_HASH_ROUNDS"]
+        self.workers = app.config["PASSWORD_HASH_WORKERS"]
+        self.queue_timeout = app.config["PASSWORD_HASH_QUEUE_TIMEOUT"]
+        self._slots = BoundedSemaphore(app.config["PASSWORD_HASH_MAX_PENDING"])
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+        self._executor = None
+
+    def hash(self, password: str) -> str:
+        """Hashes a password with the configured rounds"""
+        return self._run(_hash_password, password, self.rounds)
+
+    def verify(self, password: str, password_hash: str) -> bool:
+        """Checks a password against its hash"""
+        return self._run(_verify_password, password, password_hash)
+
+    def needs_rehash(self, password_hash: str) -> bool:
+        """Whether a hash was made with other settings than the configured
+        ones. Only parses the hash, it's cheap."""
+        return _pbkdf2_sha256().using(rounds=self.rounds).needs_update(password_hash)
+
+    def stats(self):
+        """Concurrency and queue counters of this worker"""
+        return {
+            "workers": self.workers,
+            "rounds": self.rounds,
+            "pending": self.pending,
+            "max_pending_seen": self.max_pending_seen,
+            "completed": self.completed,
+            "rejected": self.rejected,
+        }
+
+    def _run(self, func, *args):
+        if not self._slots.acquire(timeout=self.queue_timeout):
+            with self._lock:
+                self.rejected += 1
+            raise ApiErrorException(
+                503,
+                "Service Unavailable",
+                "Too many concurrent log ins, try again later",
+                {}
+            )
+
+        with self._lock:
+            self.pending += 1
+            self.max_pending_seen = max(self.max_pending_seen, self.pending)
+        try:
+            if not self.workers:
+                return func(*args)
+            return self._get_executor().submit(func, *args).result()
+        finally:
+            with self._lock:
+                self.pending -= 1
+                self.completed += 1
+            self._slots.release()
+
+    def _get_executor(self):
+        # Each (forked) worker process needs its own pool
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=get_context("forkserver"))
+                self._pid = os.getpid()
+            return self._executor
+
+
+password_hasher = PasswordHasher()
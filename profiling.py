@@ -0,0 +1,107 @@
+"""Sampling request profiler.
+
+A `PROFILE_SAMPLE_RATE` fraction of the requests (0 disables it) runs under a
+profiler, and the profiles of the ones slower than `PROFILE_THRESHOLD_MS` are
+saved in `PROFILE_DIR` (`instance/profiles` by default), named after the time,
+duration and endpoint of the request. `PROFILER` selects it:
+
+-   `cprofile`: `.prof` files for `python -m pstats` or snakeviz
+-   `pyinstrument`: `.html` call trees, needs `pip install pyinstrument`
+"""
+import cProfile
+import os
+import random
+import time
+import uuid
+
+from flask import g, request
+
+PROFILERS = ("cprofile", "pyinstrument")
+
+
+class RequestProfiler:
+    """Profiles a sample of the requests and keeps the slow ones"""
+
+    def __init__(self):
+        self.sample_rate = 0.0
+        self.threshold = 0.0
+        self.directory = None
+        self.profiler = "cprofile"
+
+    def init_app(self, app):
+        """Configures the sampling and registers the request hooks"""
+        app.config.setdefault(
+            "PROFILE_SAMPLE_RATE", float(os.getenv("PROFILE_SAMPLE_RATE", "0")))
+        app.config.setdefault(
+            "PROFILE_THRESHOLD_MS", float(os.getenv("PROFILE_THRESHOLD_MS", "500")))
+        app.config.setdefault(
+            "PROFILE_DIR",
+            os.getenv("PROFILE_DIR", os.path.join(app.instance_path, "profiles")))
+        app.config.setdefault("PROFILER", os.getenv("PROFILER", "cprofile"))
+
+        if app.config["PROFILER"] not in PROFILERS:
+            raise ValueError(f"PROFILER must be one of {', '.join(PROFILERS)}")
+        self.sample_rate = app.config["PROFILE_SAMPLE_RATE"]
+        self.threshold = app.config["PROFILE_THRESHOLD_MS"] / 1000
+        self.directory = app.config["PROFILE_DIR"]
+        self.profiler = app.config["PROFILER"]
+        if not self.sample_rate:
+            return
+
+        if self.profiler == "pyinstrument":
+            # Fail on start up rather than on the first sampled request
+            import pyinstrument  # pylint: disable=import-outside-toplevel,unused-import
+
+        @app.before_request
+        def start_profiler():
+            if random.random() >= self.sample_rate:
+                return
+            profiler = self._new_profiler()
+            try:
+                if self.profiler == "cprofile":
+                    profiler.enable()
+                else:
+                    profiler.start()
+            except ValueError:
+                # Another profiler is already active in this thread
+                return
+            g.profiler = (profiler, time.perf_counter())
+
+        @app.teardown_request
+        def stop_profiler(exc):
+            if "profiler" not in g:
+                return
+            profiler, start = g.pop("profiler")
+            if self.profiler == "cprofile":
+                profiler.disable()
+            else:
+                profiler.stop()
+
+            duration = time.perf_counter() - start
+            if duration >= self.threshold:
+                self._save(profiler, duration)
+
+    def _new_profiler(self):
+        if self.profiler == "cprofile":
+            return cProfile.Profile()
+        from pyinstrument import Profiler  # pylint: disable=import-outside-toplevel
+        return Profiler()
+
+    def _save(self, profiler, duration):
+        os.makedirs(self.directory, exist_ok=True)
+        name = "-".join([
+            time.strftime("%Y%m%dT%H%M%S"),
+            f"{duration * 1000:.0f}ms",
+            request.method,
+            request.endpoint or "unmatched",
+            uuid.uuid4().hex[:6],
+        ])
+        if self.profiler == "cprofile":
+            profiler.dump_stats(os.path.join(self.directory, name + ".prof"))
+        else:
+            with open(os.path.join(self.directory, name + ".html"), "w",
+                      encoding="utf-8") as output:
+                output.write(profiler.output_html())
+
+
+request_profiler = RequestProfiler()
@@ -0,0 +1,276 @@
+"""Rate limiting and concurrency limits, checked before the view runs.
+
+Each request spends a token of a budget: the one its view is marked with by
+`@rate_limit("expensive")`, or else the one of its blueprint (`items`,
+`stores`...), or else `default`. Collection reads spend `list` for each page
+and `expensive` for streams, so walking pages doesn't use up the budget of
+bulk writes. `RATE_LIMITS` sets the budgets as `name=<requests>/<seconds>`
+pairs, like `default=100/10,expensive=10/10`: a
+bucket of `requests` tokens per client refilled over `seconds`. Budgets not
+listed use `default`. Clients are told apart by the identity of their token,
+or by their address if they have none, and get a 429 with `Retry-After` once
+their bucket is empty.
+
+Behind proxies or a gateway every client has the address of the last proxy,
+so anonymous clients would share one bucket. `TRUSTED_PROXIES` is the number
+of proxies in front of the app: with it the address is read from
+`X-Forwarded-For`, as set by those proxies (werkzeug's `ProxyFix`). Don't set
+it higher than the number of proxies, clients could pick their address.
+
+`CONCURRENCY_LIMITS`, like `expensive=4`, caps how many requests of a budget a
+worker handles at once. Requests over it get a 503 with `Retry-After` right
+away, before touching the database.
+
+Buckets live in this worker (`RATE_LIMIT_BACKEND=local`, default) or in a
+key/value store shared by every worker (`RATE_LIMIT_BACKEND=kv`): redis at
+`RATE_LIMIT_KV_URL`, or an in-process stand-in when no url is set.
+"""
+import math
+import os
+import time
+from threading import BoundedSemaphore, Lock
+
+from flask import current_app, g, request
+from flask_jwt_extended import decode_token
+from marshmallow import fields
+from werkzeug.middleware.proxy_fix import ProxyFix
+
+from cache import LRUCache
+from exceptions import ApiErrorException
+from kvstore import LocalKeyValueStore, kv_client
+from streaming import wants_stream
+
+DEFAULT_BUDGET = "default"
+
+# Takes a token from the bucket at KEYS[1] if there's one. ARGV: capacity,
+# tokens per second, current time. Returns whether it took one and the tokens
+# left, as a string since Lua numbers are truncated to integers in replies.
+TAKE_SCRIPT = """
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local tokens = tonumber(state[1]) or capacity
+local updated = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - updated) * rate)
+local taken = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    taken = 1
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 1)
+return {taken, tostring(tokens)}
+"""
+
+
+def rate_limit(budget):
+    """Marks a view as spending tokens of `budget`, a name or a function
+    returning it for the current request"""
+    def decorator(func):
+        func.rate_limit_budget = budget
+        return func
+
+    return decorator
+
+
+def collection_budget():
+    """Budget of a collection read: `expensive` when streamed, `list` for a
+    page"""
+    stream = request.args.get("stream") in fields.Boolean.truthy
+    return "expensive" if wants_stream({"stream": stream}) else "list"
+
+
+def parse_limits(value, parse):
+    """`name=value,...` config into a dict"""
+    if isinstance(value, dict):
+        return value
+    limits = {}
+    for pair in filter(None, (pair.strip() for pair in value.split(","))):
+        name, limit = pair.split("=", 1)
+        limits[name.strip()] = parse(limit.strip())
+    return limits
+
+
+def parse_rate(value):
+    """`<requests>/<seconds>` into (capacity, tokens per second)"""
+    requests, seconds = value.split("/", 1)
+    return int(requests), int(requests) / float(seconds)
+
+
+def take(state, capacity, rate, now):
+    """Refills a (tokens, updated) bucket and takes a token from it. Returns
+    the new state and the seconds until a token is available, 0 if one was
+    taken."""
+    tokens, updated = state or (capacity, now)
+    tokens = min(capacity, tokens + max(0.0, now - updated) * rate)
+    if tokens >= 1:
+        return (tokens - 1, now), 0
+    return (tokens, now), (1 - tokens) / rate
+
+
+class LocalRateLimitBackend:
+    """Token buckets of this worker"""
+
+    def __init__(self, size):
+        self.buckets = LRUCache(size)
+        self._lock = Lock()
+
+    def take(self, key, capacity, rate):
+        """Takes a token, returns the seconds to wait if there was none"""
+        now = time.time()
+        with self._lock:
+            state, wait = take(self.buckets.get(key), capacity, rate, now)
+            self.buckets.set(key, state, now + capacity / rate)
+        return wait
+
+
+class KeyValueRateLimitBackend:
+    """Token buckets in a key/value store shared by every worker"""
+
+    KEY_PREFIX = "ratelimit:"
+
+    def __init__(self, client):
+        self.client = client
+        self._lock = Lock()
+        self._script = None
+        if not isinstance(client, LocalKeyValueStore):
+            self._script = client.register_script(TAKE_SCRIPT)
+
+    def take(self, key, capacity, rate):
+        """Takes a token, returns the seconds to wait if there was none"""
+        key = self.KEY_PREFIX + key
+        now = time.time()
+        if self._script is None:
+            # The stand-in only lives in this process, a lock makes it atomic
+            with self._lock:
+                state, wait = take(self.client.get(key), capacity, rate, now)
+                self.client.set(key, state, ex=math.ceil(capacity / rate) + 1)
+            return wait
+
+        taken, tokens = self._script(keys=[key], args=[capacity, rate, now])
+        return 0 if taken else (1 - float(tokens)) / rate
+
+
+def client_key():
+    """Identity of the token of the request, or its address without one,
+    behind `TRUSTED_PROXIES` proxies. The token is only decoded here, the view
+    still verifies it."""
+    header = request.headers.get("Authorization", "")
+    if header.startswith("Bearer "):
+        try:
+            return f"user:{decode_token(header[7:])['sub']}"
+        except Exception:  # pylint: disable=broad-except
+            pass
+    return f"addr:{request.remote_addr}"
+
+
+class RateLimiter:
+    """Admission control by rate and concurrency, per budget"""
+
+    def __init__(self):
+        self.enabled = False
+        self.backend = None
+        self.rates = {}
+        self.slots = {}
+        self.limited = 0
+        self.shed = 0
+
+    def init_app(self, app):
+        """Configures the budgets from the app config and registers the
+        admission hooks"""
+        app.config.setdefault(
+            "RATE_LIMIT_ENABLED", os.getenv("RATE_LIMIT_ENABLED", "1") == "1")
+        app.config.setdefault(
+            "RATE_LIMITS",
+            os.getenv(
+                "RATE_LIMITS",
+                "default=100/10,list=50/10,expensive=10/10,auth=10/60"
+            ))
+        app.config.setdefault(
+            "CONCURRENCY_LIMITS", os.getenv("CONCURRENCY_LIMITS", "expensive=4"))
+        app.config.setdefault(
+            "RATE_LIMIT_BACKEND", os.getenv("RATE_LIMIT_BACKEND", "local"))
+        app.config.setdefault("RATE_LIMIT_KV_URL", os.getenv("RATE_LIMIT_KV_URL"))
+        app.config.setdefault(
+            "RATE_LIMIT_CACHE_SIZE", int(os.getenv("RATE_LIMIT_CACHE_SIZE", "100000")))
+        app.config.setdefault(
+            "TRUSTED_PROXIES", int(os.getenv("TRUSTED_PROXIES", "0")))
+
+        self.enabled = app.config["RATE_LIMIT_ENABLED"]
+        self.rates = parse_limits(app.config["RATE_LIMITS"], parse_rate)
+        self.slots = {
+            budget: BoundedSemaphore(limit)
+            for budget, limit in parse_limits(
+                app.config["CONCURRENCY_LIMITS"], int).items()
+            if limit
+        }
+        if app.config["RATE_LIMIT_BACKEND"] == "kv":
+            self.backend = KeyValueRateLimitBackend(
+                kv_client(app.config["RATE_LIMIT_KV_URL"]))
+        else:
+            self.backend = LocalRateLimitBackend(app.config["RATE_LIMIT_CACHE_SIZE"])
+        if app.config["TRUSTED_PROXIES"]:
+            # `request.remote_addr` is the client the proxies saw
+            app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config["TRUSTED_PROXIES"])
+
+        @app.before_request
+        def admit_request():
+            if self.enabled:
+                self.admit(self.budget())
+
+        @app.teardown_request
+        def release_slot(exc):
+            slot = g.pop("concurrency_slot", None)
+            if slot is not None:
+                slot.release()
+
+    def stats(self):
+        """Rejection counters of this worker"""
+        return {
+            "enabled": self.enabled,
+            "limited": self.limited,
+            "shed": self.shed,
+        }
+
+    def budget(self) -> str:
+        """Budget the current request spends"""
+        view = current_app.view_functions.get(request.endpoint)
+        view_class = getattr(view, "view_class", None)
+        method = getattr(view_class, request.method.lower(), view)
+        budget = getattr(method, "rate_limit_budget", None)
+        if callable(budget):
+            budget = budget()
+        return budget or request.blueprint or DEFAULT_BUDGET
+
+    def admit(self, budget):
+        """Takes a token and a concurrency slot of `budget`, or fails with 429
+        or 503"""
+        rate = self.rates.get(budget, self.rates.get(DEFAULT_BUDGET))
+        if rate is not None:
+            wait = self.backend.take(f"{budget}:{client_key()}", *rate)
+            if wait:
+                self.limited += 1
+                raise ApiErrorException(
+                    429,
+                    "Too Many Requests",
+                    "Rate limit exceeded, try again later",
+                    {"budget": budget, "retry_after": wait},
+                    headers={"Retry-After": str(math.ceil(wait))}
+                )
+
+        slot = self.slots.get(budget)
+        if slot is not None:
+            if not slot.acquire(blocking=False):
+                self.shed += 1
+                raise ApiErrorException(
+                    503,
+                    "Service Unavailable",
+                    "Too many concurrent requests, try again later",
+                    {"budget": budget},
+                    headers={"Retry-After": "1"}
+                )
+            g.concurrency_slot = slot
+
+
+rate_limiter = RateLimiter()
@@ -0,0 +1,159 @@
+"""Read replica routing.
+
+`DATABASE_REPLICA_URLS`, a comma separated list of database urls, adds the
+replicas to `SQLALCHEMY_BINDS` as `replica1`, `replica2`... Every bind whose
+key starts with `replica` serves the reads of `GET` and `HEAD` requests,
+chosen with `REPLICA_STRATEGY`: `round_robin` or `least_connections` (the one
+with the fewest connections checked out of its pool in this worker).
+
+Everything else goes to the primary: other methods, flushes and write
+statements, work outside requests (commands, background jobs), and the reads
+of a client for `REPLICA_STICKY_SECONDS` after one of its writes, so it reads
+what it wrote even if the replicas lag behind. Those clients are kept in
+redis at `REPLICA_KV_URL`, which is required with replicas since the next
+request of a client may land on another worker (unless
+`REPLICA_STICKY_SECONDS=0`). Single statements that must see the latest
+writes go to the primary with `bind_arguments={"primary": True}`.
+
+Reads from a lagging replica can't leave stale entries in the response cache:
+they're keyed by the version read from that same replica (see `cache.py`).
+"""
+import os
+from itertools import count
+from threading import Lock
+
+from flask import g, has_request_context, request
+from flask_jwt_extended import get_jwt_identity
+from flask_sqlalchemy.session import Session
+from sqlalchemy import UpdateBase
+
+from kvstore import kv_client
+
+REPLICA_PREFIX = "replica"
+
+SAFE_METHODS = ("GET", "HEAD", "OPTIONS")
+
+STRATEGIES = ("round_robin", "least_connections")
+
+
+def client_key():
+    """Identity of the client of the request, its address if anonymous"""
+    try:
+        identity = get_jwt_identity()
+    except RuntimeError:
+        identity = None
+    if identity is not None:
+        return f"user:{identity}"
+    return f"addr:{request.remote_addr}"
+
+
+class ReplicaRouter:
+    """Chooses the replica serving the reads of a request"""
+
+    KEY_PREFIX = "primary:"
+
+    def __init__(self):
+        self.strategy = "round_robin"
+        self.sticky_seconds = 0
+        self.client = None
+        self._counter = count()
+        self._lock = Lock()
+
+    def init_app(self, app):
+        """Adds the replicas to the binds and registers the read-your-writes
+        hook. Call it before `db.init_app`."""
+        app.config.setdefault(
+            "REPLICA_STRATEGY", os.getenv("REPLICA_STRATEGY", "round_robin"))
+        app.config.setdefault(
+            "REPLICA_STICKY_SECONDS",
+            float(os.getenv("REPLICA_STICKY_SECONDS", "5")))
+        app.config.setdefault("REPLICA_KV_URL", os.getenv("REPLICA_KV_URL"))
+
+        if app.config["REPLICA_STRATEGY"] not in STRATEGIES:
+            raise ValueError(
+                f"REPLICA_STRATEGY must be one of {', '.join(STRATEGIES)}")
+        self.strategy = app.config["REPLICA_STRATEGY"]
+        self.sticky_seconds = app.config["REPLICA_STICKY_SECONDS"]
+
+        urls = [
+            url.strip()
+            for url in os.getenv("DATABASE_REPLICA_URLS", "").split(",")
+            if url.strip()
+        ]
+        binds = app.config.setdefault("SQLALCHEMY_BINDS", {})
+        for number, url in enumerate(urls, start=1):
+            binds.setdefault(f"{REPLICA_PREFIX}{number}", url)
+
+        has_replicas = any(
+            str(key).startswith(REPLICA_PREFIX) for key in binds if key is not None)
+        if has_replicas and self.sticky_seconds and not app.config["REPLICA_KV_URL"]:
+            # An in-process store would only make the worker that handled
+            # the write read the primary
+            raise ValueError(
+                "REPLICA_KV_URL is required with read replicas, "
+                "or REPLICA_STICKY_SECONDS=0")
+        self.client = kv_client(app.config["REPLICA_KV_URL"])
+
+        @app.after_request
+        def stick_to_primary(response):
+            if (
+                request.method not in SAFE_METHODS
+                and response.status_code < 400
+                and self.sticky_seconds
+            ):
+                self.client.set(
+                    self.KEY_PREFIX + client_key(), "1",
+                    ex=max(1, round(self.sticky_seconds)))
+            return response
+
+    def reads_primary(self) -> bool:
+        """Whether the reads of the current request must go to the primary"""
+        if request.method not in SAFE_METHODS:
+            return True
+        if "reads_primary" not in g:
+            g.reads_primary = bool(
+                self.sticky_seconds
+                and self.client.exists(self.KEY_PREFIX + client_key()))
+        return g.reads_primary
+
+    def choose(self, engines):
+        """Replica engine serving the reads of the current request, None for
+        the primary"""
+        replicas = [
+            engine for key, engine in sorted(engines.items(), key=lambda e: str(e[0]))
+            if key is not None and key.startswith(REPLICA_PREFIX)
+        ]
+        if not replicas or self.reads_primary():
+            return None
+        if self.strategy == "least_connections":
+            return min(replicas, key=checked_out)
+        with self._lock:
+            return replicas[next(self._counter) % len(replicas)]
+
+
+def checked_out(engine) -> int:
+    """Connections of an engine's pool in use in this worker"""
+    checkedout = getattr(engine.pool, "checkedout", None)
+    return checkedout() if checkedout is not None else 0
+
+
+replica_router = ReplicaRouter()
+
+
+class RoutingSession(Session):
+    """Session reading from a replica while handling safe requests"""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if (
+            bind is None
+            and not kwargs.get("primary")
+            and has_request_context()
+            and not self._flushing
+            and not isinstance(clause, UpdateBase)
+        ):
+            # One replica per request, so its reads see the same snapshot
+            if "read_bind" not in g:
+                g.read_bind = replica_router.choose(self._db.engines)
+            if g.read_bind is not None:
+                return g.read_bind
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
@@ -0,0 +1,97 @@
+"""Operational resources"""
+from flask.views import MethodView
+from flask_smorest import Blueprint
+
+from cache import response_cache
+from db import db
+from exceptions import ApiErrorException
+from instrumentation import pool_metrics
+from jobs import jobs
+from passwords import password_hasher
+from ratelimit import rate_limiter
+from tokens import token_cache
+from schemas import (
+    CacheStatsSchema,
+    PoolStatsSchema,
+    PasswordHashingStatsSchema,
+    RateLimitStatsSchema,
+    TokenCacheStatsSchema,
+    JobSchema
+)
+from resources.decorators import admin_required
+
+blp = Blueprint("admin", __name__, description="Operational information")
+
+
+@blp.route('/cache/stats')
+class CacheStats(MethodView):
+    """Cache stats method view"""
+
+    @admin_required
+    @blp.response(200, CacheStatsSchema)
+    def get(self):
+        """Get response cache counters of this worker"""
+        return response_cache.stats()
+
+
+@blp.route('/db/pool')
+class PoolStats(MethodView):
+    """Connection pool stats method view"""
+
+    @admin_required
+    @blp.response(200, PoolStatsSchema)
+    def get(self):
+        """Get connection pool state and counters of this worker"""
+        return pool_metrics.stats(db.engine.pool)
+
+
+@blp.route('/passwords/stats')
+class PasswordHashingStats(MethodView):
+    """Password hashing stats method view"""
+
+    @admin_required
+    @blp.response(200, PasswordHashingStatsSchema)
+    def get(self):
+        """Get password hashing pool counters of this worker"""
+        return password_hasher.stats()
+
+
+@blp.route('/ratelimit/stats')
+class RateLimitStats(MethodView):
+    """Rate limiter stats method view"""
+
+    @admin_required
+    @blp.response(200, RateLimitStatsSchema)
+    def get(self):
+        """Get rate and concurrency limiter counters of this worker"""
+        return rate_limiter.stats()
+
+
+@blp.route('/tokens/stats')
+class TokenCacheStats(MethodView):
+    """Token cache stats method view"""
+
+    @admin_required
+    @blp.response(200, TokenCacheStatsSchema)
+    def get(self):
+        """Get verified token cache counters of this worker"""
+        return token_cache.stats()
+
+
+@blp.route('/jobs/<string:job_id>')
+class Job(MethodView):
+    """Background job method view"""
+
+    @admin_required
+    @blp.response(200, JobSchema)
+    def get(self, job_id):
+        """Get the status of a background job"""
+        job = jobs.get(job_id)
+        if job is None:
+            raise ApiErrorException(
+                404,
+                "Not Found",
+                "Job not found or expired",
+                {"job_id": job_id}
+            )
+        return job
@@ -2,27 +2,33 @@
 from functools import wraps
 from flask_jwt_extended import jwt_required, get_jwt
 from exceptions import ApiErrorException
+from tokens import ADMIN_PERMISSION, token_cache
 
 
-def admin_required(func):
-    """Decorator to check if the user has admin privileges."""
-    @wraps(func)
-    @jwt_required()
-    def wrapper(*args, **kwargs):
-        # Retrieve the JWT from the request
-        jwt = get_jwt()
+def permission_required(permission):
+    """Decorator to check if the token grants `permission`. Reads the claims
+    of the token only, never the database."""
+    def decorator(func):
+        @wraps(func)
+        @jwt_required()
+        def wrapper(*args, **kwargs):
+            # Permissions embedded in the JWT at log in
+            if permission not in token_cache.token_permissions(get_jwt()):
+                raise ApiErrorException(
+                    403,
+                    "Forbidden",
+                    f"{permission.capitalize()} privilege required",
+                    {}
+                )
+
+            # Call the original function if the token grants the permission
+            return func(*args, **kwargs)
 
-        # Check if the 'is_admin' field is present and True
-        if not jwt.get("is_admin"):
-            # Raise your custom exception if the user is not an admin
-            raise ApiErrorException(
-                403,
-                "Forbidden",
-                "Admin privilege required",
-                {}
-            )
+        return wrapper
 
-        # Call the original function if the user is an admin
-        return func(*args, **kwargs)
+    return decorator
 
-    return wrapper
+
+def admin_required(func):
+    """Decorator to check if the user has admin privileges."""
+    return permission_required(ADMIN_PERMISSION)(func)
@@ -1,14 +1,40 @@
 """Store resource"""
 
+from collections import defaultdict
+
+from sqlalchemy import select, insert, update
 from sqlalchemy.exc import SQLAlchemyError, IntegrityError
 from flask.views import MethodView
+from werkzeug.http import quote_etag
 from flask_smorest import Blueprint
 from flask_jwt_extended import jwt_required
 from exceptions import ApiErrorException
-from schemas import ItemSchema, ItemUpdateSchema
-from models import ItemModel
-from db import db
+from ratelimit import rate_limit, collection_budget
+from schemas import (
+    ItemSchema,
+    ItemUpdateSchema,
+    ItemQueryArgsSchema,
+    FieldsQueryArgsSchema,
+    ItemBulkUpdateSchema,
+    BulkItemResultSchema
+)
+from models import ItemModel, StoreModel
+from db import db, chunks
+from pagination import paginate
+from loaders import ITEM_LOADERS
+from fieldsets import sparse_fieldset
+from serializers import SparseResult
+from streaming import wants_stream, stream_response
 from resources.decorators import admin_required
+from search import search_index
+from etags import (
+    conditional,
+    item_version,
+    page_etag,
+    is_not_modified,
+    not_modified,
+    touch_stores
+)
 
 blp = Blueprint("items", __name__, description="Operation on items")
 
@@ -17,11 +43,44 @@ blp = Blueprint("items", __name__, description="Operation on items")
 class Items(MethodView):
     """Items method view"""
 
+    @rate_limit(collection_budget)
     @jwt_required()
+    @blp.arguments(ItemQueryArgsSchema, location="query")
     @blp.response(200, ItemSchema(many=True))
-    def get(self):
-        """GET items"""
-        return ItemModel.query.all()
+    def get(self, query_args):
+        """GET items, one page at a time or streamed as NDJSON"""
+        fields, loaders = sparse_fieldset(ItemSchema, ITEM_LOADERS, query_args)
+        query = ItemModel.query.options(*loaders)
+
+        if "store_id" in query_args:
+            query = query.filter(ItemModel.store_id == query_args["store_id"])
+        if "name" in query_args:
+            query = query.filter(ItemModel.name == query_args["name"])
+        if "min_price" in query_args:
+            query = query.filter(ItemModel.price >= query_args["min_price"])
+        if "max_price" in query_args:
+            query = query.filter(ItemModel.price <= query_args["max_price"])
+
+        if wants_stream(query_args):
+            return stream_response(query, ItemModel.id, ItemSchema(only=fields))
+
+        etag = page_etag(
+            "items",
+            query.join(ItemModel.store).with_entities(ItemModel.id, StoreModel.version),
+            ItemModel.id,
+            query_args
+        )
+        if is_not_modified(etag):
+            return not_modified(etag)
+
+        items, headers = paginate(
+            query,
+            ItemModel.id,
+            query_args.get("cursor"),
+            query_args["limit"]
+        )
+        headers["ETag"] = quote_etag(etag)
+        return SparseResult(items, fields), headers
 
     @admin_required
     @blp.arguments(ItemSchema)
@@ -30,10 +89,10 @@ class Items(MethodView):
         """POST items"""
         item = ItemModel(**item_data)
 
-        validate_item_name(item_data["name"], item_data["store_id"])
-
+        # Name uniqueness per store is enforced by ix_items_store_id_name
         try:
             db.session.add(item)
+            touch_stores([item.store_id])
             db.session.commit()
             return item
 
@@ -41,9 +100,9 @@ class Items(MethodView):
             raise ApiErrorException(
                 422,
                 "Unprocessable Entity",
-                "Item name already in use",
+                "Item name already in use for store",
                 {"item": item_data, "error": str(e)}
-            ) from IntegrityError
+            ) from e
 
         except SQLAlchemyError as e:
             raise ApiErrorException(
@@ -54,20 +113,171 @@ class Items(MethodView):
             ) from SQLAlchemyError
 
 
+@blp.route('/items/bulk')
+class ItemsBulk(MethodView):
+    """Bulk items method view"""
+
+    @rate_limit("expensive")
+    @admin_required
+    @blp.arguments(ItemSchema(many=True))
+    @blp.response(200, BulkItemResultSchema(many=True))
+    def post(self, items_data):
+        """POST many items in a single transaction.
+
+        Items that fail validation are reported in their result row and the
+        rest are created.
+        """
+        errors = validate_bulk_item_names(items_data)
+        rows = [
+            (index, item_data)
+            for index, item_data in enumerate(items_data)
+            if errors[index] is None
+        ]
+
+        try:
+            ids = []
+            for chunk in chunks([item_data for _, item_data in rows]):
+                ids += db.session.scalars(
+                    insert(ItemModel).returning(
+                        ItemModel.id, sort_by_parameter_order=True),
+                    chunk
+                ).all()
+            touch_stores(item_data["store_id"] for _, item_data in rows)
+            search_index.mark("item", ids)
+            db.session.commit()
+        except IntegrityError as e:
+            db.session.rollback()
+            raise ApiErrorException(
+                422,
+                "Unprocessable Entity",
+                "Item name already in use",
+                {"error": str(e)}
+            ) from e
+        except SQLAlchemyError as e:
+            db.session.rollback()
+            raise ApiErrorException(
+                500,
+                "Internal Server Error",
+                "Could not create items",
+                {"error": str(e)}
+            ) from SQLAlchemyError
+
+        results = bulk_error_results(errors)
+        for (index, item_data), item_id in zip(rows, ids):
+            results[index] = {
+                "index": index,
+                "status": "created",
+                "item": {**item_data, "id": item_id}
+            }
+        return results
+
+    @rate_limit("expensive")
+    @admin_required
+    @blp.arguments(ItemBulkUpdateSchema(many=True))
+    @blp.response(200, BulkItemResultSchema(many=True))
+    def put(self, items_data):
+        """PUT many items in a single transaction.
+
+        Existing items get their name and price updated, the rest are created
+        with the given id.
+        """
+        existing = {}
+        for chunk in chunks([item_data["id"] for item_data in items_data]):
+            for item_id, store_id, description in db.session.execute(
+                select(ItemModel.id, ItemModel.store_id, ItemModel.description)
+                .where(ItemModel.id.in_(chunk))
+            ):
+                existing[item_id] = (store_id, description)
+
+        errors = [None] * len(items_data)
+        for index, item_data in enumerate(items_data):
+            if item_data["id"] in existing:
+                item_data["store_id"] = existing[item_data["id"]][0]
+            elif "store_id" not in item_data:
+                errors[index] = "store_id is required to create an item"
+        checked = iter(validate_bulk_item_names(
+            [item_data for item_data in items_data if "store_id" in item_data]))
+        for index, item_data in enumerate(items_data):
+            if "store_id" in item_data:
+                errors[index] = next(checked)
+
+        updates = []
+        inserts = []
+        for index, item_data in enumerate(items_data):
+            if errors[index] is not None:
+                continue
+            if item_data["id"] in existing:
+                updates.append((index, item_data))
+            else:
+                inserts.append((index, item_data))
+
+        try:
+            for chunk in chunks(updates):
+                db.session.execute(update(ItemModel), [
+                    {
+                        "id": item_data["id"],
+                        "name": item_data["name"],
+                        "price": item_data["price"]
+                    }
+                    for _, item_data in chunk
+                ])
+            for chunk in chunks(inserts):
+                db.session.execute(
+                    insert(ItemModel), [item_data for _, item_data in chunk])
+            touch_stores(item_data["store_id"] for _, item_data in updates + inserts)
+            search_index.mark(
+                "item", (item_data["id"] for _, item_data in updates + inserts))
+            db.session.commit()
+        except IntegrityError as e:
+            db.session.rollback()
+            raise ApiErrorException(
+                422,
+                "Unprocessable Entity",
+                "Item name already in use",
+                {"error": str(e)}
+            ) from e
+        except SQLAlchemyError as e:
+            db.session.rollback()
+            raise ApiErrorException(
+                500,
+                "Internal Server Error",
+                "Could not update items",
+                {"error": str(e)}
+            ) from SQLAlchemyError
+
+        results = bulk_error_results(errors)
+        for index, item_data in updates:
+            item = {
+                "id": item_data["id"],
+                "name": item_data["name"],
+                "price": item_data["price"],
+                "description": existing[item_data["id"]][1]
+            }
+            results[index] = {"index": index, "status": "updated", "item": item}
+        for index, item_data in inserts:
+            results[index] = {"index": index, "status": "created", "item": item_data}
+        return results
+
+
 @blp.route('/items/<int:item_id>')
 class Item(MethodView):
     """Item method view"""
 
     @jwt_required()
+    @conditional("item", item_version, cached=True)
+    @blp.arguments(FieldsQueryArgsSchema, location="query")
     @blp.response(200, ItemSchema)
-    def get(self, item_id):
+    def get(self, query_args, item_id):
         """Get item by id"""
-        item = ItemModel.query.get_or_404(item_id)
-        return item
+        fields, loaders = sparse_fieldset(ItemSchema, ITEM_LOADERS, query_args)
+        item = ItemModel.query.options(*loaders).get_or_404(item_id)
+        return SparseResult(item, fields)
 
     @admin_required
+    @conditional("item", item_version)
     @blp.arguments(ItemUpdateSchema)
     @blp.response(200, ItemSchema)
+    @blp.alt_response(412, description="Returned if If-Match doesn't match the item ETag")
     def put(self, item_data, item_id):
         """PUT items"""
         item = ItemModel.query.get(item_id)
@@ -75,19 +285,19 @@ class Item(MethodView):
         if item:
             item.price = item_data["price"]
             item.name = item_data["name"]
-            validate_item_name(item_data["name"], item.store_id, item.id)
         else:
             item = ItemModel(**item_data)
 
         try:
             db.session.add(item)
+            touch_stores([item.store_id])
             db.session.commit()
             return item
         except IntegrityError as e:
             raise ApiErrorException(
                 422,
                 "Unprocessable Entity",
-                "Item name already in use",
+                "Item name already in use for store",
                 {"item": item_data, "error": str(e)}
             ) from SQLAlchemyError
         except SQLAlchemyError as e:
@@ -99,27 +309,64 @@ class Item(MethodView):
             ) from SQLAlchemyError
 
     @admin_required
+    @conditional("item", item_version)
     @blp.response(204)
+    @blp.alt_response(412, description="Returned if If-Match doesn't match the item ETag")
     def delete(self, item_id):
         """Delete item by id"""
         item = ItemModel.query.get_or_404(item_id)
+        touch_stores([item.store_id])
         db.session.delete(item)
         db.session.commit()
 
 
-def validate_item_name(item_name: str, store_id: str, current_item_id=None):
-    """Checks an item name is unique for store"""
-    existing_item = ItemModel.query.filter(
-        ItemModel.store_id == store_id, ItemModel.name == item_name
-    ).first()
+def validate_bulk_item_names(items_data):
+    """Checks the stores exist and the item names are unique for their store,
+    with one query per store instead of one per item.
+
+    Returns the error message of each item, or None if it's valid.
+    """
+    names_by_store = defaultdict(set)
+    for item_data in items_data:
+        names_by_store[item_data["store_id"]].add(item_data["name"])
+
+    store_ids = set()
+    for chunk in chunks(list(names_by_store)):
+        store_ids.update(db.session.scalars(
+            select(StoreModel.id).where(StoreModel.id.in_(chunk))
+        ))
+
+    taken = {}
+    for store_id in store_ids:
+        for chunk in chunks(list(names_by_store[store_id])):
+            for item_id, name in db.session.execute(
+                select(ItemModel.id, ItemModel.name).where(
+                    ItemModel.store_id == store_id, ItemModel.name.in_(chunk))
+            ):
+                taken[(store_id, name)] = item_id
+
+    errors = []
+    seen = set()
+    for item_data in items_data:
+        key = (item_data["store_id"], item_data["name"])
+        if item_data["store_id"] not in store_ids:
+            errors.append("Store not found")
+        elif key in taken and taken[key] != item_data.get("id"):
+            errors.append("Item name already in use for store")
+        elif key in seen:
+            errors.append("Item name repeated in request")
+        else:
+            errors.append(None)
+        seen.add(key)
+
+    return errors
+
 
-    if existing_item and (current_item_id is None or current_item_id != existing_item.id):
-        print("Existing item:")
-        print(existing_item.id)
+def bulk_error_results(errors):
+    """Result rows for the items that failed validation"""
+    return [
+        {"index": index, "status": "error", "message": error}
+        if error is not None else None
+        for index, error in enumerate(errors)
+    ]
 
-        raise ApiErrorException(
-            422,
-            "Unprocessable Entity",
-            "Item name already in use for store",
-            {"item_name": item_name}
-        ) from SQLAlchemyError
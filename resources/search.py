@@ -0,0 +1,46 @@
+"""Search resource"""
+import json
+
+from flask.views import MethodView
+from flask_smorest import Blueprint
+from flask_jwt_extended import jwt_required
+
+from pagination import PAGINATION_HEADER, encode_cursor, decode_cursor
+from ratelimit import rate_limit
+from schemas import SearchQueryArgsSchema, SearchResultSchema
+from search import search_index
+
+blp = Blueprint("search", __name__, description="Search items and tags")
+
+
+@blp.route('/search')
+class Search(MethodView):
+    """Search method view"""
+
+    @rate_limit("expensive")
+    @jwt_required()
+    @blp.arguments(SearchQueryArgsSchema, location="query")
+    @blp.response(200, SearchResultSchema(many=True))
+    def get(self, query_args):
+        """Search items and tags by the start of the words of their name or
+        description, best matches first"""
+        # Results are ranked, so the cursor is the offset of the next page
+        offset = decode_cursor(query_args["cursor"]) if "cursor" in query_args else 0
+        limit = query_args["limit"]
+        results = search_index.search(
+            query_args["q"],
+            store_id=query_args.get("store_id"),
+            kind=query_args.get("type"),
+            offset=offset,
+            limit=limit + 1
+        )
+
+        next_cursor = None
+        if len(results) > limit:
+            results = results[:limit]
+            next_cursor = encode_cursor(offset + limit)
+
+        headers = {
+            PAGINATION_HEADER: json.dumps({"next": next_cursor, "limit": limit})
+        }
+        return results, headers
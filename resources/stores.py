@@ -1,27 +1,114 @@
 """Store resource"""
 
+from sqlalchemy import delete, func, select
 from sqlalchemy.exc import SQLAlchemyError, IntegrityError
+from flask import current_app, url_for
 from flask.views import MethodView
+from werkzeug.http import quote_etag
 from flask_smorest import Blueprint
 from flask_jwt_extended import jwt_required
 from exceptions import ApiErrorException
-from schemas import StoreSchema
-from models import StoreModel
+from ratelimit import rate_limit, collection_budget
+from schemas import (
+    StoreSchema,
+    StoreQueryArgsSchema,
+    FieldsQueryArgsSchema,
+    StoreStatsSchema,
+    StoreStatsDetailSchema,
+    StoreDeleteQueryArgsSchema,
+    JobSchema
+)
+from models import StoreModel, ItemModel, TagModel, ItemsTagsModel, StoreStatsModel
 from db import db
+from pagination import paginate
+from loaders import STORE_LOADERS
+from fieldsets import sparse_fieldset
+from serializers import SparseResult
+from streaming import wants_stream, stream_response
 from resources.decorators import admin_required
+from stats import store_stats
+from search import search_index
+from jobs import jobs
+from etags import (
+    conditional,
+    store_version,
+    page_etag,
+    is_not_modified,
+    not_modified
+)
 
 blp = Blueprint("stores", __name__, description="Operation on stores")
 
 
+def delete_store(store_id):
+    """Deletes a store with its items, tags and their links, one statement
+    per table in a single transaction. Nothing is loaded: the search index
+    drops the store's documents by store id, and cached responses go stale
+    with the store version."""
+    db.session.execute(
+        delete(ItemsTagsModel).where(
+            ItemsTagsModel.item_id.in_(
+                select(ItemModel.id).where(ItemModel.store_id == store_id))
+            | ItemsTagsModel.tag_id.in_(
+                select(TagModel.id).where(TagModel.store_id == store_id))
+        )
+    )
+    db.session.execute(delete(ItemModel).where(ItemModel.store_id == store_id))
+    db.session.execute(delete(TagModel).where(TagModel.store_id == store_id))
+    db.session.execute(
+        delete(StoreStatsModel).where(StoreStatsModel.store_id == store_id))
+    db.session.execute(delete(StoreModel).where(StoreModel.id == store_id))
+    search_index.mark_store_deleted(store_id)
+    db.session.commit()
+
+
+def many_items(store_id) -> bool:
+    """Whether a store has more items than deleting them in the request
+    should take, see STORE_DELETE_BACKGROUND_ITEMS"""
+    threshold = current_app.config["STORE_DELETE_BACKGROUND_ITEMS"]
+    if not threshold:
+        return False
+    item_count = db.session.scalar(
+        select(func.count(ItemModel.id)).where(ItemModel.store_id == store_id))
+    return item_count > threshold
+
+
 @blp.route('/stores')
 class Stores(MethodView):
     """Stores method view"""
 
+    @rate_limit(collection_budget)
     @jwt_required()
+    @blp.arguments(StoreQueryArgsSchema, location="query")
     @blp.response(200, StoreSchema(many=True))
-    def get(self):
-        """GET stores"""
-        return StoreModel.query.all()
+    def get(self, query_args):
+        """GET stores, one page at a time or streamed as NDJSON"""
+        fields, loaders = sparse_fieldset(StoreSchema, STORE_LOADERS, query_args)
+        query = StoreModel.query.options(*loaders)
+
+        if "name" in query_args:
+            query = query.filter(StoreModel.name == query_args["name"])
+
+        if wants_stream(query_args):
+            return stream_response(query, StoreModel.id, StoreSchema(only=fields))
+
+        etag = page_etag(
+            "stores",
+            query.with_entities(StoreModel.id, StoreModel.version),
+            StoreModel.id,
+            query_args
+        )
+        if is_not_modified(etag):
+            return not_modified(etag)
+
+        stores, headers = paginate(
+            query,
+            StoreModel.id,
+            query_args.get("cursor"),
+            query_args["limit"]
+        )
+        headers["ETag"] = quote_etag(etag)
+        return SparseResult(stores, fields), headers
 
     @admin_required
     @blp.arguments(StoreSchema)
@@ -38,7 +125,7 @@ class Stores(MethodView):
                 "Unprocessable Entity",
                 "Store name already in use",
                 {"store": store_data, "error": str(e)}
-            ) from IntegrityError
+            ) from e
         except SQLAlchemyError as e:
             raise ApiErrorException(
                 500,
@@ -54,16 +141,81 @@ class Store(MethodView):
     """Store method view"""
 
     @jwt_required()
+    @conditional("store", store_version, cached=True)
+    @blp.arguments(FieldsQueryArgsSchema, location="query")
     @blp.response(200, StoreSchema)
-    def get(self, store_id):
+    def get(self, query_args, store_id):
         """Get store by id"""
-        store = StoreModel.query.get_or_404(store_id)
-        return store
+        fields, loaders = sparse_fieldset(StoreSchema, STORE_LOADERS, query_args)
+        store = StoreModel.query.options(*loaders).get_or_404(store_id)
+        return SparseResult(store, fields)
 
+    @rate_limit("expensive")
     @admin_required
+    @conditional("store", store_version)
+    @blp.arguments(StoreDeleteQueryArgsSchema, location="query")
     @blp.response(204)
-    def delete(self, store_id):
-        """Delete store by id"""
-        store = StoreModel.query.get_or_404(store_id)
-        db.session.delete(store)
-        db.session.commit()
+    @blp.alt_response(202, schema=JobSchema, description="Returned if the store is deleted by a background job")
+    @blp.alt_response(412, description="Returned if If-Match doesn't match the store ETag")
+    def delete(self, query_args, store_id):
+        """Delete store by id, with its items and tags"""
+        StoreModel.query.get_or_404(store_id)
+        # Only the worker running a job could report it without a shared
+        # status store, so the store is deleted inline then
+        if jobs.shared and (query_args["background"] or many_items(store_id)):
+            job = jobs.submit("delete_store", delete_store, store_id)
+            return (
+                JobSchema().dump(job),
+                202,
+                {"Location": url_for("admin.Job", job_id=job["id"])}
+            )
+
+        delete_store(store_id)
+        return None
+
+
+@blp.route('/stores/stats')
+class StoresStats(MethodView):
+    """Stores stats method view"""
+
+    @rate_limit("expensive")
+    @jwt_required()
+    @blp.arguments(StoreQueryArgsSchema(exclude=("stream", "only", "expand")), location="query")
+    @blp.response(200, StoreStatsSchema(many=True))
+    def get(self, query_args):
+        """GET item counts, prices and tag counts of stores, one page at a time"""
+        query = StoreModel.query
+
+        if "name" in query_args:
+            query = query.filter(StoreModel.name == query_args["name"])
+
+        etag = page_etag(
+            "stores_stats",
+            query.with_entities(StoreModel.id, StoreModel.version),
+            StoreModel.id,
+            query_args
+        )
+        if is_not_modified(etag):
+            return not_modified(etag)
+
+        stores, headers = paginate(
+            query.with_entities(StoreModel.id),
+            StoreModel.id,
+            query_args.get("cursor"),
+            query_args["limit"]
+        )
+        headers["ETag"] = quote_etag(etag)
+        return store_stats.query([store.id for store in stores]).all(), headers
+
+
+@blp.route('/stores/<int:store_id>/stats')
+class StoreStats(MethodView):
+    """Store stats method view"""
+
+    @jwt_required()
+    @conditional("store_stats", store_version, cached=True)
+    @blp.response(200, StoreStatsDetailSchema)
+    def get(self, store_id):
+        """Get item counts, prices and tag usage of a store"""
+        stats = store_stats.query([store_id]).first_or_404()
+        return {**stats._asdict(), "tag_usage": store_stats.tag_usage(store_id)}
@@ -2,27 +2,48 @@
 from flask.views import MethodView
 from flask_smorest import Blueprint
 from flask_jwt_extended import jwt_required
+from sqlalchemy import select, insert, delete, exists, tuple_
 from sqlalchemy.exc import SQLAlchemyError, IntegrityError
-from models import TagModel, StoreModel, ItemModel
-from schemas import PlainTagSchema, TagSchema
+from models import TagModel, StoreModel, ItemModel, ItemsTagsModel
+from schemas import (
+    PlainTagSchema,
+    TagSchema,
+    ItemTagLinksSchema,
+    FieldsQueryArgsSchema,
+    ItemTagLinksResultSchema
+)
 from exceptions import ApiErrorException
-from db import db
+from ratelimit import rate_limit
+from db import db, chunks
 from resources.decorators import admin_required
+from loaders import TAG_LOADERS
+from fieldsets import sparse_fieldset
+from serializers import SparseResult
+from etags import conditional, store_version, tag_version, touch_stores
 
 blp = Blueprint("tags", __name__, description="Operation on tags")
 
+# Inserts of a bulk link, each after reading which pairs other requests linked
+LINK_ATTEMPTS = 3
+
 
 @blp.route('/stores/<int:store_id>/tags')
 class Tags(MethodView):
     """Item method view"""
 
     @jwt_required()
+    @conditional("store_tags", store_version, cached=True)
+    @blp.arguments(FieldsQueryArgsSchema, location="query")
     @blp.response(200, TagSchema(many=True))
-    def get(self, store_id):
+    def get(self, query_args, store_id):
         """Get tags by store id"""
-        store = StoreModel.query.get_or_404(store_id)
+        StoreModel.query.get_or_404(store_id)
 
-        return store.tags.all()
+        fields, loaders = sparse_fieldset(TagSchema, TAG_LOADERS, query_args)
+        tags = TagModel.query.options(*loaders).filter(
+            TagModel.store_id == store_id
+        ).all()
+        return SparseResult(tags, fields)
 
     @admin_required
     @blp.arguments(PlainTagSchema)
@@ -31,29 +52,19 @@ class Tags(MethodView):
         """POST tags"""
         tag = TagModel(**tag_data, store_id=store_id)
 
-        existing_tag = TagModel.query.filter(
-            TagModel.store_id == store_id, TagModel.name == tag_data["name"]
-        ).first()
-
-        if existing_tag:
-            raise ApiErrorException(
-                422,
-                "Unprocessable Entity",
-                "Tag name already in use for store",
-                {"tag": tag_data}
-            ) from SQLAlchemyError
-
+        # Name uniqueness per store is enforced by ix_tags_store_id_name
         try:
             db.session.add(tag)
+            touch_stores([store_id])
             db.session.commit()
             return tag
         except IntegrityError as e:
             raise ApiErrorException(
                 422,
                 "Unprocessable Entity",
-                "Tag name already in use",
+                "Tag name already in use for store",
                 {"tag": tag_data, "error": str(e)}
-            ) from IntegrityError
+            ) from e
         except SQLAlchemyError as e:
             raise ApiErrorException(
                 500,
@@ -68,30 +79,38 @@ class Tag(MethodView):
     """Tag Method view"""
 
     @jwt_required()
+    @conditional("tag", tag_version, cached=True)
+    @blp.arguments(FieldsQueryArgsSchema, location="query")
     @blp.response(200, TagSchema)
-    def get(self, tag_id):
+    def get(self, query_args, tag_id):
         """Get tag by id"""
-        tag = TagModel.query.get_or_404(tag_id)
-        return tag
+        fields, loaders = sparse_fieldset(TagSchema, TAG_LOADERS, query_args)
+        tag = TagModel.query.options(*loaders).get_or_404(tag_id)
+        return SparseResult(tag, fields)
 
     @admin_required
+    @conditional("tag", tag_version)
     @blp.response(204, description="Deletes a tag if no item is tagged with it")
     @blp.alt_response(404, description="Tag not found")
     @blp.alt_response(
         422,
         description="Returned if the tag is assigned to one or more items"
     )
+    @blp.alt_response(412, description="Returned if If-Match doesn't match the tag ETag")
     def delete(self, tag_id):
         """Delete tag by id"""
         tag = TagModel.query.get_or_404(tag_id)
-        if tag.items:
+        in_use = db.session.scalar(
+            select(exists().where(ItemsTagsModel.tag_id == tag_id)))
+        if in_use:
             raise ApiErrorException(
                 422,
                 "Unprocessable Entity",
                 "Cannot delete tag. Tag is in use by items",
-                {"tag": tag}
+                {"tag": PlainTagSchema().dump(tag)}
             )
 
+        touch_stores([tag.store_id])
         db.session.delete(tag)
         db.session.commit()
 
@@ -118,7 +137,15 @@ class LinkTagsToItem(MethodView):
 
         try:
             db.session.add(item)
+            touch_stores([item.store_id, tag.store_id])
             db.session.commit()
+        except IntegrityError as e:
+            raise ApiErrorException(
+                422,
+                "Unprocessable Entity",
+                "Item is already linked to tag",
+                {"item_id": item_id, "tag_id": tag_id, "error": str(e)}
+            ) from e
         except SQLAlchemyError as e:
             raise ApiErrorException(
                 500,
@@ -137,6 +164,7 @@ class LinkTagsToItem(MethodView):
 
         try:
             db.session.add(item)
+            touch_stores([item.store_id, tag.store_id])
             db.session.commit()
         except SQLAlchemyError as e:
             raise ApiErrorException(
@@ -145,3 +173,139 @@ class LinkTagsToItem(MethodView):
                 "Could not unlink item to tag",
                 {"item_id": item_id, "tag_id": tag_id, "error": str(e)}
             ) from SQLAlchemyError
+
+
+@blp.route('/items/tags')
+class LinkTagsToItems(MethodView):
+    """Bulk Link Tags To Items Method view"""
+
+    @admin_required
+    @blp.arguments(ItemTagLinksSchema)
+    @blp.response(200, ItemTagLinksResultSchema)
+    @blp.alt_response(
+        422,
+        description="Returned if an item or tag doesn't exist or they belong to different stores"
+    )
+    @blp.alt_response(
+        409,
+        description="Returned if other requests kept changing the links meanwhile"
+    )
+    @rate_limit("expensive")
+    def post(self, links_data):
+        """Link many items and tags"""
+        pairs = link_pairs(links_data)
+
+        valid = set()
+        linked = set()
+        store_ids = {}
+        for chunk in chunks(list(pairs)):
+            # Pairs of the same store, and whether they are already linked
+            for item_id, tag_id, store_id, link_id in db.session.execute(
+                select(ItemModel.id, TagModel.id, TagModel.store_id, ItemsTagsModel.id)
+                .join(TagModel, TagModel.store_id == ItemModel.store_id)
+                .outerjoin(
+                    ItemsTagsModel,
+                    (ItemsTagsModel.item_id == ItemModel.id)
+                    & (ItemsTagsModel.tag_id == TagModel.id)
+                )
+                .where(tuple_(ItemModel.id, TagModel.id).in_(chunk))
+            ):
+                valid.add((item_id, tag_id))
+                store_ids[(item_id, tag_id)] = store_id
+                if link_id is not None:
+                    linked.add((item_id, tag_id))
+
+        invalid = pairs - valid
+        if invalid:
+            raise ApiErrorException(
+                422,
+                "Unprocessable Entity",
+                "Could not link items to tags since they don't exist or belong to different stores",
+                {"links": [
+                    {"item_id": item_id, "tag_id": tag_id}
+                    for item_id, tag_id in sorted(invalid)
+                ]}
+            )
+
+        for attempt in range(LINK_ATTEMPTS):
+            new_links = sorted(valid - linked)
+            try:
+                for chunk in chunks(new_links):
+                    db.session.execute(insert(ItemsTagsModel), [
+                        {"item_id": item_id, "tag_id": tag_id}
+                        for item_id, tag_id in chunk
+                    ])
+                touch_stores(store_ids[pair] for pair in new_links)
+                db.session.commit()
+                return {"linked": len(new_links)}
+            except IntegrityError as e:
+                # Another request linked some of the pairs since they were
+                # read, skip the ones linked now
+                db.session.rollback()
+                if attempt == LINK_ATTEMPTS - 1:
+                    raise ApiErrorException(
+                        409,
+                        "Conflict",
+                        "Could not link items to tags, they are being changed concurrently",
+                        {"error": str(e)}
+                    ) from e
+                linked = existing_links(valid)
+            except SQLAlchemyError as e:
+                db.session.rollback()
+                raise ApiErrorException(
+                    500,
+                    "Internal Server Error",
+                    "Could not link items to tags",
+                    {"error": str(e)}
+                ) from SQLAlchemyError
+
+    @rate_limit("expensive")
+    @admin_required
+    @blp.arguments(ItemTagLinksSchema)
+    @blp.response(200, ItemTagLinksResultSchema)
+    def delete(self, links_data):
+        """Remove many tags from items"""
+        pairs = link_pairs(links_data)
+        unlinked = 0
+        try:
+            store_ids = set()
+            for chunk in chunks({tag_id for _, tag_id in pairs}):
+                store_ids.update(db.session.scalars(
+                    select(TagModel.store_id).where(TagModel.id.in_(chunk))
+                ))
+            for chunk in chunks(pairs):
+                unlinked += db.session.execute(
+                    delete(ItemsTagsModel).where(
+                        tuple_(ItemsTagsModel.item_id, ItemsTagsModel.tag_id).in_(chunk)
+                    )
+                ).rowcount
+            touch_stores(store_ids)
+            db.session.commit()
+        except SQLAlchemyError as e:
+            db.session.rollback()
+            raise ApiErrorException(
+                500,
+                "Internal Server Error",
+                "Could not unlink items to tags",
+                {"error": str(e)}
+            ) from SQLAlchemyError
+
+        return {"unlinked": unlinked}
+
+
+def existing_links(pairs):
+    """The given (item_id, tag_id) pairs that are linked"""
+    linked = set()
+    for chunk in chunks(pairs):
+        linked.update(tuple(row) for row in db.session.execute(
+            select(ItemsTagsModel.item_id, ItemsTagsModel.tag_id)
+            .where(tuple_(ItemsTagsModel.item_id, ItemsTagsModel.tag_id).in_(chunk))
+        ))
+    return linked
+
+
+def link_pairs(links_data):
+    """Set of (item_id, tag_id) pairs of a bulk link request"""
+    if "links" in links_data:
+        return {(link["item_id"], link["tag_id"]) for link in links_data["links"]}
+    return {(item_id, links_data["tag_id"]) for item_id in links_data["item_ids"]}
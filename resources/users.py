@@ -1,6 +1,5 @@
 """Store resource"""
 
-from passlib.hash import pbkdf2_sha256
 from sqlalchemy.exc import SQLAlchemyError, IntegrityError
 from flask.views import MethodView
 from flask_smorest import Blueprint
@@ -13,10 +12,13 @@ from flask_jwt_extended import (
 )
 
 from exceptions import ApiErrorException
+from ratelimit import rate_limit
 from schemas import UserSchema
 from models import UserModel
 from db import db
-from blocklist import BLOCKLIST
+from blocklist import blocklist
+from passwords import password_hasher
+from tokens import ADMIN, role_claims
 
 blp = Blueprint("users", __name__, description="Operation on users")
 
@@ -25,17 +27,22 @@ blp = Blueprint("users", __name__, description="Operation on users")
 class Register(MethodView):
     """Register method view"""
 
+    @rate_limit("auth")
     @blp.arguments(UserSchema)
     @blp.response(201, UserSchema)
     def post(self, user_data):
         """POST users"""
         user = UserModel(
             username=user_data["username"],
-            password=pbkdf2_sha256.hash(user_data["password"])
+            password=password_hasher.hash(user_data["password"])
         )
 
         try:
             db.session.add(user)
+            db.session.flush()
+            # The first user is the admin
+            if user.id == 1:
+                user.role = ADMIN
             db.session.commit()
             return user
 
@@ -45,7 +52,7 @@ class Register(MethodView):
                 "Unprocessable Entity",
                 "username already in use",
                 {"user": user_data, "error": str(e)}
-            ) from IntegrityError
+            ) from e
 
         except SQLAlchemyError as e:
             raise ApiErrorException(
@@ -65,7 +72,7 @@ class Users(MethodView):
     def delete(self):
         """Delete user"""
         current_user = get_jwt_identity()
-        user = UserModel.query.get_or_404(current_user)
+        user = UserModel.query.get_or_404(int(current_user))
         db.session.delete(user)
         db.session.commit()
 
@@ -74,6 +81,7 @@ class Users(MethodView):
 class UserLogIn(MethodView):
     """Log in method view"""
 
+    @rate_limit("auth")
     @blp.arguments(UserSchema)
     @blp.response(200)
     def post(self, user_data):
@@ -82,9 +90,19 @@ class UserLogIn(MethodView):
             UserModel.username == user_data["username"],
         ).first()
 
-        if user and pbkdf2_sha256.verify(user_data["password"], user.password):
-            access_token = create_access_token(identity=user.id, fresh=True)
-            refresh_token = create_refresh_token(identity=user.id)
+        if user and password_hasher.verify(user_data["password"], user.password):
+            # Upgrade hashes made with other rounds than the configured ones
+            if password_hasher.needs_rehash(user.password):
+                user.password = password_hasher.hash(user_data["password"])
+                db.session.commit()
+
+            # JWT subjects must be strings. The role travels in the tokens so
+            # authorizing requests doesn't read the user again
+            claims = role_claims(user.role)
+            access_token = create_access_token(
+                identity=str(user.id), fresh=True, additional_claims=claims)
+            refresh_token = create_refresh_token(
+                identity=str(user.id), additional_claims=claims)
             return {"access_token": access_token, "refresh_token": refresh_token}
 
         raise ApiErrorException(
@@ -103,8 +121,7 @@ class UserLogOut(MethodView):
     @blp.response(204)
     def post(self):
         """Log out"""
-        jti = get_jwt()["jti"]
-        BLOCKLIST.add(jti)
+        blocklist.revoke(get_jwt())
 
 
 @blp.route('/refresh')
@@ -116,10 +133,30 @@ class RefreshToken(MethodView):
     def post(self):
         """Log out"""
         current_user = get_jwt_identity()
-        new_token = create_access_token(identity=current_user, fresh=False)
-        # Only allow one refresh per token
-        jti = get_jwt()["jti"]
-        BLOCKLIST.add(jti)
+        # Only allow one refresh per token, even with concurrent requests to
+        # other workers
+        if not blocklist.revoke(get_jwt()):
+            raise ApiErrorException(
+                401,
+                "Unauthorized",
+                "The token has already been used",
+                {}
+            )
+        # The role is read again, so a changed role applies from the next
+        # refresh rather than when the refresh token expires
+        user = db.session.get(UserModel, int(current_user))
+        if user is None:
+            raise ApiErrorException(
+                401,
+                "Unauthorized",
+                "The user no longer exists",
+                {}
+            )
+        new_token = create_access_token(
+            identity=current_user,
+            fresh=False,
+            additional_claims=role_claims(user.role)
+        )
         return {"access_token": new_token}
 
 
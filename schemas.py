@@ -1,9 +1,13 @@
 """Validation Schemas"""
 
-from marshmallow import Schema, fields, validate
+from marshmallow import Schema, fields, validate, validates_schema, ValidationError
+from webargs.fields import DelimitedList
 
+from pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+from serializers import CompiledSchema
 
-class PlainItemSchema(Schema):
+
+class PlainItemSchema(CompiledSchema):
     """Validation schema for item creation"""
     # dump_only means it's only expected on the response bodies
     id = fields.Int(dump_only=True)
@@ -12,13 +16,13 @@ class PlainItemSchema(Schema):
     price = fields.Float(required=True, validate=validate.Range(min=0.01))
 
 
-class PlainStoreSchema(Schema):
+class PlainStoreSchema(CompiledSchema):
     """Validation schema for stores"""
     id = fields.Int(dump_only=True)
     name = fields.Str(required=True, validate=validate.Length(min=3))
 
 
-class PlainTagSchema(Schema):
+class PlainTagSchema(CompiledSchema):
     """Validation schema for tags"""
     id = fields.Int(dump_only=True)
     name = fields.Str(required=True, validate=validate.Length(min=3))
@@ -54,6 +58,20 @@ class ItemUpdateSchema(Schema):
     store_id = fields.Int()
 
 
+class ItemBulkUpdateSchema(ItemUpdateSchema):
+    """Validation schema for each item of a bulk update"""
+    id = fields.Int(required=True)
+
+
+class BulkItemResultSchema(Schema):
+    """Result of each item of a bulk request"""
+    index = fields.Int()
+    # created, updated or error
+    status = fields.Str()
+    item = fields.Nested(PlainItemSchema)
+    message = fields.Str()
+
+
 class TagAndItemSchema(Schema):
     """Used to return information about the related item and tag"""
     message = fields.Str()
@@ -61,9 +79,194 @@ class TagAndItemSchema(Schema):
     tag = fields.Nested(TagSchema)
 
 
+class ItemTagLinkSchema(Schema):
+    """An item and a tag to link/unlink"""
+    item_id = fields.Int(required=True)
+    tag_id = fields.Int(required=True)
+
+
+class ItemTagLinksSchema(Schema):
+    """Many item and tag pairs, or one tag and many items"""
+    links = fields.List(fields.Nested(ItemTagLinkSchema))
+    tag_id = fields.Int()
+    item_ids = fields.List(fields.Int())
+
+    @validates_schema
+    def validate_links(self, data, **kwargs):
+        """Either links or tag_id and item_ids are required"""
+        if "links" in data:
+            if "tag_id" in data or "item_ids" in data:
+                raise ValidationError("Send either links or tag_id and item_ids")
+        elif "tag_id" not in data or "item_ids" not in data:
+            raise ValidationError("links or tag_id and item_ids are required")
+
+
+class ItemTagLinksResultSchema(Schema):
+    """Number of item and tag pairs changed by a bulk request"""
+    linked = fields.Int()
+    unlinked = fields.Int()
+
+
+class CacheStatsSchema(Schema):
+    """Response cache counters"""
+    hits = fields.Int()
+    misses = fields.Int()
+    local_hits = fields.Int()
+    shared_hits = fields.Int()
+    evictions = fields.Int()
+    size = fields.Int()
+
+
+class HistogramBucketSchema(Schema):
+    """Cumulative histogram bucket"""
+    le = fields.Str()
+    count = fields.Int()
+
+
+class PoolStatsSchema(Schema):
+    """Connection pool state and counters"""
+    pool = fields.Str()
+    size = fields.Int(allow_none=True)
+    in_use = fields.Int(allow_none=True)
+    idle = fields.Int(allow_none=True)
+    overflow = fields.Int(allow_none=True)
+    checkouts = fields.Int()
+    connects = fields.Int()
+    invalidations = fields.Int()
+    overflow_checkouts = fields.Int()
+    wait_seconds_sum = fields.Float()
+    wait_seconds_histogram = fields.List(fields.Nested(HistogramBucketSchema))
+
+
+class PasswordHashingStatsSchema(Schema):
+    """Password hashing pool counters"""
+    workers = fields.Int()
+    rounds = fields.Int()
+    pending = fields.Int()
+    max_pending_seen = fields.Int()
+    completed = fields.Int()
+    rejected = fields.Int()
+
+
+class RateLimitStatsSchema(Schema):
+    """Rate and concurrency limiter counters"""
+    enabled = fields.Bool()
+    # Requests rejected with 429 and 503
+    limited = fields.Int()
+    shed = fields.Int()
+
+
+class TokenCacheStatsSchema(Schema):
+    """Verified token and permission cache counters"""
+    verified_hits = fields.Int()
+    verified_misses = fields.Int()
+    permission_hits = fields.Int()
+    permission_misses = fields.Int()
+    size = fields.Int()
+
+
+class TagUsageSchema(Schema):
+    """Number of items of a tag"""
+    id = fields.Int()
+    name = fields.Str()
+    item_count = fields.Int()
+
+
+class StoreStatsSchema(Schema):
+    """Item, price and tag aggregates of a store"""
+    id = fields.Int()
+    name = fields.Str()
+    item_count = fields.Int()
+    tag_count = fields.Int()
+    # Item and tag links of the store
+    link_count = fields.Int()
+    min_price = fields.Float(allow_none=True)
+    max_price = fields.Float(allow_none=True)
+    avg_price = fields.Float(allow_none=True)
+
+
+class StoreStatsDetailSchema(StoreStatsSchema):
+    """Aggregates of a store and the usage of each of its tags"""
+    tag_usage = fields.List(fields.Nested(TagUsageSchema))
+
+
+class SearchResultSchema(Schema):
+    """Item or tag matching a search"""
+    # item or tag
+    type = fields.Str()
+    id = fields.Int()
+    store_id = fields.Int()
+    name = fields.Str()
+    description = fields.Str(allow_none=True)
+    # Relevance, higher is better
+    score = fields.Float()
+
+
+class JobSchema(Schema):
+    """Background job status"""
+    id = fields.Str()
+    name = fields.Str()
+    # pending, running, done or failed
+    status = fields.Str()
+    created_at = fields.Float()
+    finished_at = fields.Float(allow_none=True)
+    error = fields.Str(allow_none=True)
+
+
 class UserSchema(Schema):
     """User Schema"""
     id = fields.Int(dump_only=True)
     username = fields.Str(required=True, validate=validate.Length(min=3))
     password = fields.Str(
         required=True, validate=validate.Length(min=8), load_only=True)
+
+
+class FieldsQueryArgsSchema(Schema):
+    """Query string arguments selecting the fields of a response"""
+    # Fields to return, comma separated. All but the expandable ones if missing.
+    # `fields` is taken by Schema
+    only = DelimitedList(fields.Str(), data_key="fields")
+    # Nested collections to return, like the items of a tag
+    expand = DelimitedList(fields.Str())
+
+
+class StoreDeleteQueryArgsSchema(Schema):
+    """Query string arguments for store deletion"""
+    # Deletes in a background job and returns 202 with it
+    background = fields.Bool(load_default=False)
+
+
+class PageQueryArgsSchema(FieldsQueryArgsSchema):
+    """Query string arguments for cursor paginated collections"""
+    cursor = fields.Str()
+    # Streams the whole collection as NDJSON instead of returning a page
+    stream = fields.Bool(load_default=False)
+    limit = fields.Int(
+        load_default=DEFAULT_PAGE_SIZE,
+        validate=validate.Range(min=1, max=MAX_PAGE_SIZE)
+    )
+
+
+class ItemQueryArgsSchema(PageQueryArgsSchema):
+    """Query string filters for items"""
+    store_id = fields.Int()
+    name = fields.Str()
+    min_price = fields.Float()
+    max_price = fields.Float()
+
+
+class StoreQueryArgsSchema(PageQueryArgsSchema):
+    """Query string filters for stores"""
+    name = fields.Str()
+
+
+class SearchQueryArgsSchema(Schema):
+    """Query string arguments of a search"""
+    q = fields.Str(required=True, validate=validate.Length(min=1, max=200))
+    store_id = fields.Int()
+    type = fields.Str(validate=validate.OneOf(["item", "tag"]))
+    cursor = fields.Str()
+    limit = fields.Int(
+        load_default=DEFAULT_PAGE_SIZE,
+        validate=validate.Range(min=1, max=MAX_PAGE_SIZE)
+    )
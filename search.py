@@ -0,0 +1,531 @@
+"""Full-text and prefix search over item and tag names.
+
+`SEARCH_BACKEND` selects where the index lives:
+
+-   `fts5`: an SQLite FTS5 table, `search_index`, updated in the transaction of
+    every write. Default on SQLite.
+-   `postgres`: `to_tsvector` over the `items` and `tags` tables, served by GIN
+    expression indexes, so there's nothing to maintain. Default on PostgreSQL.
+-   `memory`: an inverted index per worker, built from the database on first
+    use and updated after each commit of the worker. It's rebuilt in the
+    background every `SEARCH_MEMORY_TTL` seconds to pick up the writes of
+    other workers. Default on other databases.
+
+The FTS5 table and the GIN indexes are created by a migration (`flask db
+upgrade`), or on start up outside `FAST_BOOT`, and autogenerate leaves them
+out. Items and tags changed through the ORM are reindexed automatically. Bulk
+statements that bypass it mark what they change with `search_index.mark`.
+"""
+import os
+import re
+import time
+from bisect import bisect_left, insort
+from collections import defaultdict
+from threading import Lock, Thread
+
+from flask import current_app
+from sqlalchemy import bindparam, event, literal, null, select, text
+from sqlalchemy.orm import Session
+
+from db import db, chunks
+from models import ItemModel, TagModel
+
+# Session.info keys of the documents changed in the current transaction, and
+# of the changes the memory index applies once it commits
+CHANGED_DOCUMENTS = "search_changed"
+DELETED_STORES = "search_deleted_stores"
+SYNCED_DOCUMENTS = "search_synced"
+
+# Query words used at most
+MAX_TERMS = 8
+
+TOKEN = re.compile(r"\w+")
+
+MODELS = {"item": ItemModel, "tag": TagModel}
+
+
+def tokenize(value):
+    """Lower case words of a text"""
+    return TOKEN.findall(value.lower()) if value else []
+
+
+def load_documents(keys):
+    """Current (kind, id, store_id, name, description) of the given
+    (kind, id) documents, by key. Deleted ones are left out."""
+    ids = defaultdict(list)
+    for kind, doc_id in keys:
+        ids[kind].append(doc_id)
+
+    documents = {}
+    for kind, kind_ids in ids.items():
+        model = MODELS[kind]
+        description = model.description if kind == "item" else null()
+        for chunk in chunks(kind_ids):
+            for doc_id, store_id, name, desc in db.session.execute(
+                select(model.id, model.store_id, model.name, description)
+                .where(model.id.in_(chunk))
+            ):
+                documents[(kind, doc_id)] = (kind, doc_id, store_id, name, desc)
+    return documents
+
+
+def all_documents():
+    """(kind, id, store_id, name, description) of every item and tag"""
+    yield from db.session.execute(select(
+        literal("item"), ItemModel.id, ItemModel.store_id, ItemModel.name,
+        ItemModel.description
+    ))
+    yield from db.session.execute(select(
+        literal("tag"), TagModel.id, TagModel.store_id, TagModel.name, null()
+    ))
+
+
+class FTS5Backend:
+    """Search index in an SQLite FTS5 table"""
+
+    create_statement = (
+        "CREATE VIRTUAL TABLE search_index USING fts5("
+        "name, description, kind UNINDEXED, store_id UNINDEXED, "
+        "tokenize = 'unicode61', prefix = '2 3')"
+    )
+    # Matches in names weigh more than in descriptions
+    rank = "bm25(search_index, 10.0, 1.0)"
+
+    @staticmethod
+    def rowid(kind, doc_id):
+        """Row of a document, items and tags interleaved"""
+        return doc_id * 2 + (kind == "tag")
+
+    def create_all(self):
+        """Creates and fills the index table if it doesn't exist"""
+        exists = db.session.scalar(text(
+            "SELECT 1 FROM sqlite_master WHERE name = 'search_index'"))
+        if not exists:
+            self.rebuild()
+
+    def rebuild(self):
+        """Recreates the index from the items and tags tables"""
+        db.session.execute(text("DROP TABLE IF EXISTS search_index"))
+        db.session.execute(text(self.create_statement))
+        self.apply(
+            {(row[0], row[1]): tuple(row) for row in all_documents()}, ())
+
+    def apply(self, documents, deleted):
+        """Writes the given documents and deletes the given keys"""
+        rowids = [self.rowid(*key) for key in [*documents, *deleted]]
+        for chunk in chunks(rowids):
+            db.session.execute(
+                text("DELETE FROM search_index WHERE rowid IN :rowids")
+                .bindparams(bindparam("rowids", expanding=True)),
+                {"rowids": chunk}
+            )
+        for chunk in chunks(documents.values()):
+            db.session.execute(
+                text(
+                    "INSERT INTO search_index "
+                    "(rowid, kind, store_id, name, description) "
+                    "VALUES (:rowid, :kind, :store_id, :name, :description)"
+                ),
+                [
+                    {
+                        "rowid": self.rowid(kind, doc_id),
+                        "kind": kind,
+                        "store_id": store_id,
+                        "name": name,
+                        "description": description,
+                    }
+                    for kind, doc_id, store_id, name, description in chunk
+                ]
+            )
+
+    def delete_stores(self, store_ids):
+        """Deletes the documents of the given stores"""
+        db.session.execute(
+            text("DELETE FROM search_index WHERE store_id IN :store_ids")
+            .bindparams(bindparam("store_ids", expanding=True)),
+            {"store_ids": list(store_ids)}
+        )
+
+    def search(self, terms, store_id, kind, offset, limit):
+        """Matches of all `terms` as prefixes, best first"""
+        match = " ".join(f'"{term}"*' for term in terms)
+        filters = ""
+        params = {"match": match, "offset": offset, "limit": limit}
+        if store_id is not None:
+            filters += " AND store_id = :store_id"
+            params["store_id"] = store_id
+        if kind is not None:
+            filters += " AND kind = :kind"
+            params["kind"] = kind
+
+        rows = db.session.execute(text(
+            f"SELECT kind, rowid / 2, store_id, name, description, -{self.rank} "
+            "FROM search_index WHERE search_index MATCH :match" + filters +
+            f" ORDER BY {self.rank}, rowid LIMIT :limit OFFSET :offset"
+        ), params)
+        return [result(*row) for row in rows]
+
+
+class PostgresBackend:
+    """Search with PostgreSQL full-text search over the tables themselves"""
+
+    def create_all(self):
+        """Creates the GIN indexes backing the searches"""
+        db.session.execute(text(
+            "CREATE INDEX IF NOT EXISTS ix_items_search ON items USING gin "
+            "(to_tsvector('simple', name || ' ' || coalesce(description, '')))"
+        ))
+        db.session.execute(text(
+            "CREATE INDEX IF NOT EXISTS ix_tags_search ON tags USING gin "
+            "(to_tsvector('simple', name))"
+        ))
+
+    def rebuild(self):
+        """Nothing to rebuild, PostgreSQL maintains its indexes"""
+        self.create_all()
+
+    def apply(self, documents, deleted):
+        """Nothing to update, PostgreSQL maintains its indexes"""
+
+    def delete_stores(self, store_ids):
+        """Nothing to delete, PostgreSQL maintains its indexes"""
+
+    def search(self, terms, store_id, kind, offset, limit):
+        """Matches of all `terms` as prefixes, best first"""
+        params = {
+            "query": " & ".join(f"{term}:*" for term in terms),
+            "offset": offset,
+            "limit": limit,
+        }
+        filters = ""
+        if store_id is not None:
+            filters = " AND store_id = :store_id"
+            params["store_id"] = store_id
+
+        selects = []
+        if kind in (None, "item"):
+            selects.append(
+                "SELECT 'item' AS kind, id, store_id, name, description, "
+                "ts_rank(setweight(to_tsvector('simple', name), 'A') || "
+                "to_tsvector('simple', coalesce(description, '')), query) AS score "
+                "FROM items, to_tsquery('simple', :query) query "
+                "WHERE to_tsvector('simple', name || ' ' || coalesce(description, '')) "
+                "@@ query" + filters
+            )
+        if kind in (None, "tag"):
+            selects.append(
+                "SELECT 'tag' AS kind, id, store_id, name, NULL AS description, "
+                "ts_rank(setweight(to_tsvector('simple', name), 'A'), query) AS score "
+                "FROM tags, to_tsquery('simple', :query) query "
+                "WHERE to_tsvector('simple', name) @@ query" + filters
+            )
+
+        rows = db.session.execute(text(
+            " UNION ALL ".join(selects) +
+            " ORDER BY score DESC, kind, id LIMIT :limit OFFSET :offset"
+        ), params)
+        return [result(*row) for row in rows]
+
+
+class MemoryIndex:
+    """Inverted index of word prefixes"""
+
+    def __init__(self):
+        self.documents = {}
+        self.postings = defaultdict(set)
+        self.words = []
+
+    def apply(self, documents, deleted):
+        """Indexes the given documents and drops the given keys"""
+        self.remove([*documents, *deleted])
+        self.add(documents)
+
+    def delete_stores(self, store_ids):
+        """Drops the documents of the given stores"""
+        self.remove([
+            key for key, document in self.documents.items()
+            if document[2] in store_ids
+        ])
+
+    def add(self, documents):
+        """Indexes the given documents, by key"""
+        new_words = set()
+        for key, document in documents.items():
+            self.documents[key] = document
+            for word in set(tokenize(document[3]) + tokenize(document[4])):
+                if word not in self.postings:
+                    new_words.add(word)
+                self.postings[word].add(key)
+        if not self.words:
+            self.words = sorted(self.postings)
+            return
+        for word in new_words:
+            insort(self.words, word)
+
+    def remove(self, keys):
+        """Drops the given keys"""
+        for key in keys:
+            document = self.documents.pop(key, None)
+            if document is None:
+                continue
+            for word in set(tokenize(document[3]) + tokenize(document[4])):
+                self.postings[word].discard(key)
+                if not self.postings[word]:
+                    del self.postings[word]
+                    del self.words[bisect_left(self.words, word)]
+
+    def prefixed(self, term):
+        """Keys of the documents with a word starting with `term`"""
+        keys = set()
+        index = bisect_left(self.words, term)
+        while index < len(self.words) and self.words[index].startswith(term):
+            keys |= self.postings[self.words[index]]
+            index += 1
+        return keys
+
+
+class MemoryBackend:
+    """`MemoryIndex` kept in this worker.
+
+    The first search builds it. Once it's older than `ttl` a search starts
+    rebuilding it in a background thread and keeps using the current one,
+    which the new index replaces when it's ready. Changes this worker commits
+    while a rebuild reads the tables are applied to both indexes.
+    """
+
+    def __init__(self, ttl=60):
+        self.ttl = ttl
+        self.built_at = None
+        self.index = None
+        # Changes to apply to the index being built, None when not building
+        self._replay = None
+        self._lock = Lock()
+        self._build_lock = Lock()
+
+    def create_all(self):
+        """The index is built on first use"""
+
+    def rebuild(self):
+        """Rebuilds the index from the items and tags tables"""
+        with self._build_lock:
+            self._build()
+
+    def _build(self):
+        with self._lock:
+            self._replay = []
+        try:
+            index = MemoryIndex()
+            index.add({(row[0], row[1]): tuple(row) for row in all_documents()})
+        finally:
+            with self._lock:
+                replay, self._replay = self._replay, None
+        with self._lock:
+            for method, args in replay:
+                getattr(index, method)(*args)
+            self.index = index
+            self.built_at = time.monotonic()
+
+    def _rebuild_in_background(self, app):
+        try:
+            with app.app_context():
+                self._build()
+        except Exception:  # pylint: disable=broad-except
+            app.logger.exception("Rebuilding the search index failed")
+        finally:
+            self._build_lock.release()
+
+    def _update(self, method, *args):
+        with self._lock:
+            if self._replay is not None:
+                self._replay.append((method, args))
+            if self.index is not None:
+                getattr(self.index, method)(*args)
+
+    def apply(self, documents, deleted):
+        """Indexes the given documents and drops the given keys"""
+        self._update("apply", documents, deleted)
+
+    def delete_stores(self, store_ids):
+        """Drops the documents of the given stores"""
+        self._update("delete_stores", store_ids)
+
+    def current_index(self) -> MemoryIndex:
+        """The index, built if there's none yet, and rebuilt in the
+        background if it's older than `ttl`"""
+        if self.index is None:
+            with self._build_lock:
+                if self.index is None:
+                    self._build()
+        elif (time.monotonic() - self.built_at > self.ttl
+                and self._build_lock.acquire(blocking=False)):
+            Thread(
+                target=self._rebuild_in_background,
+                args=(current_app._get_current_object(),),  # pylint: disable=protected-access
+                daemon=True
+            ).start()
+        return self.index
+
+    def search(self, terms, store_id, kind, offset, limit):
+        """Matches of all `terms` as prefixes, best first"""
+        index = self.current_index()
+        with self._lock:
+            keys = None
+            for term in terms:
+                keys = index.prefixed(term) if keys is None else keys & index.prefixed(term)
+            documents = [
+                index.documents[key] for key in keys or ()
+                if (store_id is None or index.documents[key][2] == store_id)
+                and (kind is None or key[0] == kind)
+            ]
+
+        def score(document):
+            # Terms matching the name weigh as in the FTS5 backend
+            words = tokenize(document[3])
+            return sum(
+                10.0 if any(word.startswith(term) for word in words) else 1.0
+                for term in terms
+            )
+
+        ranked = sorted(
+            ((score(document), document) for document in documents),
+            key=lambda match: (-match[0], match[1][0], match[1][1])
+        )
+        return [
+            result(*document, score)
+            for score, document in ranked[offset:offset + limit]
+        ]
+
+
+def result(kind, doc_id, store_id, name, description, score):
+    """Search result as dumped by SearchResultSchema"""
+    return {
+        "type": kind,
+        "id": doc_id,
+        "store_id": store_id,
+        "name": name,
+        "description": description,
+        "score": score,
+    }
+
+
+class SearchIndex:
+    """Search over items and tags, through the configured backend"""
+
+    def __init__(self):
+        self.backend = None
+
+    def init_app(self, app):
+        """Reads the configuration and registers the `flask search-index`
+        command"""
+        app.config.setdefault(
+            "SEARCH_BACKEND", os.getenv("SEARCH_BACKEND", "auto"))
+        app.config.setdefault(
+            "SEARCH_MEMORY_TTL", float(os.getenv("SEARCH_MEMORY_TTL", "60")))
+
+        backend = app.config["SEARCH_BACKEND"]
+        if backend == "auto":
+            dialect = app.config["SQLALCHEMY_DATABASE_URI"].split(":", 1)[0]
+            if dialect.startswith("sqlite"):
+                backend = "fts5"
+            elif dialect.startswith("postgres"):
+                backend = "postgres"
+            else:
+                backend = "memory"
+
+        if backend == "fts5":
+            self.backend = FTS5Backend()
+        elif backend == "postgres":
+            self.backend = PostgresBackend()
+        else:
+            self.backend = MemoryBackend(app.config["SEARCH_MEMORY_TTL"])
+
+        @app.cli.command("search-index")
+        def rebuild_search_index():
+            """Rebuild the search index"""
+            self.backend.rebuild()
+            db.session.commit()
+            print("Search index rebuilt")
+
+    def create_all(self):
+        """Creates the index if it doesn't exist. Needs an app context."""
+        self.backend.create_all()
+        db.session.commit()
+
+    def search(self, query, store_id=None, kind=None, offset=0, limit=50):
+        """Items and tags with words starting with every word of `query`"""
+        terms = tokenize(query)[:MAX_TERMS]
+        if not terms:
+            return []
+        return self.backend.search(terms, store_id, kind, offset, limit)
+
+    def mark(self, kind, ids):
+        """Schedules the given items or tags to be reindexed when the current
+        transaction commits. Needed by writes that bypass the ORM."""
+        db.session.info.setdefault(CHANGED_DOCUMENTS, set()).update(
+            (kind, doc_id) for doc_id in ids)
+
+    def mark_store_deleted(self, store_id):
+        """Schedules the items and tags of a store to be dropped from the
+        index when the current transaction commits, without loading them"""
+        db.session.info.setdefault(DELETED_STORES, set()).add(store_id)
+
+
+search_index = SearchIndex()
+
+
+@event.listens_for(Session, "after_flush")
+def collect_changed_documents(session, flush_context):
+    """Remembers the items and tags the flush wrote"""
+    changed = session.info.setdefault(CHANGED_DOCUMENTS, set())
+    dirty = [
+        instance for instance in session.dirty
+        if session.is_modified(instance, include_collections=False)
+    ]
+    for instance in (*session.new, *dirty, *session.deleted):
+        if isinstance(instance, ItemModel):
+            changed.add(("item", instance.id))
+        elif isinstance(instance, TagModel):
+            changed.add(("tag", instance.id))
+
+
+@event.listens_for(Session, "before_commit")
+def index_changed_documents(session):
+    """Reindexes the items and tags changed by the transaction"""
+    if search_index.backend is None or isinstance(search_index.backend, PostgresBackend):
+        session.info.pop(CHANGED_DOCUMENTS, None)
+        session.info.pop(DELETED_STORES, None)
+        return
+    session.flush()
+    keys = session.info.pop(CHANGED_DOCUMENTS, None)
+    store_ids = session.info.pop(DELETED_STORES, None)
+    if not keys and not store_ids:
+        return
+
+    documents = load_documents(keys or ())
+    deleted = [key for key in keys or () if key not in documents]
+    if isinstance(search_index.backend, MemoryBackend):
+        # Applied once committed, other transactions can't see it before
+        session.info[SYNCED_DOCUMENTS] = (documents, deleted, store_ids)
+    else:
+        if store_ids:
+            search_index.backend.delete_stores(store_ids)
+        search_index.backend.apply(documents, deleted)
+
+
+@event.listens_for(Session, "after_commit")
+def apply_synced_documents(session):
+    """Updates the memory index with the changes just committed"""
+    synced = session.info.pop(SYNCED_DOCUMENTS, None)
+    if synced is not None:
+        documents, deleted, store_ids = synced
+        if store_ids:
+            search_index.backend.delete_stores(store_ids)
+        search_index.backend.apply(documents, deleted)
+
+
+@event.listens_for(Session, "after_rollback")
+def forget_changed_documents(session):
+    """Drops the changes of a rolled back transaction"""
+    session.info.pop(CHANGED_DOCUMENTS, None)
+    session.info.pop(DELETED_STORES, None)
+    session.info.pop(SYNCED_DOCUMENTS, None)
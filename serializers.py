@@ -0,0 +1,212 @@
+"""Precompiled serializers for marshmallow schemas and a faster JSON encoder"""
+import re
+
+import orjson
+from flask.json.provider import DefaultJSONProvider
+from marshmallow import Schema, fields, missing
+from marshmallow.decorators import POST_DUMP, PRE_DUMP
+from marshmallow.utils import ensure_text_type
+
+from instrumentation import phase
+
+# Fields dumped by converting the attribute value, like marshmallow does
+CONVERTERS = {
+    fields.Integer: int,
+    fields.Float: float,
+    fields.String: ensure_text_type,
+}
+
+COMPACT_SEPARATORS = (",", ":")
+
+# Floats orjson writes unlike repr(): under 1e-4 (`0.00001`, `1e-7` instead of
+# `1e-05`, `1e-07`) and from 1e16 (`1e16` instead of `1e+16`). Strings looking
+# like them match too, which only costs a fallback.
+REPR_MISMATCH = re.compile(rb"[0-9]e-?[0-9]|0\.0000")
+
+
+class SparseResult:
+    """Object a view returns to have its response schema dump only
+    `fields` of it"""
+
+    __slots__ = ("obj", "fields")
+
+    def __init__(self, obj, fields):
+        self.obj = obj
+        self.fields = fields
+
+
+class CompiledSchema(Schema):
+    """Schema that dumps objects with a serializer compiled from its fields.
+
+    The serializer reads attributes and converts them the same way the
+    fields would, skipping marshmallow's per-field dispatch, so the output is
+    identical. Fields it doesn't know how to compile, dicts and other
+    subscriptable objects go through marshmallow as usual.
+
+    A `SparseResult` is dumped with the subset of fields it carries.
+    """
+
+    def dump(self, obj, *, many=None):
+        if isinstance(obj, SparseResult):
+            return self.subset(obj.fields).dump(obj.obj, many=many)
+        with phase("serialize"):
+            return super().dump(obj, many=many)
+
+    def subset(self, fields):
+        """Copy of this schema dumping only `fields`, compiled once"""
+        subsets = self.__dict__.setdefault("_subsets", {})
+        key = frozenset(fields)
+        subset = subsets.get(key)
+        if subset is None:
+            subset = subsets[key] = type(self)(only=sorted(key), many=self.many)
+        return subset
+
+    def _serialize(self, obj, *, many=False):
+        serializer = self.__dict__.get("_serializer")
+        if serializer is None:
+            serializer = self._serializer = compile_serializer(self)
+
+        if many and obj is not None:
+            obj = list(obj)
+            if all(map(compilable_type, set(map(type, obj)))):
+                return [serializer(each) for each in obj]
+            return [
+                serializer(each) if compilable_type(type(each))
+                else super(CompiledSchema, self)._serialize(each)
+                for each in obj
+            ]
+        if compilable_type(type(obj)):
+            return serializer(obj)
+        return super()._serialize(obj, many=many)
+
+
+def compilable_type(cls):
+    """Whether marshmallow reads the attributes of `cls` instances with
+    getattr, as compiled serializers do"""
+    return cls is not type(None) and not hasattr(cls, "__getitem__")
+
+
+def has_dump_hooks(schema):
+    """Whether `schema` has pre_dump or post_dump methods"""
+    return bool(schema._hooks[PRE_DUMP] or schema._hooks[POST_DUMP])
+
+
+def plan_field(attr_name, field, schema):
+    """How the serializer of `schema` dumps `field`: ("convert", type),
+    ("nested", (nested schema, many)) or ("field", None) to call
+    `field.serialize`"""
+    attribute = field.attribute or attr_name
+    plain = (
+        "." not in attribute
+        and field.dump_default is missing
+        and type(schema).get_attribute is Schema.get_attribute
+    )
+    if not plain:
+        return "field", None
+
+    if type(field) in CONVERTERS and not getattr(field, "as_string", False):
+        return "convert", field.num_type if hasattr(field, "num_type") else str
+
+    in_list = isinstance(field, fields.List)
+    nested = field.inner if in_list else field
+    if isinstance(nested, fields.Nested):
+        nested_schema = nested.schema
+        many = nested_schema.many or nested.many
+        if (
+            isinstance(nested_schema, CompiledSchema)
+            and not has_dump_hooks(nested_schema)
+            and not (in_list and many)
+        ):
+            return "nested", (nested_schema, many or in_list)
+
+    return "field", None
+
+
+def compile_serializer(schema):
+    """Function dumping one object with the fields of `schema`.
+
+    Its source is generated from the fields, reading each attribute once and
+    converting it only when it isn't of the dumped type already.
+    """
+    namespace = {
+        "dict_class": schema.dict_class,
+        "missing": missing,
+        "get_attribute": schema.get_attribute,
+    }
+    lines = ["def serializer(obj):", "    result = dict_class()"]
+    for index, (attr_name, field) in enumerate(schema.dump_fields.items()):
+        key = field.data_key if field.data_key is not None else attr_name
+        attribute = field.attribute or attr_name
+        kind, plan = plan_field(attr_name, field, schema)
+
+        if kind == "convert":
+            namespace[f"type_{index}"] = plan
+            namespace[f"convert_{index}"] = CONVERTERS[type(field)]
+            lines += [
+                f"    value = getattr(obj, {attribute!r}, missing)",
+                "    if value is not missing:",
+                f"        result[{key!r}] = (",
+                f"            value if value is None or value.__class__ is type_{index}",
+                f"            else convert_{index}(value)",
+                "        )",
+            ]
+        elif kind == "nested":
+            nested_schema, many = plan
+            namespace[f"serialize_{index}"] = nested_schema._serialize
+            lines += [
+                f"    value = getattr(obj, {attribute!r}, missing)",
+                "    if value is not missing:",
+                f"        result[{key!r}] = (",
+                f"            None if value is None else serialize_{index}(value, many={many})",
+                "        )",
+            ]
+        else:
+            namespace[f"field_{index}"] = field
+            lines += [
+                f"    value = field_{index}.serialize({attr_name!r}, obj, "
+                "accessor=get_attribute)",
+                "    if value is not missing:",
+                f"        result[{key!r}] = value",
+            ]
+    lines.append("    return result")
+
+    exec("\n".join(lines), namespace)  # pylint: disable=exec-used
+    return namespace["serializer"]
+
+
+class TimedJSONProvider(DefaultJSONProvider):
+    """Default JSON provider timing the encoding of responses"""
+
+    def response(self, *args, **kwargs):
+        with phase("encode"):
+            return super().response(*args, **kwargs)
+
+
+class OrjsonProvider(TimedJSONProvider):
+    """JSON provider encoding compact documents with orjson.
+
+    The output is byte for byte the default provider's (sorted keys, ASCII
+    only): documents orjson would write differently are encoded by the
+    default provider instead. Those are the ones with non ASCII characters,
+    with floats under 1e-4 or from 1e16, that orjson can't encode, or
+    indented ones. The exception is NaN/Infinity, which orjson writes as null
+    where the default provider writes the (invalid JSON) `NaN`/`Infinity`.
+    """
+
+    options = (
+        orjson.OPT_SORT_KEYS
+        | orjson.OPT_NON_STR_KEYS
+        | orjson.OPT_PASSTHROUGH_DATETIME
+        | orjson.OPT_PASSTHROUGH_DATACLASS
+    )
+
+    def dumps(self, obj, **kwargs):
+        if kwargs != {"separators": COMPACT_SEPARATORS} or not self.sort_keys:
+            return super().dumps(obj, **kwargs)
+        try:
+            data = orjson.dumps(obj, default=self.default, option=self.options)
+        except TypeError:
+            return super().dumps(obj, **kwargs)
+        if (self.ensure_ascii and not data.isascii()) or REPR_MISMATCH.search(data):
+            return super().dumps(obj, **kwargs)
+        return data.decode()
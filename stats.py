@@ -0,0 +1,180 @@
+"""Store statistics.
+
+Item counts, prices and tag usage are aggregated with GROUP BY queries over
+`items`, `tags` and `items_tags`. With `STORE_STATS_SUMMARY=1` the aggregates of
+each store are also kept in the `store_stats` table: write paths mark the
+stores they change with `touch_stores`, and their rows are recomputed right
+before the transaction commits, so reads don't scan items at all.
+"""
+import os
+
+from sqlalchemy import delete, event, func, insert, select
+from sqlalchemy.orm import Session
+
+from db import db, chunks
+from models import StoreModel, ItemModel, TagModel, ItemsTagsModel, StoreStatsModel
+
+# Session.info key of the stores changed in the current transaction
+CHANGED_STORES = "changed_stores"
+
+SUMMARY_COLUMNS = (
+    "store_id",
+    "item_count",
+    "tag_count",
+    "link_count",
+    "min_price",
+    "max_price",
+    "avg_price",
+)
+
+
+def aggregate_subqueries(store_ids):
+    """Item, tag and link aggregates of the given stores, grouped by store"""
+    items = (
+        select(
+            ItemModel.store_id,
+            func.count(ItemModel.id).label("item_count"),
+            func.min(ItemModel.price).label("min_price"),
+            func.max(ItemModel.price).label("max_price"),
+            func.avg(ItemModel.price).label("avg_price"),
+        )
+        .where(ItemModel.store_id.in_(store_ids))
+        .group_by(ItemModel.store_id)
+        .subquery()
+    )
+    tags = (
+        select(TagModel.store_id, func.count(TagModel.id).label("tag_count"))
+        .where(TagModel.store_id.in_(store_ids))
+        .group_by(TagModel.store_id)
+        .subquery()
+    )
+    links = (
+        select(TagModel.store_id, func.count(ItemsTagsModel.id).label("link_count"))
+        .join(ItemsTagsModel, ItemsTagsModel.tag_id == TagModel.id)
+        .where(TagModel.store_id.in_(store_ids))
+        .group_by(TagModel.store_id)
+        .subquery()
+    )
+    return items, tags, links
+
+
+def aggregates_select(store_ids):
+    """Select of the `store_stats` columns of the given stores"""
+    items, tags, links = aggregate_subqueries(store_ids)
+    return (
+        select(
+            StoreModel.id.label("store_id"),
+            func.coalesce(items.c.item_count, 0).label("item_count"),
+            func.coalesce(tags.c.tag_count, 0).label("tag_count"),
+            func.coalesce(links.c.link_count, 0).label("link_count"),
+            items.c.min_price,
+            items.c.max_price,
+            items.c.avg_price,
+        )
+        .outerjoin(items, items.c.store_id == StoreModel.id)
+        .outerjoin(tags, tags.c.store_id == StoreModel.id)
+        .outerjoin(links, links.c.store_id == StoreModel.id)
+        .where(StoreModel.id.in_(store_ids))
+    )
+
+
+class StoreStats:
+    """Computes store statistics, live or from the summary table"""
+
+    def __init__(self):
+        self.summary = False
+
+    def init_app(self, app):
+        """Reads the configuration and registers the `flask store-stats` command"""
+        app.config.setdefault(
+            "STORE_STATS_SUMMARY",
+            os.getenv("STORE_STATS_SUMMARY", "0") == "1"
+        )
+        self.summary = app.config["STORE_STATS_SUMMARY"]
+
+        @app.cli.command("store-stats")
+        def rebuild_store_stats():
+            """Rebuild the store_stats summary table"""
+            count = self.rebuild()
+            db.session.commit()
+            print(f"Summarized {count} stores")
+
+    def query(self, store_ids):
+        """Query of the id, name and aggregates of the given stores"""
+        if self.summary:
+            stats = StoreStatsModel.__table__
+        else:
+            stats = aggregates_select(store_ids).subquery()
+
+        return (
+            db.session.query(
+                StoreModel.id,
+                StoreModel.name,
+                func.coalesce(stats.c.item_count, 0).label("item_count"),
+                func.coalesce(stats.c.tag_count, 0).label("tag_count"),
+                func.coalesce(stats.c.link_count, 0).label("link_count"),
+                stats.c.min_price,
+                stats.c.max_price,
+                stats.c.avg_price,
+            )
+            .outerjoin(stats, stats.c.store_id == StoreModel.id)
+            .filter(StoreModel.id.in_(store_ids))
+            .order_by(StoreModel.id)
+        )
+
+    def tag_usage(self, store_id):
+        """Number of items of each tag of a store"""
+        return db.session.execute(
+            select(
+                TagModel.id,
+                TagModel.name,
+                func.count(ItemsTagsModel.id).label("item_count")
+            )
+            .outerjoin(ItemsTagsModel, ItemsTagsModel.tag_id == TagModel.id)
+            .where(TagModel.store_id == store_id)
+            .group_by(TagModel.id, TagModel.name)
+            .order_by(TagModel.id)
+        ).all()
+
+    def refresh(self, store_ids):
+        """Recomputes the summary rows of the given stores"""
+        for chunk in chunks(set(store_ids)):
+            db.session.execute(
+                delete(StoreStatsModel).where(StoreStatsModel.store_id.in_(chunk)))
+            db.session.execute(
+                insert(StoreStatsModel).from_select(
+                    SUMMARY_COLUMNS, aggregates_select(chunk))
+            )
+
+    def rebuild(self):
+        """Recomputes the summary rows of every store, returns their number"""
+        store_ids = db.session.scalars(select(StoreModel.id)).all()
+        db.session.execute(delete(StoreStatsModel))
+        self.refresh(store_ids)
+        return len(store_ids)
+
+
+store_stats = StoreStats()
+
+
+def mark_changed(store_ids):
+    """Schedules the summary of the given stores to be recomputed when the
+    current transaction commits"""
+    if store_stats.summary:
+        db.session.info.setdefault(CHANGED_STORES, set()).update(store_ids)
+
+
+@event.listens_for(Session, "before_commit")
+def refresh_changed_stores(session):
+    """Recomputes the summary of the stores changed by the transaction, after
+    its last changes are flushed"""
+    store_ids = session.info.pop(CHANGED_STORES, None)
+    if store_ids:
+        session.flush()
+        store_stats.refresh(store_ids)
+
+
+@event.listens_for(Session, "after_rollback")
+def forget_changed_stores(session):
+    """Drops the stores marked by a rolled back transaction"""
+    session.info.pop(CHANGED_STORES, None)
@@ -0,0 +1,38 @@
+"""Streamed (NDJSON) responses for large collections"""
+from itertools import islice
+
+from flask import Response, current_app, request, stream_with_context
+
+NDJSON_MIMETYPE = "application/x-ndjson"
+STREAM_CHUNK_SIZE = 1000
+
+
+def wants_stream(query_args) -> bool:
+    """Whether the client asked for a streamed response, either with
+    `?stream=1` or with `Accept: application/x-ndjson`"""
+    if query_args.get("stream"):
+        return True
+    best = request.accept_mimetypes.best_match(["application/json", NDJSON_MIMETYPE])
+    return best == NDJSON_MIMETYPE
+
+
+def stream_response(query, id_column, schema, chunk_size=STREAM_CHUNK_SIZE):
+    """Streams every row of `query` as newline delimited JSON.
+
+    Rows are fetched from the database `chunk_size` at a time and dumped with
+    `schema` chunk by chunk, so memory use doesn't grow with the result size.
+    """
+    rows = iter(query.order_by(id_column).yield_per(chunk_size))
+
+    def generate():
+        dumps = current_app.json.dumps
+        separators = (",", ":")
+        while True:
+            chunk = list(islice(rows, chunk_size))
+            if not chunk:
+                break
+            yield "".join(
+                dumps(row, separators=separators) + "\n" for row in schema.dump(chunk, many=True)
+            )
+
+    return Response(stream_with_context(generate()), mimetype=NDJSON_MIMETYPE)
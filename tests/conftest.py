@@ -0,0 +1,34 @@
+"""Fixtures"""
+import pytest
+from flask_jwt_extended import create_access_token
+
+from app import create_app
+from tokens import ADMIN, role_claims
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    """Path of the SQLite database of the app"""
+    return tmp_path / "data.db"
+
+
+@pytest.fixture
+def app(db_path, monkeypatch):
+    """App on a fresh SQLite database"""
+    monkeypatch.setenv("RATE_LIMIT_ENABLED", "0")
+    return create_app(f"sqlite:///{db_path}")
+
+
+@pytest.fixture
+def client(app):
+    """Test client of the app"""
+    return app.test_client()
+
+
+@pytest.fixture
+def admin_headers(app):
+    """Authorization header of an admin"""
+    with app.app_context():
+        token = create_access_token(
+            identity="1", fresh=True, additional_claims=role_claims(ADMIN))
+    return {"Authorization": f"Bearer {token}"}
@@ -0,0 +1,64 @@
+"""Token blocklist tests"""
+import pytest
+from flask_jwt_extended import decode_token
+
+from app import create_app
+from blocklist import blocklist
+
+
+@pytest.fixture(params=["sql", "kv"])
+def app(request, db_path, monkeypatch):
+    """App with each blocklist backend"""
+    monkeypatch.setenv("RATE_LIMIT_ENABLED", "0")
+    monkeypatch.setenv("BLOCKLIST_BACKEND", request.param)
+    return create_app(f"sqlite:///{db_path}")
+
+
+def log_in(client):
+    """Registers a user and returns its tokens"""
+    client.post("/register", json={"username": "user1", "password": "password1"})
+    return client.post(
+        "/login", json={"username": "user1", "password": "password1"}).json
+
+
+def bearer(token):
+    """Authorization header of a token"""
+    return {"Authorization": f"Bearer {token}"}
+
+
+def test_logged_out_token_is_rejected(client):
+    """A token can't be used after logging out with it"""
+    tokens = log_in(client)
+    headers = bearer(tokens["access_token"])
+    assert client.get("/tokens/stats", headers=headers).status_code == 200
+    assert client.post("/logout", headers=headers).status_code == 204
+    assert client.get("/tokens/stats", headers=headers).status_code == 401
+
+
+def test_refresh_token_works_once(client):
+    """A refresh token is revoked by its first refresh"""
+    headers = bearer(log_in(client)["refresh_token"])
+    assert client.post("/refresh", headers=headers).status_code == 200
+    assert client.post("/refresh", headers=headers).status_code == 401
+
+
+def test_refresh_token_revoked_by_other_worker(app, client):
+    """Refresh tokens found not revoked aren't cached, a refresh done in
+    another worker is seen right away"""
+    refresh_token = log_in(client)["refresh_token"]
+    with app.app_context():
+        payload = decode_token(refresh_token)
+        assert blocklist.is_revoked(payload) is False
+        # Another worker refreshes, it only shares the backend
+        assert blocklist.backend.add(payload["jti"], payload["exp"])
+        assert blocklist.is_revoked(payload) is True
+    assert client.post("/refresh", headers=bearer(refresh_token)).status_code == 401
+
+
+def test_revoke_is_atomic_in_backend(app):
+    """Revoking reports whether the token was already revoked"""
+    with app.app_context():
+        assert blocklist.backend.add("jti1", 2**31) is True
+        assert blocklist.backend.add("jti1", 2**31) is False
+        assert blocklist.backend.contains("jti1")
+        assert not blocklist.backend.contains("jti2")
@@ -0,0 +1,37 @@
+"""Conditional request tests"""
+import pytest
+
+from app import create_app
+
+
+@pytest.fixture
+def app(db_path, monkeypatch):
+    """App compressing every response"""
+    monkeypatch.setenv("RATE_LIMIT_ENABLED", "0")
+    monkeypatch.setenv("COMPRESSION_MIN_SIZE", "0")
+    return create_app(f"sqlite:///{db_path}")
+
+
+def test_not_modified_has_etag_of_compressed_representation(client, admin_headers):
+    """A 304 to a client with the gzipped representation has its ETag"""
+    store_id = client.post(
+        "/stores", json={"name": "store1"}, headers=admin_headers).json["id"]
+    url = f"/stores/{store_id}"
+    headers = {**admin_headers, "Accept-Encoding": "gzip"}
+
+    response = client.get(url, headers=headers)
+    assert response.headers["Content-Encoding"] == "gzip"
+    etag = response.get_etag()[0]
+    assert etag.endswith("-gzip")
+
+    cached = client.get(url, headers={**headers, "If-None-Match": f'"{etag}"'})
+    assert cached.status_code == 304
+    assert cached.get_etag()[0] == etag
+    assert "Accept-Encoding" in cached.vary
+
+    plain = client.get(
+        url,
+        headers={**admin_headers, "If-None-Match": f'"{etag.removesuffix("-gzip")}"'}
+    )
+    assert plain.status_code == 304
+    assert plain.get_etag()[0] == etag.removesuffix("-gzip")
@@ -0,0 +1,17 @@
+"""Sparse fieldset tests"""
+from types import SimpleNamespace
+
+from schemas import ItemSchema, PlainStoreSchema
+from serializers import SparseResult
+
+
+def test_field_selection_only_applies_to_its_result(app):
+    """Other dumps of the request, before or after, dump every field"""
+    store = SimpleNamespace(id=1, name="store1")
+    item = SimpleNamespace(
+        id=1, name="item1", description=None, price=1.5, store=store, tags=[])
+
+    with app.test_request_context():
+        assert PlainStoreSchema().dump(store) == {"id": 1, "name": "store1"}
+        assert ItemSchema().dump(SparseResult(item, {"name"})) == {"name": "item1"}
+        assert ItemSchema().dump(item)["store"] == {"id": 1, "name": "store1"}
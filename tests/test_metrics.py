@@ -0,0 +1,63 @@
+"""Request metrics tests"""
+import json
+
+import pytest
+
+from app import create_app
+
+TOKEN = "metrics-token"
+
+
+@pytest.fixture
+def metrics_dir(tmp_path):
+    """Directory shared by the workers"""
+    return tmp_path / "metrics"
+
+
+@pytest.fixture
+def app(db_path, metrics_dir, monkeypatch):
+    """App sharing its metrics with other workers"""
+    monkeypatch.setenv("RATE_LIMIT_ENABLED", "0")
+    monkeypatch.setenv("METRICS_TOKEN", TOKEN)
+    monkeypatch.setenv("METRICS_DIR", str(metrics_dir))
+    return create_app(f"sqlite:///{db_path}")
+
+
+def scrape(client):
+    """Metrics, by sample name and labels"""
+    response = client.get("/metrics", headers={"Authorization": f"Bearer {TOKEN}"})
+    assert response.status_code == 200
+    return dict(
+        line.rsplit(" ", 1)
+        for line in response.text.splitlines() if not line.startswith("#")
+    )
+
+
+def test_metrics_add_up_every_worker(client, metrics_dir):
+    """A scrape counts the requests of the workers that wrote to METRICS_DIR"""
+    client.get("/users/1")
+    sample = 'http_responses_total{method="GET",route="/users/<int:user_id>",status="404"}'
+    count = int(scrape(client)[sample])
+
+    # Another worker served three of them
+    (metrics_dir / "1.json").write_text(json.dumps({
+        "buckets": [["GET", "/users/<int:user_id>", [3] + [0] * 11]],
+        "sums": [["GET", "/users/<int:user_id>", 0.003]],
+        "responses": [["GET", "/users/<int:user_id>", 404, 3]],
+        "phase_sums": [],
+    }))
+    assert int(scrape(client)[sample]) == count + 3
+
+
+def test_metrics_need_token(client):
+    """Scrapes without METRICS_TOKEN are rejected"""
+    assert client.get("/metrics").status_code == 401
+    assert client.get(
+        "/metrics", headers={"Authorization": "Bearer other"}).status_code == 401
+
+
+def test_metrics_not_served_without_token(db_path, monkeypatch):
+    """/metrics is off until a METRICS_TOKEN is set"""
+    monkeypatch.delenv("METRICS_TOKEN", raising=False)
+    client = create_app(f"sqlite:///{db_path}").test_client()
+    assert client.get("/metrics").status_code == 404
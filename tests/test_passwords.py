@@ -0,0 +1,29 @@
+"""Password hashing tests"""
+from passwords import password_hasher
+
+
+def test_inline_hashing_is_counted(client, admin_headers):
+    """Hashes run inline by default still go through the concurrency limit"""
+    assert password_hasher.workers == 0
+    completed = password_hasher.completed
+    client.post("/register", json={"username": "user1", "password": "password1"})
+    client.post("/login", json={"username": "user1", "password": "password1"})
+
+    stats = client.get("/passwords/stats", headers=admin_headers).json
+    assert stats["completed"] == completed + 2
+    assert stats["max_pending_seen"] >= 1
+    assert stats["pending"] == 0
+
+
+def test_inline_hashing_is_rejected_without_slot(client):
+    """A hash that doesn't get a slot in time gets a 503"""
+    password_hasher.queue_timeout = 0
+    rejected = password_hasher.rejected
+    assert password_hasher._slots.acquire()  # pylint: disable=protected-access
+    try:
+        response = client.post(
+            "/register", json={"username": "user1", "password": "password1"})
+    finally:
+        password_hasher._slots.release()  # pylint: disable=protected-access
+    assert response.status_code == 503
+    assert password_hasher.rejected == rejected + 1
@@ -0,0 +1,55 @@
+"""Rate limiting tests"""
+import pytest
+
+from app import create_app
+
+
+@pytest.fixture
+def app(db_path, monkeypatch):
+    """App with rate limiting"""
+    monkeypatch.setenv("RATE_LIMIT_ENABLED", "1")
+    return create_app(f"sqlite:///{db_path}")
+
+
+def test_pages_do_not_spend_expensive_budget(client, admin_headers):
+    """Walking the pages of a collection leaves bulk writes their budget"""
+    store_id = client.post(
+        "/stores", json={"name": "store1"}, headers=admin_headers).json["id"]
+    for _ in range(11):
+        assert client.get("/stores?limit=1", headers=admin_headers).status_code == 200
+
+    response = client.post(
+        "/items/bulk",
+        json=[{"name": "item1", "price": 1.5, "store_id": store_id}],
+        headers=admin_headers
+    )
+    assert response.status_code != 429
+
+
+def test_streams_spend_expensive_budget(client, admin_headers):
+    """Streamed collection reads are limited like other expensive requests"""
+    statuses = [
+        client.get("/stores?stream=1", headers=admin_headers).status_code
+        for _ in range(11)
+    ]
+    assert statuses[:10] == [200] * 10
+    assert statuses[10] == 429
+
+
+def test_anonymous_clients_behind_proxy_have_own_buckets(db_path, monkeypatch):
+    """With a trusted proxy the address comes from X-Forwarded-For"""
+    monkeypatch.setenv("RATE_LIMIT_ENABLED", "1")
+    monkeypatch.setenv("RATE_LIMITS", "auth=1/60")
+    monkeypatch.setenv("TRUSTED_PROXIES", "1")
+    client = create_app(f"sqlite:///{db_path}").test_client()
+
+    def login(address):
+        return client.post(
+            "/login",
+            json={"username": "user1", "password": "password1"},
+            headers={"X-Forwarded-For": address}
+        ).status_code
+
+    assert login("192.0.2.1") != 429
+    assert login("192.0.2.1") == 429
+    assert login("192.0.2.2") != 429
@@ -0,0 +1,60 @@
+"""Response cache tests"""
+import sqlite3
+
+from cache import CACHE_HEADER
+
+
+def test_cached_body_is_not_served_after_write_by_other_worker(
+        client, admin_headers, db_path):
+    """A write committed by another worker, which can't invalidate this
+    worker's cache, changes the version and so the cache key"""
+    store_id = client.post(
+        "/stores", json={"name": "store1"}, headers=admin_headers).json["id"]
+    url = f"/stores/{store_id}/tags"
+
+    first = client.get(url, headers=admin_headers)
+    assert first.headers[CACHE_HEADER] == "MISS"
+    assert client.get(url, headers=admin_headers).headers[CACHE_HEADER] == "HIT"
+
+    # Another worker adds a tag, touching the store version
+    with sqlite3.connect(db_path) as connection:
+        connection.execute(
+            "INSERT INTO tags (name, store_id) VALUES ('tag1', ?)", (store_id,))
+        connection.execute(
+            "UPDATE stores SET version = 'other-worker' WHERE id = ?", (store_id,))
+
+    second = client.get(url, headers=admin_headers)
+    assert second.headers[CACHE_HEADER] == "MISS"
+    assert [tag["name"] for tag in second.json] == ["tag1"]
+    assert second.get_etag() != first.get_etag()
+
+    stale = client.get(
+        url, headers={**admin_headers, "If-None-Match": f'"{first.get_etag()[0]}"'})
+    assert stale.status_code == 200
+    assert [tag["name"] for tag in stale.json] == ["tag1"]
+
+    fresh = client.get(
+        url, headers={**admin_headers, "If-None-Match": f'"{second.get_etag()[0]}"'})
+    assert fresh.status_code == 304
+
+
+def test_write_changes_cache_key(client, admin_headers):
+    """A write through the API is seen by the next read without invalidating
+    the cached response"""
+    store_id = client.post(
+        "/stores", json={"name": "store1"}, headers=admin_headers).json["id"]
+    item_id = client.post(
+        "/items",
+        json={"name": "item1", "price": 1.5, "store_id": store_id},
+        headers=admin_headers
+    ).json["id"]
+    url = f"/items/{item_id}"
+
+    assert client.get(url, headers=admin_headers).headers[CACHE_HEADER] == "MISS"
+    assert client.get(url, headers=admin_headers).headers[CACHE_HEADER] == "HIT"
+
+    client.put(url, json={"name": "item2", "price": 1.5}, headers=admin_headers)
+
+    response = client.get(url, headers=admin_headers)
+    assert response.headers[CACHE_HEADER] == "MISS"
+    assert response.json["name"] == "item2"
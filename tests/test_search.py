@@ -0,0 +1,80 @@
+"""Search index tests"""
+import time
+
+import pytest
+
+import search
+from app import create_app
+from search import MemoryBackend, MemoryIndex, search_index
+
+
+@pytest.fixture
+def app(db_path, monkeypatch):
+    """App searching with the memory index"""
+    monkeypatch.setenv("RATE_LIMIT_ENABLED", "0")
+    monkeypatch.setenv("SEARCH_BACKEND", "memory")
+    return create_app(f"sqlite:///{db_path}")
+
+
+def test_memory_index_keeps_words_sorted_across_writes():
+    """Words added and removed by writes keep prefix searches working"""
+    index = MemoryIndex()
+
+    index.apply({
+        ("item", 1): ("item", 1, 1, "red apple", None),
+        ("item", 2): ("item", 2, 1, "green pear", "apple shaped"),
+    }, ())
+    index.apply({("tag", 1): ("tag", 1, 1, "fruit", None)}, [("item", 1)])
+
+    assert index.words == sorted(index.postings)
+    assert "red" not in index.words
+    assert index.prefixed("app") == {("item", 2)}
+    assert index.prefixed("fr") == {("tag", 1)}
+
+
+def test_changes_during_rebuild_are_kept(app, monkeypatch):
+    """A change committed while a rebuild reads the tables reaches the new
+    index"""
+    backend = search_index.backend
+    read_tables = search.all_documents
+
+    def all_documents():
+        yield from read_tables()
+        backend.apply({("tag", 1): ("tag", 1, 1, "fruit", None)}, ())
+
+    monkeypatch.setattr(search, "all_documents", all_documents)
+    with app.app_context():
+        backend.rebuild()
+    assert backend.index.prefixed("fr") == {("tag", 1)}
+
+
+def test_stale_index_is_rebuilt_in_background(app, client, admin_headers, monkeypatch):
+    """Searches keep using the current index while it's rebuilt"""
+    backend: MemoryBackend = search_index.backend
+    store_id = client.post(
+        "/stores", json={"name": "store1"}, headers=admin_headers).json["id"]
+    client.post(
+        f"/stores/{store_id}/tags", json={"name": "fruit"}, headers=admin_headers)
+    with app.test_request_context():
+        index = backend.current_index()
+
+    # Another worker writes a tag, and the index gets old
+    index.apply({("tag", 99): ("tag", 99, store_id, "frozen", None)}, ())
+    backend.built_at -= backend.ttl + 1
+    read_tables = search.all_documents
+    reads = []
+
+    def all_documents():
+        reads.append(True)
+        time.sleep(0.2)
+        yield from read_tables()
+
+    monkeypatch.setattr(search, "all_documents", all_documents)
+    with app.test_request_context():
+        assert backend.current_index() is index
+
+    deadline = time.monotonic() + 5
+    while backend.index is index and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert reads == [True]
+    assert backend.index.prefixed("fr") == {("tag", 1)}
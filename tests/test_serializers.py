@@ -0,0 +1,24 @@
+"""JSON encoding tests"""
+import random
+
+from flask.json.provider import DefaultJSONProvider
+
+from serializers import COMPACT_SEPARATORS, OrjsonProvider
+
+
+def test_orjson_output_is_the_default_providers(app):
+    """Floats of every magnitude are written like the default provider does"""
+    rng = random.Random(0)
+    floats = [
+        rng.uniform(1, 10) * 10.0 ** exponent * rng.choice((1, -1))
+        for exponent in range(-12, 20) for _ in range(10)
+    ]
+    documents = [
+        {"score": value, "name": "item1", "ids": [1, 2]} for value in floats
+    ] + [{"name": "1e5 and 0.00001"}, {"name": "héllo"}, {"price": None}]
+
+    orjson_provider = OrjsonProvider(app)
+    default_provider = DefaultJSONProvider(app)
+    for document in documents:
+        assert orjson_provider.dumps(document, separators=COMPACT_SEPARATORS) == (
+            default_provider.dumps(document, separators=COMPACT_SEPARATORS))
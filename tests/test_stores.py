@@ -0,0 +1,39 @@
+"""Store deletion tests"""
+import pytest
+
+from app import create_app
+
+
+def create_store(client, headers):
+    """Store with an item and a tag, returns its id"""
+    store_id = client.post(
+        "/stores", json={"name": "store1"}, headers=headers).json["id"]
+    client.post(
+        "/items",
+        json={"name": "apple", "price": 1.5, "store_id": store_id},
+        headers=headers
+    )
+    client.post(f"/stores/{store_id}/tags", json={"name": "apricot"}, headers=headers)
+    return store_id
+
+
+@pytest.mark.parametrize("backend", ["fts5", "memory"])
+def test_delete_store_drops_its_search_documents(
+        db_path, monkeypatch, backend, admin_headers):
+    """The items and tags of a deleted store are no longer found"""
+    monkeypatch.setenv("SEARCH_BACKEND", backend)
+    client = create_app(f"sqlite:///{db_path}").test_client()
+    store_id = create_store(client, admin_headers)
+    assert len(client.get("/search?q=ap", headers=admin_headers).json) == 2
+
+    assert client.delete(f"/stores/{store_id}", headers=admin_headers).status_code == 204
+    assert client.get("/search?q=ap", headers=admin_headers).json == []
+
+
+def test_delete_store_inline_without_shared_job_status(client, admin_headers):
+    """Without JOBS_KV_URL other workers couldn't report the job"""
+    store_id = create_store(client, admin_headers)
+    response = client.delete(
+        f"/stores/{store_id}?background=true", headers=admin_headers)
+    assert response.status_code == 204
+    assert client.get(f"/stores/{store_id}", headers=admin_headers).status_code == 404
@@ -0,0 +1,56 @@
+"""Tag linking tests"""
+import sqlite3
+
+from sqlalchemy import event
+
+from db import db
+
+
+def create_links(client, headers):
+    """Store with an item and two tags, returns the bulk link request"""
+    store_id = client.post(
+        "/stores", json={"name": "store1"}, headers=headers).json["id"]
+    item_id = client.post(
+        "/items",
+        json={"name": "apple", "price": 1.5, "store_id": store_id},
+        headers=headers
+    ).json["id"]
+    tag_ids = [
+        client.post(
+            f"/stores/{store_id}/tags", json={"name": name}, headers=headers
+        ).json["id"]
+        for name in ("fruit", "red")
+    ]
+    return {"links": [{"item_id": item_id, "tag_id": tag_id} for tag_id in tag_ids]}
+
+
+def test_bulk_link_skips_pairs_linked_concurrently(app, client, admin_headers, db_path):
+    """A pair linked by another request after the links were read is skipped
+    rather than failing the request"""
+    links = create_links(client, admin_headers)
+    first = links["links"][0]
+
+    inserts = []
+
+    def link_from_other_worker(conn, cursor, statement, *args):
+        if statement.startswith("INSERT INTO items_tags") and not inserts:
+            inserts.append(statement)
+            with sqlite3.connect(db_path) as connection:
+                connection.execute(
+                    "INSERT INTO items_tags (item_id, tag_id) VALUES (?, ?)",
+                    (first["item_id"], first["tag_id"])
+                )
+
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, "before_cursor_execute", link_from_other_worker)
+
+    try:
+        response = client.post("/items/tags", json=links, headers=admin_headers)
+    finally:
+        event.remove(engine, "before_cursor_execute", link_from_other_worker)
+    assert response.status_code == 200
+    assert response.json == {"linked": 1}
+
+    tags = client.get(f"/items/{first['item_id']}", headers=admin_headers).json["tags"]
+    assert sorted(tag["name"] for tag in tags) == ["fruit", "red"]
@@ -0,0 +1,75 @@
+"""Role claim and token cache tests"""
+import time
+
+import pytest
+from flask_jwt_extended import create_access_token
+
+from tokens import ADMIN, ADMIN_PERMISSION, USER, token_cache, token_permissions
+
+
+def log_in(client, username):
+    """Registers a user and returns its tokens"""
+    client.post("/register", json={"username": username, "password": "password1"})
+    return client.post(
+        "/login", json={"username": username, "password": "password1"}).json
+
+
+def bearer(token):
+    """Authorization header of a token"""
+    return {"Authorization": f"Bearer {token}"}
+
+
+def test_refresh_reads_role_again(app, client):
+    """A demoted admin doesn't get admin tokens from /refresh"""
+    tokens = log_in(client, "user1")
+    assert client.get(
+        "/tokens/stats", headers=bearer(tokens["access_token"])).status_code == 200
+
+    result = app.test_cli_runner().invoke(args=["set-role", "user1", USER])
+    assert result.exit_code == 0
+
+    refreshed = client.post("/refresh", headers=bearer(tokens["refresh_token"])).json
+    assert client.get(
+        "/tokens/stats", headers=bearer(refreshed["access_token"])).status_code == 403
+
+
+def test_user_role_is_not_public(client):
+    """Anyone can read a user, not whether it's an admin"""
+    log_in(client, "user1")
+    assert "role" not in client.get("/users/1").json
+
+
+def test_tokens_before_roles_use_is_admin():
+    """Tokens with only the legacy `is_admin` claim keep their permissions"""
+    assert token_permissions({"is_admin": True}) == {ADMIN_PERMISSION}
+    assert token_permissions({"is_admin": False}) == frozenset()
+    assert token_permissions({"role": ADMIN, "permissions": []}) == frozenset()
+
+
+def test_legacy_admin_token_is_authorized(app, client):
+    """`admin_required` accepts a token made before roles"""
+    with app.app_context():
+        admin = create_access_token(identity="1", additional_claims={"is_admin": True})
+        user = create_access_token(identity="2", additional_claims={"is_admin": False})
+    assert client.get("/tokens/stats", headers=bearer(admin)).status_code == 200
+    assert client.get("/tokens/stats", headers=bearer(user)).status_code == 403
+
+
+@pytest.mark.usefixtures("app")
+def test_verified_tokens_are_memoized_until_they_expire():
+    """A token is decoded once, and again after it expires"""
+    decoded = []
+
+    def decode(encoded_token, csrf_value, allow_expired):
+        decoded.append(encoded_token)
+        return {"jti": "1", "exp": expires_at}
+
+    expires_at = time.time() + 60
+    assert token_cache.decode(decode, "token1") == {"jti": "1", "exp": expires_at}
+    token_cache.decode(decode, "token1")
+    assert decoded == ["token1"]
+
+    expires_at = time.time() - 1
+    token_cache.decode(decode, "token2")
+    token_cache.decode(decode, "token2")
+    assert decoded == ["token1", "token2", "token2"]
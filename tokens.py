@@ -0,0 +1,138 @@
+"""Role claims and per worker caches of verified tokens.
+
+Each user has a role (`users.role`). At log in it's resolved into the
+permissions it grants and both are embedded in the tokens, as the `role` and
+`permissions` claims, so authorizing a request never reads the user from the
+database. Role changes (`flask set-role`) apply from the next log in or
+`/refresh`, which reads the role again, so within the lifetime of an access
+token.
+
+Each worker memoizes, until the token expires:
+
+- The payload of every verified token, by encoded token, so a client reusing
+  its token skips the signature check and claims parsing
+- The permission set of each `jti`
+
+`TOKEN_CACHE_SIZE` (default 10000) bounds both, 0 disables them.
+"""
+import os
+
+import click
+from flask_jwt_extended import JWTManager
+from sqlalchemy import select
+
+from cache import LRUCache
+from db import db
+from models import UserModel
+
+ADMIN = "admin"
+USER = "user"
+
+# Permission checked by `admin_required`
+ADMIN_PERMISSION = "admin"
+
+# Permissions granted by each role
+ROLE_PERMISSIONS = {
+    ADMIN: frozenset({ADMIN_PERMISSION}),
+    USER: frozenset(),
+}
+
+
+def role_claims(role) -> dict:
+    """Claims of the tokens of a user with `role`"""
+    permissions = ROLE_PERMISSIONS[role]
+    return {
+        "role": role,
+        "permissions": sorted(permissions),
+        "is_admin": ADMIN_PERMISSION in permissions,
+    }
+
+
+def token_role(jwt_payload) -> str:
+    """Role in a token payload. Tokens issued before roles only have
+    `is_admin`."""
+    return jwt_payload.get("role") or (ADMIN if jwt_payload.get("is_admin") else USER)
+
+
+def token_permissions(jwt_payload) -> frozenset:
+    """Permissions in a token payload"""
+    if "permissions" in jwt_payload:
+        return frozenset(jwt_payload["permissions"])
+    return ROLE_PERMISSIONS[token_role(jwt_payload)]
+
+
+class TokenCache:
+    """Verified token payloads and permission sets of this worker"""
+
+    def __init__(self):
+        self.enabled = False
+        self.verified = LRUCache()
+        self.permissions = LRUCache()
+
+    def init_app(self, app):
+        """Configures the caches from the app config and registers the
+        `flask set-role` command"""
+        app.config.setdefault(
+            "TOKEN_CACHE_SIZE", int(os.getenv("TOKEN_CACHE_SIZE", "10000")))
+
+        self.enabled = app.config["TOKEN_CACHE_SIZE"] > 0
+        self.verified = LRUCache(app.config["TOKEN_CACHE_SIZE"])
+        self.permissions = LRUCache(app.config["TOKEN_CACHE_SIZE"])
+
+        @app.cli.command("set-role")
+        @click.argument("username")
+        @click.argument("role", type=click.Choice(list(ROLE_PERMISSIONS)))
+        def set_role(username, role):
+            """Set the role of a user, applied from their next log in or
+            token refresh"""
+            user = db.session.scalar(
+                select(UserModel).where(UserModel.username == username))
+            if user is None:
+                raise click.ClickException(f"No user named {username}")
+            user.role = role
+            db.session.commit()
+            print(f"{username} is now {role}")
+
+    def stats(self):
+        """Hit and miss counters"""
+        return {
+            "verified_hits": self.verified.hits,
+            "verified_misses": self.verified.misses,
+            "permission_hits": self.permissions.hits,
+            "permission_misses": self.permissions.misses,
+            "size": len(self.verified),
+        }
+
+    def decode(self, decode, encoded_token, csrf_value=None, allow_expired=False):
+        """Payload of a token verified by `decode`, memoized until it expires"""
+        if not self.enabled or csrf_value is not None or allow_expired:
+            return decode(encoded_token, csrf_value, allow_expired)
+
+        payload = self.verified.get(encoded_token)
+        if payload is None:
+            payload = decode(encoded_token, csrf_value, allow_expired)
+            if "exp" in payload:
+                self.verified.set(encoded_token, payload, payload["exp"])
+        # flask-jwt-extended keeps it per request, don't share the cached dict
+        return dict(payload)
+
+    def token_permissions(self, jwt_payload) -> frozenset:
+        """Permissions of a verified token, cached by `jti`"""
+        jti = jwt_payload["jti"]
+        permissions = self.permissions.get(jti)
+        if permissions is None:
+            permissions = token_permissions(jwt_payload)
+            if self.enabled and "exp" in jwt_payload:
+                self.permissions.set(jti, permissions, jwt_payload["exp"])
+        return permissions
+
+
+token_cache = TokenCache()
+
+
+class CachingJWTManager(JWTManager):
+    """JWTManager memoizing verified tokens in `token_cache`"""
+
+    def _decode_jwt_from_config(self, encoded_token, csrf_value=None, allow_expired=False):
+        return token_cache.decode(
+            super()._decode_jwt_from_config, encoded_token, csrf_value, allow_expired)